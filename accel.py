@@ -1,53 +1,83 @@
-import threading
 import math
+import motion
+import trace
 from fortebit.polaris import accelerometer as accel
 
-_lock = threading.Lock()
+# The sampler thread is the only user of the accelerometer bus: it reads
+# samples into a preallocated block and runs the filters over the whole
+# block at once, then replaces the published snapshot. Getters only read
+# module variables, so they never block the sampler.
+
 _accel = accel.Accelerometer()
 _thread = None
 
 _ACCEL_LP_COEF = 0.25
-_ACCEL_UPDATE = 10
-_x = 0.0
-_y = 0.0
-_z = 0.0
-_peak = 0.0
+_ACCEL_UPDATE = 10      # sampling period in ms
+_ACCEL_BLOCK = 10       # samples processed at once
+_TEMP_UPDATE = 100      # temperature read period in samples
+
+_bx = [0.0] * _ACCEL_BLOCK
+_by = [0.0] * _ACCEL_BLOCK
+_bz = [0.0] * _ACCEL_BLOCK
+_n = 0
+_tcount = 0
+
+# published snapshot
+_xyz = (0.0, 0.0, 0.0)
+_temperature = 0.0
+_sigma = motion.register()
 
 _alive = 0
 _except = 0
 
-def _update():
-    _lock.acquire()
-    try:
-        global _x,_y,_z,_peak
-        a = _accel.acceleration()
-        _x = _ACCEL_LP_COEF * a[0] + (1-_ACCEL_LP_COEF) * _x
-        _y = _ACCEL_LP_COEF * a[1] + (1-_ACCEL_LP_COEF) * _y
-        _z = _ACCEL_LP_COEF * a[2] + (1-_ACCEL_LP_COEF) * _z
-        #print("inc: ",_x,_y,_z,a)
+def _process():
+    global _n, _xyz
+    x, y, z = _xyz
+    for i in range(_n):
+        x = _ACCEL_LP_COEF * _bx[i] + (1-_ACCEL_LP_COEF) * x
+        y = _ACCEL_LP_COEF * _by[i] + (1-_ACCEL_LP_COEF) * y
+        z = _ACCEL_LP_COEF * _bz[i] + (1-_ACCEL_LP_COEF) * z
         # update peak diff
-        d_x = a[0] - _x
-        d_y = a[1] - _y
-        d_z = a[2] - _z
+        d_x = _bx[i] - x
+        d_y = _by[i] - y
+        d_z = _bz[i] - z
         d2 = d_x*d_x + d_y*d_y + d_z*d_z
-        if d2 > _peak:
-            _peak = d2
-    except Exception as e:
-        pass
-    _lock.release()
+        motion.sample(_bx[i], _by[i], _bz[i], d2)
+    _n = 0
+    _xyz = (x, y, z)
+    motion.end_block()
+
+def _add(a):
+    global _n
+    _bx[_n] = a[0]
+    _by[_n] = a[1]
+    _bz[_n] = a[2]
+    _n += 1
+    if _n >= _ACCEL_BLOCK:
+        _process()
+
+def _update():
+    global _tcount, _temperature
+    a = _accel.acceleration()
+    _add(a)
+    if trace.enabled:
+        trace.accel(a)
+    _tcount += 1
+    if _tcount >= _TEMP_UPDATE:
+        _tcount = 0
+        _temperature = _accel.temperature()
+        if trace.enabled:
+            trace.temp(_temperature)
 
 def _run(arg):
     global _alive, _except
     # discard initial samples (accel filters need time to stabilize)
-    _lock.acquire()
     try:
         for n in range(15):
             sleep(10)
             _accel.acceleration()
-        _peak = 0.0
     except Exception as e:
         pass
-    _lock.release()
     # refresh
     while True:
         try:
@@ -57,35 +87,32 @@ def _run(arg):
             _except = _except + 1
         sleep(_ACCEL_UPDATE)
         _alive = _alive + 1
-    
+
 def get_pitchroll():
-    _lock.acquire()
-    tmp = math.sqrt(_y*_y + _z*_z);
-    pitch = math.degrees(math.atan2(-_x, tmp))
-    roll = math.degrees(math.atan2(_y, _z))
-    _lock.release()
+    x, y, z = _xyz
+    tmp = math.sqrt(y*y + z*z);
+    pitch = math.degrees(math.atan2(-x, tmp))
+    roll = math.degrees(math.atan2(y, z))
     return (pitch, roll)
 
 def get_temperature():
-    _lock.acquire()
-    t = _accel.temperature()
-    _lock.release()
-    return t
+    return _temperature
 
 def get_sigma():
-    _lock.acquire()
-    sigma = math.sqrt(_peak)
-    _peak = 0.0
-    _lock.release()
-    return sigma
-    
+    return motion.read(_sigma)[0]
+
+def stats():
+    """Returns (sampler loops, sampler exceptions)"""
+    return (_alive, _except)
+
 def start():
-    _lock.acquire()
+    global _thread, _xyz, _temperature
+    if _thread is not None:
+        return
     try:
-        if _thread is None:
-            _thread = thread(_run,"Accel Task")
-        global _x,_y,_z
-        (_x,_y,_z) = _accel.acceleration()
+        a = _accel.acceleration()
+        _xyz = (a[0], a[1], a[2])
+        _temperature = _accel.temperature()
     except Exception as e:
         pass
-    _lock.release()
+    _thread = thread(_run,"Accel Task")
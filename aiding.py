@@ -0,0 +1,84 @@
+# GNSS aiding data kept across resets.
+#
+# The last good fix and its time are saved in settings when the position
+# changes, at most every _SAVE_PERIOD, and before controlled resets or when
+# the ignition goes off. After a reset the saved position is injected into
+# the receiver together with the current time from the modem, using the
+# PMTK741 aiding sentence of the Quectel L76, so that it skips the cold
+# start search. The modem RTC holds a default date until the network sets
+# it, so the time is only valid after registration. Positions older than
+# _MAX_AGE are not used, the vehicle may have been moved meanwhile.
+
+import settings
+import timestamp
+import track
+
+_KEY = "gnss"
+_SAVE_PERIOD = 1800     # s between saves of a changing position
+_MAX_AGE = 43200        # s, older positions are not injected
+_MIN_MOVE = 100.0       # m, smaller changes are not saved
+
+_last = None            # [lat, lon, alt, secs] of the last good fix
+_saved = None           # record in flash
+
+saves = 0
+injected = False
+
+
+def load():
+    """Reads the saved record, call once settings are loaded"""
+    global _saved, _last
+    _saved = settings.get(_KEY)
+    _last = _saved
+
+
+def update(fix, secs):
+    """Remembers a good fix taken at unix time secs"""
+    global _last
+    _last = [fix[0], fix[1], fix[2], secs]
+    if _saved is None:
+        save()
+    elif secs - _saved[3] >= _MAX_AGE // 2:
+        # keep the record of a parked vehicle from expiring
+        save()
+    elif secs - _saved[3] >= _SAVE_PERIOD and track.distance(fix[0], fix[1], _saved[0], _saved[1]) >= _MIN_MOVE:
+        save()
+
+
+def save():
+    """Writes the last fix to flash if it is newer than the saved one"""
+    global _saved, saves
+    if _last is None or _last is _saved:
+        return
+    settings.set(_KEY, _last)
+    settings.commit()
+    _saved = _last
+    saves += 1
+
+
+def _sentence(body):
+    cs = 0
+    for c in bytes(body):
+        cs ^= c
+    return "$%s*%02X\r\n" % (body, cs)
+
+
+def valid_time(tm):
+    """Returns True if the date/time tm was set, not the RTC default"""
+    return tm is not None and tm[0] >= 2019
+
+
+def inject(gnss, tm):
+    """Sends the saved position and the current date/time tm to the receiver,
+    returns True if it was sent"""
+    global injected
+    if _saved is None or not valid_time(tm):
+        return False
+    age = timestamp.to_unix(tm) - _saved[3]
+    if age < 0 or age > _MAX_AGE:
+        print("GNSS aiding expired:", age)
+        return False
+    gnss.send(_sentence("PMTK741,%.6f,%.6f,%d,%04d,%02d,%02d,%02d,%02d,%02d" %
+                        (_saved[0], _saved[1], int(_saved[2]), tm[0], tm[1], tm[2], tm[3], tm[4], tm[5])))
+    injected = True
+    return True
@@ -0,0 +1,105 @@
+# Priority lane for SOS and ignition changes.
+#
+# A high priority thread polls the two inputs at a short period and, on any
+# edge, publishes a minimal alarm message right away instead of waiting for
+# the telemetry task. Every other publish and backlog access must hold
+# `lock`, so an alarm waits at most for one message already in flight.
+# Alarms that fail are kept in RAM and retried before any backlog is resent.
+#
+# This thread is the only reader of the two inputs: the telemetry loop takes
+# `ignition` and `sos` from here and is woken by notify() on edges. The board
+# library gives no pin interrupts for the inputs, so they are polled at the
+# period of the old input loop, 5 wake-ups and 10 pin reads per second; a
+# contact bouncing for less than _PERIOD is seen as a single edge.
+
+import threading
+import timers
+import clock
+from fortebit.polaris import polaris
+
+_PERIOD = 200           # input poll period in ms, also the debounce time
+_RETRY = 1000           # unsent alarm retry period in ms
+
+lock = threading.Lock()
+
+_thread = None
+_publish = None
+_notify = None
+_pending = {}           # alarm values not sent yet
+_edge_time = 0          # time of the oldest unsent edge
+_try_time = 0
+
+ignition = None         # input levels at the last poll
+sos = None
+
+sent = 0
+polls = 0               # input poll loops, thread liveness
+latency_last = 0        # edge to publish completion of last alarm in ms
+latency_max = 0
+
+
+def pending():
+    return len(_pending) > 0
+
+
+def _send():
+    global _pending, _try_time, sent, latency_last, latency_max
+    values = _pending
+    _pending = {}
+    _try_time = timers.now()
+    lock.acquire()
+    try:
+        ok = _publish(values, clock.stamp(_edge_time))
+    except Exception as e:
+        print("Alarm publish failed", e)
+        ok = False
+    lock.release()
+    if ok:
+        sent += 1
+        latency_last = timers.now() - _edge_time
+        if latency_last > latency_max:
+            latency_max = latency_last
+        print("Alarm sent:", values, latency_last)
+    else:
+        # keep newer values if inputs changed meanwhile
+        for k in values:
+            if k not in _pending:
+                _pending[k] = values[k]
+
+
+def _run():
+    global _edge_time, polls, ignition, sos
+    while True:
+        sleep(_PERIOD)
+        polls += 1
+        edge = False
+        first = len(_pending) == 0
+        v = polaris.getEmergencyStatus()
+        if v != sos:
+            sos = v
+            _pending['sos'] = v
+            edge = True
+        v = polaris.getIgnitionStatus()
+        if v != ignition:
+            ignition = v
+            _pending['ignition'] = v
+            edge = True
+        if edge and first:
+            _edge_time = timers.now()
+        if edge and _notify is not None:
+            _notify()
+        if len(_pending) > 0 and (edge or timers.now() - _try_time >= _RETRY):
+            _send()
+
+
+def start(publish, notify=None):
+    """Starts the alarm lane, publish(values, ts) returns True when sent.
+    notify() is called on every input edge"""
+    global _thread, _publish, _notify, ignition, sos
+    if _thread is not None:
+        return
+    _publish = publish
+    _notify = notify
+    sos = polaris.getEmergencyStatus()
+    ignition = polaris.getIgnitionStatus()
+    _thread = thread(_run, prio=PRIO_HIGH)
@@ -0,0 +1,53 @@
+# Accumulates timestamped telemetry points to be published as a single message,
+# either as a list of {"ts": ts, "values": values} items (the array form of the
+# telemetry message) or as a compact encoded batch, so each point keeps its
+# own timestamp. Points are copied into a pool of records allocated by init().
+
+import record
+
+_ts = []
+_pool = []
+_n = 0
+_first = 0
+
+
+def init(size):
+    """Allocates room for size points"""
+    global _n
+    while len(_pool) < size:
+        _pool.append(record.new())
+        _ts.append(None)
+    _n = 0
+
+
+def add(ts, r, now):
+    """Appends a copy of record r taken at time ts (unix ms string)"""
+    global _first, _n
+    if _n == 0:
+        _first = now
+    if _n == len(_pool):
+        _pool.append(record.new())
+        _ts.append(None)
+    record.copy(_pool[_n], r)
+    _ts[_n] = ts
+    _n += 1
+
+
+def count():
+    return _n
+
+
+def ready(now, max_points, max_time):
+    """Returns True when max_points are collected or the oldest is max_time ms old"""
+    return _n > 0 and (_n >= max_points or now - _first >= max_time)
+
+
+def take():
+    """Returns the accumulated (ts, record) points and clears the batch.
+    The records are reused by the next add()"""
+    global _n
+    points = []
+    for i in range(_n):
+        points.append((_ts[i], _pool[i]))
+    _n = 0
+    return points
@@ -0,0 +1,112 @@
+# Unix time base derived from timers.now().
+#
+# The clock is synced occasionally from the GNSS fix time or the modem RTC
+# and then runs on the local millisecond timer, so timestamps cost no modem
+# round trip and have sub-second resolution. The local timer rate is
+# estimated over a long baseline, since sync sources have one second
+# resolution. Small errors are slewed over the next sync period so time
+# never goes backwards; large ones step the clock.
+#
+# Times are kept as seconds plus milliseconds to stay within small integers.
+
+import timers
+import timestamp
+
+_SYNC_PERIOD = 600000       # ms between syncs
+_MAX_STEP = 2000            # ms, larger errors step the clock
+_DRIFT_BASELINE = 3600000   # ms of baseline needed to estimate the rate
+_MAX_DRIFT = 0.0005         # max rate correction (500 ppm)
+_REANCHOR = 3600000         # ms, fold elapsed time into the reference
+
+synced = False
+
+_ref_local = 0              # local time of the reference
+_ref_secs = 0               # unix time of the reference
+_ref_ms = 0
+_rate = 1.0                 # true ms per local ms
+_slew = 0.0                 # temporary rate correction
+_sync_local = 0             # local time of the last sync
+_base_local = 0             # start of the drift baseline
+_base_secs = 0
+
+steps = 0
+
+
+def _at(t):
+    # (secs, ms) at local time t
+    total = _ref_ms + int((t - _ref_local) * (_rate + _slew))
+    return (_ref_secs + total // 1000, total % 1000)
+
+
+def _anchor(t, secs, ms):
+    global _ref_local, _ref_secs, _ref_ms
+    _ref_local = t
+    _ref_secs = secs
+    _ref_ms = ms
+
+
+def need_sync():
+    """Returns True when a new sync source reading is due"""
+    return not synced or timers.now() - _sync_local >= _SYNC_PERIOD
+
+
+def sync(tm):
+    """Syncs to a date/time tuple (GNSS fix time or modem RTC)"""
+    global synced, _rate, _slew, _sync_local, _base_local, _base_secs, steps
+    if tm is None or tm[0] < 2019:
+        return
+    t = timers.now()
+    secs = timestamp.to_unix(tm)
+    _sync_local = t
+    if synced:
+        p = _at(t)
+        err = (secs - p[0]) * 1000 - p[1]
+        if err <= _MAX_STEP and err >= -_MAX_STEP:
+            el = t - _base_local
+            if el >= _DRIFT_BASELINE:
+                r = (secs - _base_secs) * 1000 / el
+                if r > 1 + _MAX_DRIFT:
+                    r = 1 + _MAX_DRIFT
+                elif r < 1 - _MAX_DRIFT:
+                    r = 1 - _MAX_DRIFT
+                _rate = r
+            # spread the error over the next period
+            _anchor(t, p[0], p[1])
+            _slew = err / _SYNC_PERIOD
+            return
+        print("Clock step:", err)
+        steps += 1
+    _anchor(t, secs, 0)
+    _slew = 0.0
+    _base_local = t
+    _base_secs = secs
+    synced = True
+
+
+def now():
+    """Returns the current unix time as (secs, ms), None if not synced"""
+    global _slew
+    if not synced:
+        return None
+    t = timers.now()
+    if _slew != 0 and t - _ref_local >= _SYNC_PERIOD:
+        # error absorbed, stop slewing
+        e = _ref_local + _SYNC_PERIOD
+        p = _at(e)
+        _anchor(e, p[0], p[1])
+        _slew = 0.0
+    if t - _ref_local >= _REANCHOR:
+        p = _at(t)
+        _anchor(t, p[0], p[1])
+    return _at(t)
+
+
+def stamp(t=None):
+    """Returns the unix time in ms as a string, at local time t if given"""
+    if not synced:
+        return None
+    if t is None:
+        p = now()
+    else:
+        p = _at(t)
+    return "%d%03d" % p
@@ -0,0 +1,218 @@
+# Telemetry encoders.
+#
+# The loop collects fixed layout records (see record.py); they are converted
+# only when published, either to the JSON decimal strings used so far or to a
+# compact binary form:
+#
+#   message := version (1) | point*
+#   point   := mask | [ts] | value*
+#
+# All integers are zigzag varints. Bit 0 of the mask tells if a timestamp
+# follows, as seconds from the previous point (or from TS_EPOCH) and
+# milliseconds, so values stay within small integers. Bit n+1
+# is set for each field n of FIELDS that is present. Values are fixed point
+# integers with the field decimals; delta coded fields are sent as the
+# difference from the previous point of the same message when it had them.
+#
+# encode() writes into a buffer allocated once and reused by every message;
+# the values dict of format() and the hex string of a compact message are
+# new for each message, as the publish queue keeps them until they are sent.
+# decode() and unhexlify() have no device dependencies and run on the host too.
+
+VERSION = 1
+TS_EPOCH = 1500000000
+
+# (name, decimals, delta coded)
+FIELDS = (
+    ("latitude", 6, True),
+    ("longitude", 6, True),
+    ("speed", 1, False),
+    ("altitude", 1, True),
+    ("COG", 1, False),
+    ("nsat", 0, False),
+    ("HDOP", 2, False),
+    ("battery", 3, False),
+    ("backup", 3, False),
+    ("temperature", 2, False),
+    ("sigma", 3, False),
+    ("pitch", 1, False),
+    ("roll", 1, False),
+    ("ignition", 0, False),
+    ("sos", 0, False),
+    ("charger", 0, False),
+    ("event", 0, False),
+    ("event_g", 2, False),
+    ("jerk", 1, False),
+    ("rms", 3, False),
+    ("fence", 0, False),
+    ("fence_event", 0, False),
+    ("trip_distance", 3, False),
+    ("trip_time", 0, False),
+    ("trip_idle", 0, False),
+    ("trip_stop", 0, False),
+    ("trip_vmax", 1, False),
+    ("trip_vavg", 1, False),
+    ("odometer", 1, False),
+)
+
+_N = len(FIELDS)
+_FORMAT = []
+_SCALE = []
+for _f in FIELDS:
+    _FORMAT.append("%%.%df" % _f[1])
+    _SCALE.append(10 ** _f[1])
+
+
+def format(r):
+    """Returns the JSON values of record r: fields with decimals as strings"""
+    res = {}
+    i = 0
+    while i < _N:
+        if r[i] is not None:
+            if FIELDS[i][1] > 0:
+                res[FIELDS[i][0]] = _FORMAT[i] % r[i]
+            else:
+                res[FIELDS[i][0]] = r[i]
+        i += 1
+    return res
+
+
+def _put(buf, v):
+    # zigzag varint
+    v = (v << 1) if v >= 0 else ((-v << 1) - 1)
+    while v >= 0x80:
+        buf.append((v & 0x7F) | 0x80)
+        v >>= 7
+    buf.append(v)
+
+
+def _get(data, pos):
+    v = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        v |= (b & 0x7F) << shift
+        shift += 7
+        if b < 0x80:
+            break
+    if v & 1:
+        v = -((v + 1) >> 1)
+    else:
+        v >>= 1
+    return (v, pos)
+
+
+def _put_at(buf, pos, v):
+    # zigzag varint at pos, returns the next position
+    v = (v << 1) if v >= 0 else ((-v << 1) - 1)
+    while v >= 0x80:
+        buf[pos] = (v & 0x7F) | 0x80
+        pos += 1
+        v >>= 7
+    buf[pos] = v
+    return pos + 1
+
+
+_POINT_MAX = 5 * (len(FIELDS) + 3)      # worst case point size
+_buf = bytearray(256)
+_prev = [0] * len(FIELDS)
+
+
+def encode(points):
+    """Encodes a list of (ts, record) points, ts as unix ms string (or None).
+    Returns the message length, the message is in buffer() until the next call"""
+    _buf[0] = VERSION
+    pos = 1
+    prev_ts = TS_EPOCH
+    prev_mask = 0
+    for p in points:
+        ts = p[0]
+        r = p[1]
+        if len(_buf) - pos < _POINT_MAX:
+            _buf.extend(bytearray(len(_buf)))
+        mask = 0
+        if ts is not None:
+            mask = 1
+        i = 0
+        while i < _N:
+            if r[i] is not None:
+                mask |= 2 << i
+            i += 1
+        pos = _put_at(_buf, pos, mask)
+        if ts is not None:
+            secs = int(ts[0:-3])
+            pos = _put_at(_buf, pos, secs - prev_ts)
+            pos = _put_at(_buf, pos, int(ts[-3:]))
+            prev_ts = secs
+        i = 0
+        while i < _N:
+            if mask & (2 << i):
+                x = r[i] * _SCALE[i]
+                v = int(x + 0.5) if x >= 0 else -int(0.5 - x)
+                if FIELDS[i][2] and prev_mask & (2 << i):
+                    pos = _put_at(_buf, pos, v - _prev[i])
+                else:
+                    pos = _put_at(_buf, pos, v)
+                _prev[i] = v
+            i += 1
+        prev_mask = mask
+    return pos
+
+
+def buffer():
+    return _buf
+
+
+def decode(data):
+    """Decodes a message into a list of (ts, telemetry) points, ts in unix ms"""
+    if len(data) < 1 or data[0] != VERSION:
+        raise ValueError
+    points = []
+    pos = 1
+    prev_ts = TS_EPOCH
+    prev = [None] * len(FIELDS)
+    while pos < len(data):
+        mask, pos = _get(data, pos)
+        ts = None
+        if mask & 1:
+            d, pos = _get(data, pos)
+            ms, pos = _get(data, pos)
+            prev_ts += d
+            ts = prev_ts * 1000 + ms
+        t = {}
+        cur = [None] * len(FIELDS)
+        for i in range(len(FIELDS)):
+            if mask & (2 << i):
+                v, pos = _get(data, pos)
+                if FIELDS[i][2] and prev[i] is not None:
+                    v += prev[i]
+                cur[i] = v
+                if FIELDS[i][1] > 0:
+                    t[FIELDS[i][0]] = v / _SCALE[i]
+                else:
+                    t[FIELDS[i][0]] = v
+        prev = cur
+        points.append((ts, t))
+    return points
+
+
+_HEX = b"0123456789abcdef"
+
+
+def hexlify(data, n=-1):
+    """Returns the first n bytes of data (all by default) as a hex string"""
+    if n < 0:
+        n = len(data)
+    res = bytearray(2 * n)
+    i = 0
+    while i < n:
+        b = data[i]
+        res[2 * i] = _HEX[b >> 4]
+        res[2 * i + 1] = _HEX[b & 15]
+        i += 1
+    return str(res)
+
+
+def unhexlify(s):
+    return bytearray([int(s[i:i + 2], 16) for i in range(0, len(s), 2)])
@@ -0,0 +1,76 @@
+# Per-field change detection for telemetry.
+#
+# apply() drops from a telemetry record the fields that didn't change enough
+# since they were last sent. A value is sent when it moved from the last
+# sent one by more than the dead-band, the larger of an absolute and a
+# relative (to the last sent value) amount, but not more often than the
+# field minimum interval; it is sent anyway after the refresh interval.
+# Fields not listed here always pass. The last sent values are kept in lists
+# allocated once.
+
+import record
+
+# (field, absolute, relative, min interval ms, refresh ms)
+FIELDS = (
+    (record.BATTERY, 0.2, 0.0, 60000, 3600000),
+    (record.BACKUP, 0.05, 0.0, 60000, 3600000),
+    (record.TEMPERATURE, 1.0, 0.0, 60000, 3600000),
+    (record.SIGMA, 0.01, 0.5, 0, 3600000),
+    (record.PITCH, 2.0, 0.0, 0, 3600000),
+    (record.ROLL, 2.0, 0.0, 0, 3600000),
+    (record.ALTITUDE, 10.0, 0.0, 0, 3600000),
+    (record.COG, 10.0, 0.0, 0, 3600000),
+    (record.NSAT, 2, 0.0, 60000, 3600000),
+    (record.HDOP, 0.3, 0.2, 60000, 3600000),
+)
+
+_ANGLES = (record.COG,)
+
+_value = [None] * len(FIELDS)   # last sent
+_time = [0] * len(FIELDS)
+
+dropped = 0
+
+
+def reset():
+    """Forgets the sent values, so the next ones all pass"""
+    for i in range(len(FIELDS)):
+        _value[i] = None
+
+
+def apply(r, now):
+    """Removes the unchanged fields from record r, now is the time in ms"""
+    global dropped
+    i = -1
+    # while, not a for over a range, as this runs at every point
+    while i < len(FIELDS) - 1:
+        i += 1
+        f = FIELDS[i]
+        v = r[f[0]]
+        if v is None:
+            continue
+        last = _value[i]
+        if last is not None:
+            age = now - _time[i]
+            if age < f[4]:
+                d = v - last
+                if f[0] in _ANGLES:
+                    if d > 180:
+                        d -= 360
+                    elif d < -180:
+                        d += 360
+                if d < 0:
+                    d = -d
+                band = f[1]
+                if f[2] > 0:
+                    b = last * f[2]
+                    if b < 0:
+                        b = -b
+                    if b > band:
+                        band = b
+                if d <= band or age < f[3]:
+                    r[f[0]] = None
+                    dropped += 1
+                    continue
+        _value[i] = v
+        _time[i] = now
@@ -0,0 +1,110 @@
+# Timing diagnostics of the telemetry hot path.
+#
+# Each stage keeps count, sum, min and max of its durations in ms plus a
+# histogram with power of two buckets, from which percentiles are estimated
+# without storing samples or sorting. Recording costs a few list updates,
+# so it is always enabled. Free heap is sampled periodically and probes
+# return liveness counters of the other threads.
+
+import gc
+
+RTC = 0
+FIX = 1
+PITCHROLL = 2
+ENCODE = 3
+PUBLISH = 4
+BACKLOG = 5
+
+_NAMES = ("rtc", "fix", "pitchroll", "encode", "publish", "backlog")
+_BUCKETS = 12           # bucket b holds durations below 2^b ms, the last the rest
+
+_count = [0] * len(_NAMES)
+_sum = [0] * len(_NAMES)
+_min = [0] * len(_NAMES)
+_max = [0] * len(_NAMES)
+_hist = [0] * (len(_NAMES) * _BUCKETS)
+
+_probes = []            # (name, fn)
+
+heap_free = None        # last sample
+heap_min = None
+
+
+def record(stage, ms):
+    """Adds a duration in ms to stage"""
+    n = _count[stage]
+    _count[stage] = n + 1
+    _sum[stage] += ms
+    if n == 0 or ms < _min[stage]:
+        _min[stage] = ms
+    if ms > _max[stage]:
+        _max[stage] = ms
+    b = 0
+    while ms > 0 and b < _BUCKETS - 1:
+        ms >>= 1
+        b += 1
+    _hist[stage * _BUCKETS + b] += 1
+
+
+def percentile(stage, pct):
+    """Returns an upper bound in ms of the pct percentile of stage"""
+    n = _count[stage]
+    if n == 0:
+        return 0
+    need = (n * pct + 99) // 100
+    acc = 0
+    for b in range(_BUCKETS - 1):
+        acc += _hist[stage * _BUCKETS + b]
+        if acc >= need:
+            bound = (1 << b) - 1
+            return bound if bound < _max[stage] else _max[stage]
+    return _max[stage]
+
+
+def stats(stage):
+    """Returns (name, count, min, avg, p50, p95, max) in ms"""
+    n = _count[stage]
+    avg = _sum[stage] // n if n > 0 else 0
+    return (_NAMES[stage], n, _min[stage], avg, percentile(stage, 50), percentile(stage, 95), _max[stage])
+
+
+def probe(name, fn):
+    """Registers fn() returning a liveness counter to report as name"""
+    _probes.append((name, fn))
+
+
+def sample_heap():
+    global heap_free, heap_min
+    try:
+        free = gc.info()[1]
+    except Exception as e:
+        return
+    heap_free = free
+    if heap_min is None or free < heap_min:
+        heap_min = free
+
+
+def summary():
+    """Returns the diagnostics as a compact dict for publish_attributes"""
+    sample_heap()
+    res = {}
+    for i in range(len(_NAMES)):
+        if _count[i] > 0:
+            s = stats(i)
+            res[s[0]] = [s[1], s[2], s[3], s[5], s[6]]
+    res["heap"] = [heap_free, heap_min]
+    for p in _probes:
+        try:
+            res[p[0]] = p[1]()
+        except Exception as e:
+            res[p[0]] = None
+    return {"diag": res}
+
+
+def dump():
+    for i in range(len(_NAMES)):
+        print("Stage:", stats(i))
+    sample_heap()
+    print("Heap free:", heap_free, "min", heap_min)
+    for p in _probes:
+        print("Probe:", p[0], p[1]())
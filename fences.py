@@ -0,0 +1,98 @@
+# Geofence set kept in its own flash area, out of the settings journal.
+#
+# A fence set can take tens of KB, too much to be copied by every settings
+# snapshot. It is stored as JSON in one of two flash blocks, alternately,
+# behind a header written last:
+#   sequence (4) | length (4) | checksum (2) | JSON payload
+# so a set is replaced entirely or not at all: on load the valid block with
+# the highest sequence number is used. A set longer than MAX_SIZE bytes of
+# JSON is refused with ValueError.
+
+import json
+from fortebit.polaris import qspiflash
+
+_BLOCK_SIZE = 0x10000   # erase block size of the QSPI flash
+_FIRST_BLOCK = 8        # two blocks between settings and backlog
+_HDR = 10
+_ERASED = 0xFFFFFFFF
+
+MAX_SIZE = _BLOCK_SIZE - _HDR
+
+_flash = None
+_seq = 0                # sequence of the newest set, 0 if none
+
+erases = 0
+
+
+def _addr(seq):
+    return (_FIRST_BLOCK + seq % 2) * _BLOCK_SIZE
+
+
+def _checksum(data):
+    a = 0
+    b = 0
+    for c in data:
+        a = (a + c) % 255
+        b = (b + a) % 255
+    return (b << 8) | a
+
+
+def _header(seq):
+    # returns (length, checksum) of the set in block seq, None if not written
+    h = _flash.read_data(_addr(seq), _HDR)
+    s = (h[0] << 24) | (h[1] << 16) | (h[2] << 8) | h[3]
+    if s != seq:
+        return None
+    n = (h[4] << 24) | (h[5] << 16) | (h[6] << 8) | h[7]
+    if n > MAX_SIZE:
+        return None
+    return (n, (h[8] << 8) | h[9])
+
+
+def load():
+    """Reads the newest valid fence set from flash, returns it or None"""
+    global _flash, _seq
+    if _flash is None:
+        _flash = qspiflash.QSpiFlash()
+    seqs = []
+    for b in range(2):
+        h = _flash.read_data((_FIRST_BLOCK + b) * _BLOCK_SIZE, 4)
+        seq = (h[0] << 24) | (h[1] << 16) | (h[2] << 8) | h[3]
+        if seq != _ERASED and seq % 2 == b:
+            seqs.append(seq)
+    if len(seqs) == 2 and seqs[0] < seqs[1]:
+        seqs = [seqs[1], seqs[0]]
+    # the next save goes to the other block than the set in use
+    _seq = seqs[0] if len(seqs) > 0 else 0
+    for seq in seqs:
+        h = _header(seq)
+        if h is None:
+            continue
+        data = _flash.read_data(_addr(seq) + _HDR, h[0])
+        if _checksum(data) != h[1]:
+            # interrupted save, use the previous set
+            continue
+        _seq = seq
+        return json.loads(data)
+    return None
+
+
+def save(fences):
+    """Replaces the stored fence set, None or [] removes it; raises
+    ValueError if it is too large, leaving the stored set unchanged"""
+    global _seq, erases
+    if fences is None:
+        fences = []
+    data = bytes(json.dumps(fences))
+    n = len(data)
+    if n > MAX_SIZE:
+        raise ValueError("fence set too large: %d bytes, max %d" % (n, MAX_SIZE))
+    c = _checksum(data)
+    seq = _seq + 1
+    addr = _addr(seq)
+    _flash.erase_block(addr)
+    erases += 1
+    _flash[addr + _HDR] = data
+    _flash[addr] = bytes([(seq >> 24) & 0xFF, (seq >> 16) & 0xFF, (seq >> 8) & 0xFF, seq & 0xFF,
+                          (n >> 24) & 0xFF, (n >> 16) & 0xFF, (n >> 8) & 0xFF, n & 0xFF, c >> 8, c & 0xFF])
+    _seq = seq
@@ -0,0 +1,202 @@
+# Circle and polygon geofences checked on the device.
+#
+# Fences are stored by fences.py and set with the terminal command "fences",
+# as a list of
+#   [id, lat, lon, radius]              circle, radius in m
+#   [id, [lat1, lon1, lat2, lon2, ...]] polygon, at least 3 vertices
+# with integer ids. load() indexes them on a grid of _CELL degrees: each
+# cell lists the fences whose bounding box overlaps it, so check() only
+# tests the fences of the cell of the fix, plus the few too large to index
+# and the ones the vehicle is in. Entering, leaving and staying in a fence
+# for _DWELL queue events, read with get_event() like motion events.
+
+import math
+import track
+
+FENCE_ENTER = 1
+FENCE_EXIT = 2
+FENCE_DWELL = 3
+
+_CELL = 0.02            # grid cell size in degrees (~2 km)
+_MAX_CELLS = 16         # larger fences are checked by bounding box only
+_MAX_FENCES = 500
+_MARGIN = 25.0          # m, circles are left beyond radius + margin
+_DWELL = 600000         # ms inside a fence for a dwell event
+_MAX_EVENTS = 8
+
+# per fence
+_id = []
+_radius = []            # m, 0 for polygons
+_shape = []             # polygon vertices
+_box = []               # [min lat, min lon, max lat, max lon]
+_since = []             # entry time, None when outside
+_dwelt = []
+
+_grid = {}              # cell key -> list of fences
+_large = []
+_inside = []            # fences the vehicle is in
+
+_ev_id = [0] * _MAX_EVENTS
+_ev_code = [0] * _MAX_EVENTS
+_ev_time = [0] * _MAX_EVENTS
+_ev_head = 0
+_ev_tail = 0
+
+events_lost = 0
+tested = 0              # fences tested by the last check
+
+
+def _key(iy, ix):
+    return (iy + 5000) * 20000 + ix + 10000
+
+
+def _cell(v):
+    return int(math.floor(v / _CELL))
+
+
+def count():
+    return len(_id)
+
+
+def load(fences):
+    """Builds the index for a list of fences, replacing the current ones"""
+    global _id, _radius, _shape, _box, _since, _dwelt, _grid, _large, _inside
+    _id = []
+    _radius = []
+    _shape = []
+    _box = []
+    _since = []
+    _dwelt = []
+    _grid = {}
+    _large = []
+    _inside = []
+    if fences is None:
+        return
+    for f in fences:
+        if len(_id) >= _MAX_FENCES:
+            print("Too many fences")
+            break
+        try:
+            if len(f) == 4:
+                r = float(f[3])
+                dlat = math.degrees(r / track._EARTH_RADIUS)
+                dlon = dlat / math.cos(math.radians(f[1]))
+                box = [f[1] - dlat, f[2] - dlon, f[1] + dlat, f[2] + dlon]
+                shape = None
+            else:
+                r = 0.0
+                shape = f[1]
+                if len(shape) < 6 or len(shape) % 2 != 0:
+                    raise ValueError
+                box = [shape[0], shape[1], shape[0], shape[1]]
+                for j in range(2, len(shape), 2):
+                    box[0] = min(box[0], shape[j])
+                    box[1] = min(box[1], shape[j + 1])
+                    box[2] = max(box[2], shape[j])
+                    box[3] = max(box[3], shape[j + 1])
+        except Exception as e:
+            print("Invalid fence", f)
+            continue
+        i = len(_id)
+        _id.append(f[0])
+        _radius.append(r)
+        _shape.append(shape)
+        _box.append(box)
+        _since.append(None)
+        _dwelt.append(False)
+        y0 = _cell(box[0])
+        x0 = _cell(box[1])
+        y1 = _cell(box[2])
+        x1 = _cell(box[3])
+        if (y1 - y0 + 1) * (x1 - x0 + 1) > _MAX_CELLS:
+            _large.append(i)
+            continue
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                k = _key(y, x)
+                if k in _grid:
+                    _grid[k].append(i)
+                else:
+                    _grid[k] = [i]
+
+
+def _polygon(p, lat, lon):
+    # ray casting, lat/lon taken as planar
+    n = len(p)
+    res = False
+    j = n - 2
+    for i in range(0, n, 2):
+        yi = p[i]
+        yj = p[j]
+        if (yi > lat) != (yj > lat):
+            x = p[i + 1] + (lat - yi) * (p[j + 1] - p[i + 1]) / (yj - yi)
+            if lon < x:
+                res = not res
+        j = i
+    return res
+
+
+def contains(i, lat, lon, margin=0.0):
+    """Returns True if fence i contains the position"""
+    b = _box[i]
+    if _radius[i] > 0:
+        # the box center is the circle center
+        return track.distance((b[0] + b[2]) / 2, (b[1] + b[3]) / 2, lat, lon) <= _radius[i] + margin
+    if lat < b[0] or lat > b[2] or lon < b[1] or lon > b[3]:
+        return False
+    return _polygon(_shape[i], lat, lon)
+
+
+def _event(i, code, now):
+    global _ev_head, _ev_tail, events_lost
+    _ev_id[_ev_head] = _id[i]
+    _ev_code[_ev_head] = code
+    _ev_time[_ev_head] = now
+    n = (_ev_head + 1) % _MAX_EVENTS
+    if n == _ev_tail:
+        # drop the oldest
+        events_lost += 1
+        _ev_tail = (_ev_tail + 1) % _MAX_EVENTS
+    _ev_head = n
+
+
+def check(lat, lon, now):
+    """Updates the fence states with a fix taken at time now in ms"""
+    global tested, _inside
+    tested = 0
+    # leave first, so each fence is tested once
+    inside = []
+    for i in _inside:
+        tested += 1
+        if contains(i, lat, lon, _MARGIN):
+            inside.append(i)
+        else:
+            _since[i] = None
+            _event(i, FENCE_EXIT, now)
+    k = _key(_cell(lat), _cell(lon))
+    for c in (_grid.get(k, ()), _large):
+        for i in c:
+            if _since[i] is not None:
+                continue
+            tested += 1
+            if contains(i, lat, lon):
+                _since[i] = now
+                _dwelt[i] = False
+                inside.append(i)
+                _event(i, FENCE_ENTER, now)
+    _inside = inside
+
+
+def get_event(now):
+    """Returns the oldest pending event as (id, code, time) or None"""
+    global _ev_tail
+    for i in _inside:
+        if not _dwelt[i] and now - _since[i] >= _DWELL:
+            _dwelt[i] = True
+            _event(i, FENCE_DWELL, now)
+    if _ev_tail == _ev_head:
+        return None
+    i = _ev_tail
+    res = (_ev_id[i], _ev_code[i], _ev_time[i])
+    _ev_tail = (i + 1) % _MAX_EVENTS
+    return res
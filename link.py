@@ -0,0 +1,150 @@
+# Connection manager.
+#
+# A thread checks the cloud connection and, once it has been lost for a
+# while, recovers in layers of growing cost: reconnect the MQTT client,
+# then re-attach the data connection, then restart the modem. Each layer
+# gets a few attempts spaced by an exponential backoff with random jitter,
+# so many devices losing the same cell don't retry in step. The MCU is
+# reset only when every layer has failed.
+
+import random
+import timers
+import alarm
+import utils
+from wireless import gsm
+
+_CHECK = 1000           # connection check period in ms
+_GRACE = 5000           # ms disconnected before recovering
+_BACKOFF = 2000         # first retry delay in ms, doubled at each attempt
+_BACKOFF_MAX = 60000
+_JITTER = 4             # +/- 1/_JITTER of the delay
+_NETWORK_WAIT = 60      # s to wait for network registration
+
+_thread = None
+_device = None
+_modem = None
+_apn = None
+
+up = True
+outages = 0
+recovered = [0, 0, 0]   # recoveries per layer
+resets = 0
+outage_last = 0         # duration of the last outage in ms
+outage_max = 0
+
+
+def _connect():
+    # the client is shared with the publishers
+    alarm.lock.acquire()
+    try:
+        ok = _device.connect()
+    except Exception as e:
+        print("Link connect failed", e)
+        ok = False
+    alarm.lock.release()
+    return ok
+
+
+def _reconnect():
+    return _connect()
+
+
+def _reattach():
+    try:
+        gsm.detach()
+    except Exception as e:
+        pass
+    sleep(1000)
+    gsm.attach(_apn)
+    return _connect()
+
+
+def _restart():
+    _modem.shutdown()
+    _modem.startup()
+    for _ in range(_NETWORK_WAIT):
+        if gsm.network_info()[6]:
+            break
+        sleep(1000)
+    else:
+        return False
+    gsm.attach(_apn)
+    return _connect()
+
+
+# (name, step, attempts)
+_LAYERS = (
+    ("reconnect", _reconnect, 2),
+    ("reattach", _reattach, 2),
+    ("restart", _restart, 2),
+)
+
+
+def _backoff(attempt):
+    d = _BACKOFF << attempt
+    if d > _BACKOFF_MAX:
+        d = _BACKOFF_MAX
+    j = d // _JITTER
+    return d - j + random.randint(0, 2 * j)
+
+
+def _recover():
+    # returns the layer that recovered, -1 if all failed
+    attempt = 0
+    for i in range(len(_LAYERS)):
+        layer = _LAYERS[i]
+        for _ in range(layer[2]):
+            print("Link recovery:", layer[0])
+            try:
+                if layer[1]():
+                    return i
+            except Exception as e:
+                print("Link recovery failed", e)
+            sleep(_backoff(attempt))
+            attempt += 1
+            if _device.is_connected():
+                # recovered by itself meanwhile
+                return i
+    return -1
+
+
+def _run():
+    global up, outages, resets, outage_last, outage_max
+    lost = None
+    while True:
+        sleep(_CHECK)
+        if _device.is_connected():
+            lost = None
+            continue
+        now = timers.now()
+        if lost is None:
+            lost = now
+            continue
+        if now - lost < _GRACE:
+            continue
+        up = False
+        outages += 1
+        layer = _recover()
+        if layer < 0:
+            print("Link recovery failed, reset")
+            resets += 1
+            sleep(500)
+            utils.reset()
+        recovered[layer] += 1
+        outage_last = timers.now() - lost
+        if outage_last > outage_max:
+            outage_max = outage_last
+        print("Link recovered:", _LAYERS[layer][0], outage_last)
+        up = True
+        lost = None
+
+
+def start(device, modem, apn):
+    """Starts watching the connection of device"""
+    global _thread, _device, _modem, _apn
+    if _thread is not None:
+        return
+    _device = device
+    _modem = modem
+    _apn = apn
+    _thread = thread(_run)
@@ -15,21 +15,49 @@ import streams
 s = streams.serial()
 
 import mcu
-import timestamp
 import timers
 import ssl
-import requests
-import threading
 from wireless import gsm
 import utils
-
-sleep(1000)
+import batch
+import codec
+import record
+import motion
+import scheduler
+import alarm
+import track
+import clock
+import sensors
+import diag
+import link
+import aiding
+import deadband
+import geofence
+import fences
+import trip
+import trace
+import outbox
 
 # CONFIG
-poll_time = 100                     # poll inputs at twice the specified period in ms
+poll_time = 100                     # telemetry period tolerance in ms
+status_period = 1000                # link status, LED and pending events check period in ms
+terminal_period = 5000              # serial terminal check period in ms, the console reader wakes the loop sooner
+backlog_period = 1000               # backlog resend period in ms
+watchdog_period = 5000              # watchdog kick period in ms
 gps_period = 10000                  # gps lat,lon and speed telemetry period in ms
 update_period = 6 * gps_period      # other telemetry data period in ms
 no_ignition_period = 300000         # no ignition telemetry data period in ms
+backlog_drain = 5                   # stored records to resend per loop iteration
+queue_policy = outbox.COALESCE      # when the publish queue is full (see outbox.py)
+batch_size = 6                      # gps points published in a single message (1 to disable)
+batch_time = update_period          # max age in ms of the oldest point in a batch
+compact_telemetry = False           # publish fixed point binary records (see codec.py)
+adaptive_reporting = True           # report positions by distance/heading/speed changes (see track.py)
+deadband_filter = True              # send other fields only when they change (see deadband.py)
+fix_period = 2000                   # fix evaluation period in ms for adaptive reporting
+max_hdop = 2.5                      # less accurate positions are not transmitted
+diag_period = 3600000               # diagnostics attributes period in ms
+aiding_wait = 30                    # s to wait for the network time to inject GNSS aiding
 
 fw_version = "1.11"
 
@@ -49,7 +77,46 @@ try:
 except Exception as e:
     print("Failed polaris init with", e)
     sleep(500)
-    mcu.reset()
+    utils.reset()
+
+
+# NETWORK BRING-UP
+# runs in its own thread while the rest of the hardware and settings are set up
+net_status = None
+minfo = None
+
+def network_task():
+    global net_status, minfo
+    try:
+        print("Starting Modem...")
+        modem.startup()
+        minfo = gsm.mobile_info()
+        print("Modem:", minfo)
+        print("Waiting for network...")
+        for _ in range(600):
+            ninfo = gsm.network_info()
+            if ninfo[6]:
+                break
+            sleep(250)
+        else:
+            raise TimeoutError
+        print("Attached to network:", ninfo)
+        net_status = True
+        # help the receiver with the last known position, once the network
+        # has set the modem clock
+        try:
+            for _ in range(aiding_wait):
+                tm = modem.rtc()
+                if aiding.valid_time(tm):
+                    break
+                sleep(1000)
+            if aiding.inject(gnss, tm):
+                print("GNSS aiding sent")
+        except Exception as e:
+            print("GNSS aiding failed", e)
+    except Exception as e:
+        print("Network failure", e)
+        net_status = False
 
 
 # INIT HW
@@ -64,32 +131,32 @@ try:
 
     print("Starting Accelerometer...")
     import accel
+    motion_stats = motion.register()
     accel.start()
     print("Starting GNSS...")
+    aiding.load()
+    trip.load()
     gnss.start()
     gnss.set_rate(2000)
 
-    print("Starting Modem...")
-    modem.startup()
-    
+    thread(network_task)
+
     # enable modem/gnss utilities
     utils.modem = modem
     utils.gnss = gnss
 
+    print("Opening backlog...")
+    import store
+    store.init()
+
     sfw.watchdog(0, 30000)
     sfw.kick()
     if utils.check_terminal(s):
         utils.do_terminal(s)
-
-    minfo = gsm.mobile_info()
-    print("Modem:", minfo)
-    
-    # enable SMS checking
-    utils.check_sms = True
 except Exception as e:
     print("Failed init hw with", e)
     sleep(500)
-    mcu.reset()
+    utils.reset()
 
 
 # GATHERING SETTINGS
@@ -114,6 +181,11 @@ try:
         name = settings["name"]
         print("Name:", name)
 
+    fence_set = fences.load()
+    if fence_set is not None:
+        geofence.load(fence_set)
+        print("Fences:", geofence.count())
+
     if apn is not None and not utils.validate_apn(apn):
         print("Invalid APN!")
         apn = None
@@ -140,24 +212,20 @@ try:
 except Exception as e:
     print("Failed gathering settings with", e)
     sleep(500)
-    mcu.reset()
+    utils.reset()
 
 
 # GSM ATTACH
 try:
-    print("Waiting for network...",end='')
-    for _ in range(150):
+    # wait for the network bring-up thread
+    while net_status is None:
         sfw.kick()
-        ninfo = gsm.network_info()
-        if ninfo[6]:
-            break
-        sleep(1000)
-        if (_ % 10) == 9:
-            print('.',end='')
-    else:
+        sleep(250)
+    if not net_status:
         raise TimeoutError
-    print("ok!")
-    print("Attached to network:", ninfo)
+
+    # enable SMS checking
+    utils.check_sms = True
 
     print("Activating data connection...")
     for _ in range(3):
@@ -178,14 +246,21 @@ try:
 except Exception as e:
     print("Network failure", e)
     sleep(500)
-    mcu.reset()
+    utils.reset()
 
 
 # FORTEBIT CLOUD
 try:
     from fortebit.polaris import cloud
-    # get access token
-    device_token = cloud.getAccessToken(minfo[0], mcu.uid())
+    # get access token, cached in flash for this modem
+    cached_token = settings.get("token_imei") == minfo[0] and "token" in settings
+    if cached_token:
+        device_token = settings["token"]
+    else:
+        device_token = cloud.getAccessToken(minfo[0], mcu.uid())
+        settings["token"] = device_token
+        settings["token_imei"] = minfo[0]
+        utils.saveSettings(settings)
     # NOTE! Do not disclose security token in production builds
     print("Access Token:", device_token)
 
@@ -219,6 +294,10 @@ try:
             except Exception as e:
                 print("Failed connect...", e)
         else:
+            if cached_token:
+                # the cached token may be stale, get a new one on next boot
+                del settings["token"]
+                utils.saveSettings(settings)
             raise TimeoutError
 
     print("Device is connected")
@@ -230,7 +309,8 @@ try:
     print("Device is up and running")
 
     # if not registered, register device to Fortebit Cloud
-    if not cloud.isRegistered(device, email):
+    # (registration of this email is cached in flash)
+    if settings.get("registered") != email and not cloud.isRegistered(device, email):
         sfw.kick()
         retry = timers.now()
         print("Device is not registered, register device...")
@@ -248,142 +328,276 @@ try:
 
     sfw.kick()
     print("Device is registered")
+    if settings.get("registered") != email:
+        settings["registered"] = email
+        utils.saveSettings(settings)
     polaris.ledRedOff()
     polaris.ledGreenOff()
-    print("Publish device attributes")
-    device.publish_attributes({"name": name,
-                              "target_board": vm.info()[1].upper(),
-                              "vm_version": vm.info()[2],
-                              "fw_version": fw_version})
+    attributes = {"name": name,
+                  "target_board": vm.info()[1].upper(),
+                  "vm_version": vm.info()[2],
+                  "fw_version": fw_version}
+    # attributes are kept by the cloud, only publish changes
+    if settings.get("attributes") != attributes:
+        print("Publish device attributes")
+        if device.publish_attributes(attributes):
+            settings["attributes"] = attributes
+            utils.saveSettings(settings)
+    boot_time = timers.now()
+    print("Boot time:", boot_time)
     sfw.kick()
 
 except Exception as e:
     print("Failed access to Fortebit cloud", e)
     sleep(500)
-    mcu.reset()
+    utils.reset()
+
+# TELEMETRY TASKS
+def input_task():
+    global ignition, sos, connected, extra_send
+
+    # inputs are read by the alarm lane, which wakes this task on edges
+    old_ign = ignition
+    ignition = alarm.ignition
+    old_sos = sos
+    sos = alarm.sos
+    if trace.enabled:
+        trace.inputs(ignition, sos)
+
+    # harsh driving events are sent as they happen
+    ev = motion.get_event()
+    if ev is not None:
+        print("Motion event:", ev)
+        telemetry[record.EVENT] = ev[0]
+        telemetry[record.EVENT_G] = ev[1]
+        extra_send = True
+
+    # one geofence event per point, the others follow at the next polls
+    ev = geofence.get_event(timers.now())
+    if ev is not None:
+        print("Geofence event:", ev)
+        telemetry[record.FENCE] = ev[0]
+        telemetry[record.FENCE_EVENT] = ev[1]
+        extra_send = True
+
+    # lost connections are recovered by the link thread
+    connected = device.is_connected()
+
+    # led waiting status
+    utils.status_led(False, ignition, connected)
+
+    if sos != old_sos:
+        telemetry[record.SOS] = sos
+        extra_send = True
+
+    if ignition != old_ign:
+        telemetry[record.IGNITION] = ignition
+        extra_send = True
+        if ignition:
+            trip.start(timers.now())
+        else:
+            # the trip summary goes with the ignition off point
+            if trip.end(timers.now(), telemetry):
+                print("Trip:", telemetry[record.TRIP_DISTANCE], "km")
+            aiding.save()
+        # sleep as indicated by rate
+        scheduler.set_period(telemetry_id, report_period if ignition else no_ignition_period)
+
+    if extra_send:
+        scheduler.trigger(telemetry_id)
+
+
+def terminal_task():
+    # the console is read by the terminal thread
+    if utils.terminal_requested():
+        utils.do_terminal(s)
+        utils.terminal_done()
+
+
+def watchdog_task():
+    sfw.kick()
+    diag.sample_heap()
+
+
+def diag_task():
+    if not connected:
+        return
+    outbox.put(diag.summary(), None, outbox.ATTRIBUTES)
+
+
+def telemetry_task():
+    global counter, extra_send, last_update, last_report
+    now_time = timers.now()
+    if ignition == 0:
+        extra_send = True
+    full = extra_send or last_update is None or now_time - last_update >= update_period
+
+    raw = None
+    fix = None
+    if gnss.has_fix():
+        t = timers.now()
+        raw = gnss.fix()
+        diag.record(diag.FIX, timers.now() - t)
+        # only transmit position when it's accurate
+        if raw[6] < max_hdop:
+            fix = raw
+            geofence.check(fix[0], fix[1], now_time)
+            trip.fix(fix[0], fix[1], fix[3], now_time)
+    if trace.enabled:
+        trace.fix(raw)
+
+    if not full and adaptive_reporting:
+        # skip positions that add no information
+        if fix is not None:
+            if not track.check(fix[0], fix[1], fix[3], fix[4], now_time):
+                return
+        elif now_time - last_report < gps_period - poll_time:
+            return
+
+    if full:
+        last_update = now_time
+        telemetry[record.IGNITION] = ignition
+        telemetry[record.SOS] = sos
+
+        if sensors.get(sensors.BATTERY_BACKUP):
+            telemetry[record.CHARGER] = -1
+        else:
+            telemetry[record.BATTERY] = sensors.get(sensors.MAIN_VOLTAGE)
+            telemetry[record.CHARGER] = sensors.get(sensors.CHARGER)
+
+        telemetry[record.BACKUP] = sensors.get(sensors.BATT_VOLTAGE)
+        telemetry[record.TEMPERATURE] = accel.get_temperature()
+        telemetry[record.SIGMA] = accel.get_sigma()
+        ms = motion.read(motion_stats)
+        telemetry[record.JERK] = ms[1]
+        telemetry[record.RMS] = ms[2]
+
+        t = timers.now()
+        pr = accel.get_pitchroll()
+        diag.record(diag.PITCHROLL, timers.now() - t)
+        telemetry[record.PITCH] = pr[0]
+        telemetry[record.ROLL] = pr[1]
+
+    if raw is not None:
+        if fix is not None:
+            telemetry[record.LATITUDE] = fix[0]
+            telemetry[record.LONGITUDE] = fix[1]
+            telemetry[record.SPEED] = fix[3]
+            if full:
+                telemetry[record.ALTITUDE] = fix[2]
+                telemetry[record.COG] = fix[4]
+            track.reported(fix[0], fix[1], fix[3], fix[4], now_time)
+            if clock.synced:
+                aiding.update(fix, clock.now()[0])
+        if full:
+            telemetry[record.NSAT] = raw[5]
+            telemetry[record.HDOP] = raw[6]
+
+    if deadband_filter:
+        deadband.apply(telemetry, now_time)
+
+    # keep the clock synced, GPS time is preferred to the modem RTC
+    if clock.need_sync():
+        if raw is not None:
+            clock.sync(raw[9])
+        else:
+            t = timers.now()
+            rtc = modem.rtc()
+            diag.record(diag.RTC, timers.now() - t)
+            #print("MODEM RTC =", rtc)
+            clock.sync(rtc)
+    ts = clock.stamp()
+
+    counter += 1
+    last_report = now_time
+
+    # led sending status, back to waiting status shortly
+    utils.status_led(True, ignition, connected)
+    scheduler.trigger(input_id, 2 * poll_time)
+
+    if ts is None or batch_size <= 1:
+        print("Publishing:", counter, ts, record.count(telemetry))
+        t = timers.now()
+        if compact_telemetry:
+            point[0] = ts
+            values = {"z": codec.hexlify(codec.buffer(), codec.encode(single))}
+            kind = outbox.PACKED
+        else:
+            values = codec.format(telemetry)
+            kind = outbox.POINT
+        diag.record(diag.ENCODE, timers.now() - t)
+        if not outbox.put(values, ts, kind):
+            print("Publish queue full, point dropped")
+    else:
+        print("Batching:", counter, ts, record.count(telemetry))
+        batch.add(ts, telemetry, timers.now())
+        # input changes are sent right away with the pending points
+        if extra_send or batch.ready(timers.now(), batch_size, batch_time):
+            points = batch.take()
+            if adaptive_reporting:
+                points = track.simplify(points)
+            print("Publishing batch:", len(points))
+            t = timers.now()
+            if compact_telemetry:
+                # timestamps are carried by the encoded points
+                values = {"z": codec.hexlify(codec.buffer(), codec.encode(points))}
+                kind = outbox.PACKED
+            else:
+                values = []
+                for p in points:
+                    values.append({"ts": p[0], "values": codec.format(p[1])})
+                kind = outbox.BATCH
+            diag.record(diag.ENCODE, timers.now() - t)
+            if not outbox.put(values, None, kind):
+                print("Publish queue full, batch dropped")
+    record.clear(telemetry)
+    extra_send = False
+
 
 # TELEMETRY LOOP
 try:
     accel.get_sigma()  # reset accumulated value
+    link.start(device, modem, apn)
+    # the loop only queues messages, the sender thread publishes them
+    outbox.start(device, queue_policy, backlog_period, backlog_drain)
     sleep(500)
 
-    last_time = -(no_ignition_period + gps_period) # force sending data immediately
     counter = 0
-    sos = -1
+    last_update = None
+    last_report = None
+    report_period = fix_period if adaptive_reporting else gps_period
     connected = True
     ignition = None
     sos = None
-    telemetry = {}
-    disconn_time = None
-
-    while True:
-        # allow other threads to run while waiting
-        sleep(poll_time*2)
-        sfw.kick()
-        now_time = timers.now()
-
-        if utils.check_terminal(s):
-            utils.do_terminal(s)
-
-        # read inputs
-        old_ign = ignition
-        ignition = polaris.getIgnitionStatus()
-        old_sos = sos
-        sos = polaris.getEmergencyStatus()
-        extra_send = False
-
-        if connected and not device.is_connected():
-            if disconn_time is None:
-                disconn_time = now_time + 60000 # add some time to recover
-            connected = False
-        elif not connected and device.is_connected():
-            connected = True
-            disconn_time = None
-
-        if not connected and disconn_time:
-            if now_time > disconn_time:
-                raise TimeoutError
-                pass
-
-        # led waiting status
-        utils.status_led(False, ignition, connected)
-
-        if sos != old_sos:
-            telemetry['sos'] = sos
-            extra_send = True
-
-        if ignition != old_ign:
-            telemetry['ignition'] = ignition
-            extra_send = True
-
-        if not extra_send:
-            if ignition == 0:
-                # sleep as indicated by rate for no ignition
-                if now_time - last_time < no_ignition_period - poll_time:
-                    continue
-                extra_send = True
-            else:
-                # sleep as indicated by rate
-                if now_time - last_time < gps_period - poll_time:
-                    continue
-
-        ts = modem.rtc()
-        #print("MODEM RTC =", ts)
-
-        if counter % (update_period / gps_period) == 0 or extra_send:
-            telemetry['ignition'] = ignition
-            telemetry['sos'] = sos
-
-            if polaris.isBatteryBackup():
-                telemetry['charger'] = -1
-            else:
-                telemetry['battery'] = utils.decimal(3, polaris.readMainVoltage())
-                telemetry['charger'] = polaris.getChargerStatus()
-
-            telemetry['backup'] = utils.decimal(3, polaris.readBattVoltage())
-            telemetry['temperature'] = utils.decimal(2, accel.get_temperature())
-            telemetry['sigma'] = utils.decimal(3, accel.get_sigma())
-
-            pr = accel.get_pitchroll()
-            telemetry['pitch'] = utils.decimal(1, pr[0])
-            telemetry['roll'] = utils.decimal(1, pr[1])
-
-        if gnss.has_fix():
-            fix = gnss.fix()
-            # only transmit position when it's accurate
-            if fix[6] < 2.5:
-                telemetry['latitude'] = utils.decimal(6, fix[0])
-                telemetry['longitude'] = utils.decimal(6, fix[1])
-                telemetry['speed'] = utils.decimal(1, fix[3])
-                if counter % (update_period / gps_period) == 0 or extra_send:
-                    telemetry['altitude'] = utils.decimal(1, fix[2])
-                    telemetry['COG'] = utils.decimal(1, fix[4])
-            if counter % (update_period / gps_period) == 0 or extra_send:
-                telemetry['nsat'] = fix[5]
-                telemetry['HDOP'] = utils.decimal(2, fix[6])
-            # replace timestamp with GPS
-            ts = fix[9]
-        elif ts is not None and ts[0] < 2019:
-            ts = None
-
-        if ts is not None:
-            ts = str(timestamp.to_unix(ts)) + "000"
-
-        counter += 1
-        last_time = now_time
-
-        # led sending status
-        utils.status_led(True, ignition, connected)
-
-        print("Publishing:", counter, ts, telemetry)
-        sfw.kick()
-        ok = device.publish_telemetry(telemetry, ts)
-        telemetry = {}
-        
-        if not ok:
-            print("Publishing failed") # TODO: retry or store to qspiflash and resend later
+    # one record for the whole run, cleared after each point
+    telemetry = record.new()
+    point = [None, telemetry]
+    single = [point]
+    batch.init(batch_size)
+    extra_send = False
+
+    # inputs are read first, telemetry is sent immediately then as indicated by rate
+    input_id = scheduler.add(input_task, "inputs", status_period)
+    telemetry_id = scheduler.add(telemetry_task, "telemetry", report_period)
+    terminal_id = scheduler.add(terminal_task, "terminal", terminal_period)
+    scheduler.add(watchdog_task, "watchdog", watchdog_period)
+    scheduler.add(diag_task, "diag", diag_period, diag_period)
+
+    # SOS and ignition changes are published as soon as they happen; they,
+    # harsh driving events and the terminal wake the loop instead of polls
+    alarm.start(device.publish_telemetry, lambda: scheduler.trigger(input_id))
+    motion.notify = lambda: scheduler.trigger(input_id)
+    utils.start_terminal(s, lambda: scheduler.trigger(terminal_id))
+
+    # thread liveness counters reported with the diagnostics
+    diag.probe("accel", accel.stats)
+    diag.probe("alarm", lambda: alarm.polls)
+    diag.probe("outbox", lambda: outbox.sent)
+    diag.probe("loop", lambda: scheduler.wakeups)
+    diag.probe("boot", lambda: boot_time)
+    scheduler.run()
 
 except Exception as e:
     print("Failed telemetry loop", e)
     sleep(500)
-    mcu.reset()
+    utils.reset()
@@ -0,0 +1,176 @@
+# Motion statistics and harsh driving events from the accelerometer stream.
+#
+# The accel sampler calls sample() for every reading and end_block() after
+# each processed block. Work per sample is constant and all buffers are
+# preallocated. Statistics are accumulated separately for each registered
+# consumer, so readers don't reset each other's values.
+#
+# Acceleration is in g. Gravity is removed with a slow low-pass filter and
+# the dynamic part is projected on the vehicle axes given by the mounting
+# (_AXIS_FWD/_AXIS_LAT and signs).
+
+import math
+import timers
+
+_RATE = 100             # samples per second
+_WINDOW = 100           # RMS sliding window in samples
+_GRAVITY_COEF = 0.002   # gravity low-pass (~5s)
+_EVENT_COEF = 0.1       # event low-pass (~100ms)
+_AXIS_FWD = 0
+_SIGN_FWD = 1
+_AXIS_LAT = 1
+_SIGN_LAT = 1
+
+# event codes and thresholds in g
+EV_BRAKING = 1
+EV_ACCELERATION = 2
+EV_CORNERING = 3
+EV_IMPACT = 4
+_TH_BRAKING = 0.40
+_TH_ACCELERATION = 0.35
+_TH_CORNERING = 0.40
+_TH_IMPACT = 2.5
+_HOLDOFF = 2 * _RATE    # samples before the same event can trigger again
+
+_MAX_EVENTS = 8
+_MAX_CONSUMERS = 4
+
+# sliding window of squared dynamic acceleration
+_sq = [0.0] * _WINDOW
+_sq_sum = 0.0
+_sq_pos = 0
+
+_g = None               # gravity estimate [x,y,z]
+_prev = None            # previous sample
+_lon = 0.0
+_lat = 0.0
+_holdoff = [0, 0, 0, 0, 0]
+
+# block accumulators
+_b_sigma = 0.0
+_b_jerk = 0.0
+
+# per-consumer accumulators
+_consumers = 0
+_c_sigma = [0.0] * _MAX_CONSUMERS
+_c_jerk = [0.0] * _MAX_CONSUMERS
+_c_reset = [False] * _MAX_CONSUMERS
+_rms = 0.0
+
+# pending events ring: code, peak value, time
+_ev_code = [0] * _MAX_EVENTS
+_ev_value = [0.0] * _MAX_EVENTS
+_ev_time = [0] * _MAX_EVENTS
+_ev_head = 0
+_ev_tail = 0
+
+notify = None           # called by the sampler when an event is queued
+
+events_lost = 0
+
+
+def register():
+    """Returns a new consumer id for read()"""
+    global _consumers
+    if _consumers >= _MAX_CONSUMERS:
+        raise ValueError
+    _consumers += 1
+    return _consumers - 1
+
+
+def _event(code, value):
+    global _ev_head, _ev_tail, events_lost
+    _holdoff[code] = _HOLDOFF
+    n = (_ev_head + 1) % _MAX_EVENTS
+    if n == _ev_tail:
+        # full, drop the oldest
+        _ev_tail = (_ev_tail + 1) % _MAX_EVENTS
+        events_lost += 1
+    _ev_code[_ev_head] = code
+    _ev_value[_ev_head] = value
+    _ev_time[_ev_head] = timers.now()
+    _ev_head = n
+    if notify is not None:
+        notify()
+
+
+def sample(ax, ay, az, d2):
+    """Adds a raw sample; d2 is the squared deviation used for sigma"""
+    global _g, _prev, _sq_sum, _sq_pos, _lon, _lat, _b_sigma, _b_jerk
+    if _g is None:
+        _g = [ax, ay, az]
+        _prev = [ax, ay, az]
+    _g[0] += _GRAVITY_COEF * (ax - _g[0])
+    _g[1] += _GRAVITY_COEF * (ay - _g[1])
+    _g[2] += _GRAVITY_COEF * (az - _g[2])
+    dyn = (ax - _g[0], ay - _g[1], az - _g[2])
+    m2 = dyn[0]*dyn[0] + dyn[1]*dyn[1] + dyn[2]*dyn[2]
+    # sliding window RMS
+    _sq_sum += m2 - _sq[_sq_pos]
+    _sq[_sq_pos] = m2
+    _sq_pos += 1
+    if _sq_pos >= _WINDOW:
+        _sq_pos = 0
+    # jerk in g/s
+    j_x = ax - _prev[0]
+    j_y = ay - _prev[1]
+    j_z = az - _prev[2]
+    j2 = (j_x*j_x + j_y*j_y + j_z*j_z) * (_RATE * _RATE)
+    _prev[0] = ax
+    _prev[1] = ay
+    _prev[2] = az
+    if j2 > _b_jerk:
+        _b_jerk = j2
+    if d2 > _b_sigma:
+        _b_sigma = d2
+    # harsh events
+    _lon += _EVENT_COEF * (_SIGN_FWD * dyn[_AXIS_FWD] - _lon)
+    _lat += _EVENT_COEF * (_SIGN_LAT * dyn[_AXIS_LAT] - _lat)
+    for i in range(1, 5):
+        if _holdoff[i] > 0:
+            _holdoff[i] -= 1
+    if _holdoff[EV_IMPACT] == 0 and m2 > _TH_IMPACT * _TH_IMPACT:
+        _event(EV_IMPACT, math.sqrt(m2))
+    if _holdoff[EV_BRAKING] == 0 and _lon < -_TH_BRAKING:
+        _event(EV_BRAKING, -_lon)
+    if _holdoff[EV_ACCELERATION] == 0 and _lon > _TH_ACCELERATION:
+        _event(EV_ACCELERATION, _lon)
+    if _holdoff[EV_CORNERING] == 0 and (_lat > _TH_CORNERING or _lat < -_TH_CORNERING):
+        _event(EV_CORNERING, _lat if _lat > 0 else -_lat)
+
+
+def end_block():
+    """Folds the block statistics into each consumer"""
+    global _b_sigma, _b_jerk, _rms
+    _rms = math.sqrt(_sq_sum / _WINDOW) if _sq_sum > 0 else 0.0
+    for i in range(_consumers):
+        if _c_reset[i]:
+            _c_reset[i] = False
+            _c_sigma[i] = _b_sigma
+            _c_jerk[i] = _b_jerk
+        else:
+            if _b_sigma > _c_sigma[i]:
+                _c_sigma[i] = _b_sigma
+            if _b_jerk > _c_jerk[i]:
+                _c_jerk[i] = _b_jerk
+    _b_sigma = 0.0
+    _b_jerk = 0.0
+
+
+def read(consumer):
+    """Returns (sigma, jerk) peaks since the previous read by consumer and the
+    current RMS of the dynamic acceleration"""
+    res = (math.sqrt(_c_sigma[consumer]), math.sqrt(_c_jerk[consumer]), _rms)
+    _c_reset[consumer] = True
+    return res
+
+
+def get_event():
+    """Returns the oldest pending event as (code, value, time) or None"""
+    global _ev_tail
+    if _ev_tail == _ev_head:
+        return None
+    i = _ev_tail
+    res = (_ev_code[i], _ev_value[i], _ev_time[i])
+    _ev_tail = (i + 1) % _MAX_EVENTS
+    return res
@@ -0,0 +1,268 @@
+# Publish queue.
+#
+# The telemetry loop only enqueues messages; a sender thread publishes them
+# in order, so a slow or lossy link never holds up input polling, the
+# watchdog or the status LED. Messages that fail are stored to the backlog,
+# which the thread resends while the queue is idle; while the link is down
+# they go to the backlog without trying. Each publish holds alarm.lock and
+# waits, up to _ALARM_HOLD, while an alarm is pending, so alarms jump the
+# queue: they wait at most for the one message in flight.
+#
+# The queue is a ring of _SIZE slots. When it is full, put() follows the
+# policy: DROP_OLDEST drops the oldest queued message, DROP_NEWEST the new
+# one, COALESCE merges the new message into the last queued one when both
+# are JSON batches (the points are joined) or JSON points, the last one
+# with only fix fields and the new one with a position (the newer values
+# win), and otherwise moves the oldest to the backlog. Events, inputs and
+# sensor values are never merged: the dead-band filter has marked them as
+# sent. The message in flight is never touched.
+
+import threading
+import timers
+import alarm
+import diag
+import store
+
+DROP_OLDEST = 0
+DROP_NEWEST = 1
+COALESCE = 2
+
+# message kinds
+POINT = 0               # values of a single point
+BATCH = 1               # list of {"ts": ts, "values": values}
+PACKED = 2              # compact encoding, single point or batch
+ATTRIBUTES = 3
+
+_SIZE = 8
+_FIX = ("latitude", "longitude", "speed", "altitude", "COG", "nsat", "HDOP")
+_MAX_POINTS = 30        # points of a coalesced batch
+_ALARM_WAIT = 20        # ms between checks while an alarm is pending
+_ALARM_HOLD = 2000      # ms a message waits for a pending alarm
+
+_lock = threading.Lock()
+_ready = threading.Event()
+_values = [None] * _SIZE
+_ts = [None] * _SIZE
+_kind = [0] * _SIZE
+_head = 0
+_count = 0
+_busy = False           # the head is being published
+_spill = []             # [values, ts, kind] displaced from the queue
+
+_thread = None
+_device = None
+_policy = COALESCE
+_backlog_period = 1000
+_backlog_drain = 5
+_backlog_time = 0
+
+sent = 0
+failed = 0
+dropped = 0
+coalesced = 0
+displaced = 0           # moved to the backlog by COALESCE
+resent = 0
+depth_max = 0
+
+
+def depth():
+    return _count
+
+
+def _drop_oldest():
+    # removes the oldest message not in flight, returns [values, ts, kind]
+    # or None if there is none
+    global _count
+    first = 1 if _busy else 0
+    if _count <= first:
+        return None
+    i = (_head + first) % _SIZE
+    res = [_values[i], _ts[i], _kind[i]]
+    # shift the newer messages down over it
+    for k in range(first, _count - 1):
+        j = (_head + k) % _SIZE
+        n = (j + 1) % _SIZE
+        _values[j] = _values[n]
+        _ts[j] = _ts[n]
+        _kind[j] = _kind[n]
+    last = (_head + _count - 1) % _SIZE
+    _values[last] = None
+    _count -= 1
+    return res
+
+
+def _coalesce(values, ts, kind):
+    # merges into the last message not in flight, False if they don't match
+    global coalesced
+    if _count == 0 or (_busy and _count == 1):
+        return False
+    last = (_head + _count - 1) % _SIZE
+    if _kind[last] != kind:
+        return False
+    old = _values[last]
+    if kind == POINT:
+        # only a position replaced by the new one
+        if "latitude" not in values:
+            return False
+        for k in old:
+            if k not in _FIX:
+                return False
+        for k in values:
+            old[k] = values[k]
+        _ts[last] = ts
+    elif kind == BATCH and len(old) + len(values) <= _MAX_POINTS:
+        for p in values:
+            old.append(p)
+    else:
+        return False
+    coalesced += 1
+    return True
+
+
+def put(values, ts=None, kind=POINT):
+    """Queues a message of kind, ts is the unix ms string of a point or None.
+    Returns False if the message was dropped"""
+    global _count, depth_max, dropped, displaced
+    _lock.acquire()
+    try:
+        if _count == _SIZE:
+            if _policy == COALESCE and _coalesce(values, ts, kind):
+                _lock.release()
+                return True
+            old = None
+            if _policy != DROP_NEWEST:
+                old = _drop_oldest()
+            if old is None:
+                dropped += 1
+                _lock.release()
+                return False
+            if _policy == DROP_OLDEST or old[2] == ATTRIBUTES or len(_spill) >= _SIZE:
+                dropped += 1
+            else:
+                # stored by the sender thread, the only user of the backlog
+                _spill.append(old)
+                displaced += 1
+        i = (_head + _count) % _SIZE
+        _values[i] = values
+        _ts[i] = ts
+        _kind[i] = kind
+        _count += 1
+        if _count > depth_max:
+            depth_max = _count
+    except Exception as e:
+        _lock.release()
+        raise e
+    _lock.release()
+    _ready.set()
+    return True
+
+
+def _publish(values, ts=None, kind=POINT):
+    alarm.lock.acquire()
+    try:
+        if kind == ATTRIBUTES:
+            ok = _device.publish_attributes(values)
+        else:
+            ok = _device.publish_telemetry(values, ts)
+    except Exception as e:
+        print("Publish failed", e)
+        ok = False
+    alarm.lock.release()
+    return ok
+
+
+def _backlog(values, ts, kind):
+    # stores a message that could not be sent, a batch point by point
+    if kind == BATCH:
+        for p in values:
+            if not store.push(p["ts"], p["values"]):
+                print("Backlog store failed")
+    elif not store.push(ts, values):
+        print("Backlog store failed")
+
+
+def _send():
+    global _head, _count, _busy, sent, failed
+    _lock.acquire()
+    values = _values[_head]
+    ts = _ts[_head]
+    kind = _kind[_head]
+    _busy = True
+    _lock.release()
+    ok = False
+    if _device.is_connected():
+        t = timers.now()
+        ok = _publish(values, ts, kind)
+        diag.record(diag.PUBLISH, timers.now() - t)
+    if ok:
+        sent += 1
+    else:
+        failed += 1
+        if kind != ATTRIBUTES:
+            print("Publishing failed, storing to backlog")
+            _backlog(values, ts, kind)
+    _lock.acquire()
+    _values[_head] = None
+    _head = (_head + 1) % _SIZE
+    _count -= 1
+    _busy = False
+    _lock.release()
+
+
+def _unspill():
+    # stores the messages displaced by put() to the backlog
+    while True:
+        _lock.acquire()
+        if len(_spill) == 0:
+            _lock.release()
+            return
+        m = _spill.pop(0)
+        _lock.release()
+        _backlog(m[0], m[1], m[2])
+
+
+def _drain():
+    # resends stored records, oldest first, after any unsent alarm
+    global _backlog_time, resent
+    _backlog_time = timers.now()
+    if not _device.is_connected() or not store.pending() or alarm.pending():
+        return
+    n = store.drain(_publish, _backlog_drain)
+    diag.record(diag.BACKLOG, timers.now() - _backlog_time)
+    if n > 0:
+        resent += n
+        print("Resent from backlog:", n)
+
+
+def _run():
+    held = 0
+    while True:
+        if len(_spill) > 0:
+            _unspill()
+        if _count > 0 and held < _ALARM_HOLD and alarm.pending() and _device.is_connected():
+            # let the alarm lane go first
+            sleep(_ALARM_WAIT)
+            held += _ALARM_WAIT
+        elif _count > 0:
+            held = 0
+            _send()
+        else:
+            wait = _backlog_period - (timers.now() - _backlog_time)
+            if wait <= 0:
+                _drain()
+                continue
+            _ready.clear()
+            if _count == 0:
+                _ready.wait(wait)
+
+
+def start(device, policy=COALESCE, backlog_period=1000, backlog_drain=5):
+    """Starts the sender thread publishing to device"""
+    global _thread, _device, _policy, _backlog_period, _backlog_drain
+    if _thread is not None:
+        return
+    _device = device
+    _policy = policy
+    _backlog_period = backlog_period
+    _backlog_drain = backlog_drain
+    _thread = thread(_run)
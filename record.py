@@ -0,0 +1,74 @@
+# Fixed layout telemetry records.
+#
+# A record is a list allocated once with a slot for each field of
+# codec.FIELDS, in the same order: the loop stores a value with a plain
+# item assignment and None marks the fields not present. Records are cleared
+# and refilled at every cycle, so collecting a point builds no dict and costs
+# no call per field; the bitmask of the present fields is made by the
+# encoders, the values become strings or fixed point integers only when a
+# message is built.
+
+import codec
+
+LATITUDE = 0
+LONGITUDE = 1
+SPEED = 2
+ALTITUDE = 3
+COG = 4
+NSAT = 5
+HDOP = 6
+BATTERY = 7
+BACKUP = 8
+TEMPERATURE = 9
+SIGMA = 10
+PITCH = 11
+ROLL = 12
+IGNITION = 13
+SOS = 14
+CHARGER = 15
+EVENT = 16
+EVENT_G = 17
+JERK = 18
+RMS = 19
+FENCE = 20
+FENCE_EVENT = 21
+TRIP_DISTANCE = 22
+TRIP_TIME = 23
+TRIP_IDLE = 24
+TRIP_STOP = 25
+TRIP_VMAX = 26
+TRIP_VAVG = 27
+ODOMETER = 28
+
+SIZE = len(codec.FIELDS)
+
+
+def new():
+    return [None] * SIZE
+
+
+# the loops below, and those of the encoders, count with while, as a for over
+# a range allocates its iterator
+
+def clear(r):
+    i = 0
+    while i < SIZE:
+        r[i] = None
+        i += 1
+
+
+def count(r):
+    n = 0
+    i = 0
+    while i < SIZE:
+        if r[i] is not None:
+            n += 1
+        i += 1
+    return n
+
+
+def copy(dst, src):
+    i = 0
+    while i < SIZE:
+        dst[i] = src[i]
+        i += 1
@@ -0,0 +1,70 @@
+# Byte ring buffers for serial streams.
+#
+# A ring is a list [buffer, head, count, dropped] over a preallocated
+# bytearray. put() copies a whole block in at most two slices and counts the
+# bytes that don't fit, get() returns the longest contiguous block, so data
+# is never moved one byte at a time.
+
+_BUF = 0
+_HEAD = 1
+_COUNT = 2
+_DROPPED = 3
+
+
+def new(size):
+    return [bytearray(size), 0, 0, 0]
+
+
+def count(r):
+    return r[_COUNT]
+
+
+def free(r):
+    return len(r[_BUF]) - r[_COUNT]
+
+
+def dropped(r):
+    return r[_DROPPED]
+
+
+def clear(r):
+    r[_HEAD] = 0
+    r[_COUNT] = 0
+
+
+def put(r, data):
+    """Appends data, returns the number of bytes stored; the rest is dropped"""
+    buf = r[_BUF]
+    size = len(buf)
+    n = len(data)
+    f = size - r[_COUNT]
+    if n > f:
+        r[_DROPPED] += n - f
+        n = f
+    if n == 0:
+        return 0
+    tail = (r[_HEAD] + r[_COUNT]) % size
+    first = size - tail
+    if first > n:
+        first = n
+    buf[tail:tail + first] = data[0:first]
+    if n > first:
+        buf[0:n - first] = data[first:n]
+    r[_COUNT] += n
+    return n
+
+
+def get(r, n):
+    """Removes and returns up to n bytes, as a single contiguous block"""
+    buf = r[_BUF]
+    size = len(buf)
+    head = r[_HEAD]
+    if n > r[_COUNT]:
+        n = r[_COUNT]
+    if n > size - head:
+        n = size - head
+    data = buf[head:head + n]
+    r[_COUNT] -= n
+    # restart from the beginning when empty, for longer blocks
+    r[_HEAD] = (head + n) % size if r[_COUNT] > 0 else 0
+    return data
@@ -0,0 +1,108 @@
+# Cooperative scheduler for periodic tasks.
+#
+# Each task has its own period and next deadline; run() waits until the
+# earliest deadline and runs every task that is due, so tasks with
+# coinciding deadlines share a single wake-up. Deadlines advance by whole
+# periods: a task that misses one or more deadlines counts an overrun and
+# keeps its phase. With a handful of tasks a linear scan is cheaper than a
+# heap. trigger() may be called from other threads: it ends the wait, so
+# events are handled at once instead of at the next poll.
+
+import threading
+import timers
+
+# task fields
+_FN = 0
+_NAME = 1
+_PERIOD = 2
+_DEADLINE = 3
+_RUNS = 4
+_OVERRUNS = 5
+_JITTER_SUM = 6
+_JITTER_MAX = 7
+_BUSY_MAX = 8
+
+_tasks = []
+_wake = threading.Event()
+
+wakeups = 0
+
+
+def add(fn, name, period, delay=0):
+    """Registers fn to be called every period ms, first after delay ms.
+    Returns the task id."""
+    _tasks.append([fn, name, period, timers.now() + delay, 0, 0, 0, 0, 0])
+    return len(_tasks) - 1
+
+
+def set_period(task, period):
+    """Changes the period of task, keeping the time of its last run"""
+    t = _tasks[task]
+    if t[_PERIOD] != period:
+        t[_DEADLINE] += period - t[_PERIOD]
+        t[_PERIOD] = period
+
+
+def trigger(task, delay=0):
+    """Makes task due within delay ms, from any thread"""
+    t = _tasks[task]
+    deadline = timers.now() + delay
+    if deadline < t[_DEADLINE]:
+        t[_DEADLINE] = deadline
+        _wake.set()
+
+
+def stats(task):
+    """Returns (name, runs, overruns, avg jitter, max jitter, max run time) in ms"""
+    t = _tasks[task]
+    avg = t[_JITTER_SUM] // t[_RUNS] if t[_RUNS] > 0 else 0
+    return (t[_NAME], t[_RUNS], t[_OVERRUNS], avg, t[_JITTER_MAX], t[_BUSY_MAX])
+
+
+def count():
+    return len(_tasks)
+
+
+def dump():
+    print("Wake-ups:", wakeups)
+    for i in range(len(_tasks)):
+        print("Task:", stats(i))
+
+
+def run():
+    """Runs the tasks forever, exceptions are propagated to the caller"""
+    global wakeups
+    while True:
+        # cleared before the scan, so a trigger after it ends the wait
+        _wake.clear()
+        now = timers.now()
+        nxt = _tasks[0][_DEADLINE]
+        for t in _tasks:
+            if t[_DEADLINE] < nxt:
+                nxt = t[_DEADLINE]
+        if nxt > now:
+            _wake.wait(nxt - now)
+            now = timers.now()
+        wakeups += 1
+        for t in _tasks:
+            if t[_DEADLINE] > now:
+                continue
+            late = now - t[_DEADLINE]
+            t[_RUNS] += 1
+            t[_JITTER_SUM] += late
+            if late > t[_JITTER_MAX]:
+                t[_JITTER_MAX] = late
+            deadline = t[_DEADLINE]
+            t[_FN]()
+            end = timers.now()
+            if end - now > t[_BUSY_MAX]:
+                t[_BUSY_MAX] = end - now
+            if t[_DEADLINE] != deadline:
+                # rescheduled while running
+                continue
+            deadline += t[_PERIOD]
+            if deadline <= end:
+                t[_OVERRUNS] += 1
+                deadline += ((end - deadline) // t[_PERIOD] + 1) * t[_PERIOD]
+            t[_DEADLINE] = deadline
+            now = end
@@ -0,0 +1,50 @@
+# Shared cache of the slow board sensors.
+#
+# Every source is read from hardware at most once per its time-to-live and
+# all consumers (utility thread, telemetry, charger logic) get the cached
+# value. Temperature is already cached by the accel sampler.
+
+import timers
+import trace
+from fortebit.polaris import polaris
+
+MAIN_VOLTAGE = 0
+BATT_VOLTAGE = 1
+BATTERY_BACKUP = 2
+CHARGER = 3
+
+_NAMES = ("main", "batt", "backup", "charger")
+_READ = (polaris.readMainVoltage, polaris.readBattVoltage, polaris.isBatteryBackup, polaris.getChargerStatus)
+_TTL = [1000, 1000, 500, 1000]      # ms
+
+_value = [None, None, None, None]
+_time = [0, 0, 0, 0]
+
+reads = [0, 0, 0, 0]                # physical reads per source
+requests = [0, 0, 0, 0]
+
+
+def sample(src):
+    """Returns (value, time) of src, reading it if older than its TTL"""
+    requests[src] += 1
+    t = timers.now()
+    if _value[src] is None or t - _time[src] >= _TTL[src]:
+        _value[src] = _READ[src]()
+        _time[src] = t
+        reads[src] += 1
+        if trace.enabled:
+            trace.sensor(src, _value[src])
+    return (_value[src], _time[src])
+
+
+def get(src):
+    return sample(src)[0]
+
+
+def set_ttl(src, ttl):
+    _TTL[src] = ttl
+
+
+def dump():
+    for i in range(len(_NAMES)):
+        print("Sensor:", _NAMES[i], "reads", reads[i], "requests", requests[i], "value", _value[i])
@@ -0,0 +1,268 @@
+# Settings cached in RAM and persisted as a journal in flash.
+#
+# The journal spans a ring of flash blocks. Each block starts with a 4 bytes
+# sequence number and a snapshot record of all settings, followed by update
+# records with the keys changed by each commit (None removes a key):
+#   magic (1) | type (1) | length (2) | checksum (2) | JSON payload
+# A commit is a single record, so it is applied entirely or not at all.
+# When a block is full the settings are compacted into a snapshot on the
+# next block of the ring, spreading erases over all of them.
+# On load the newest block with a valid snapshot is replayed up to the
+# first damaged record; if any is found the next commit compacts.
+# A snapshot must fit in a block with its header: a commit that would make
+# the settings longer than MAX_SIZE bytes of JSON raises ValueError and
+# leaves the cache and the flash as they were. The sequence number of a
+# new block is adopted only once its snapshot is written.
+
+import json
+import threading
+from fortebit.polaris import qspiflash
+
+_BLOCK_SIZE = 0x10000   # erase block size of the QSPI flash
+_FIRST_BLOCK = 1        # block 0 holds legacy settings
+_NUM_BLOCKS = 4
+_HDR = 4                # block header size (sequence number)
+_REC = 6                # record header size
+_MAGIC = 0x5A
+_SNAPSHOT = 0x53
+_UPDATE = 0x55
+_ERASED = 0xFFFFFFFF
+
+MAX_SIZE = _BLOCK_SIZE - _HDR - _REC    # longest snapshot payload
+
+_lock = threading.Lock()
+_flash = None
+_cache = None
+_staged = {}
+_seq = 0
+_wpos = _BLOCK_SIZE     # no block open yet
+_dirty = False          # damaged records found, compact on next commit
+
+erases = 0
+writes = 0
+
+
+def _addr(seq):
+    return (_FIRST_BLOCK + seq % _NUM_BLOCKS) * _BLOCK_SIZE
+
+
+def _checksum(data):
+    a = 0
+    b = 0
+    for c in data:
+        a = (a + c) % 255
+        b = (b + a) % 255
+    return (b << 8) | a
+
+
+def _read_record(addr, end):
+    # returns (type, payload) or None if missing or damaged
+    if addr + _REC > end:
+        return None
+    h = _flash.read_data(addr, _REC)
+    if h[0] != _MAGIC:
+        return None
+    n = (h[2] << 8) | h[3]
+    if addr + _REC + n > end:
+        return None
+    data = _flash.read_data(addr + _REC, n)
+    if _checksum(data) != ((h[4] << 8) | h[5]):
+        return None
+    return (h[1], data)
+
+
+def _record(rtype, obj):
+    # raises ValueError before anything is written if obj cannot fit a block
+    data = bytes(json.dumps(obj))
+    n = len(data)
+    if n > MAX_SIZE:
+        raise ValueError("settings too large")
+    c = _checksum(data)
+    return bytes([_MAGIC, rtype, n >> 8, n & 0xFF, c >> 8, c & 0xFF]) + data
+
+
+def _append(rec):
+    global _wpos, _dirty, writes
+    _dirty = True           # a partial record must not be written over
+    _flash[_addr(_seq) + _wpos] = rec
+    _wpos += len(rec)
+    writes += 1
+    _dirty = False
+
+
+def _compact(rec):
+    # writes the snapshot record rec on the next block of the ring
+    global _seq, _wpos, _dirty, erases, writes
+    seq = _seq + 1
+    addr = _addr(seq)
+    _flash.erase_block(addr)
+    erases += 1
+    _flash[addr] = bytes([(seq >> 24) & 0xFF, (seq >> 16) & 0xFF, (seq >> 8) & 0xFF, seq & 0xFF])
+    _flash[addr + _HDR] = rec
+    writes += 1
+    # until here a failure leaves the current block in use
+    _seq = seq
+    _wpos = _HDR + len(rec)
+    _dirty = False
+
+
+def _legacy():
+    # settings saved by previous firmware at the start of block 0
+    data = _flash.read_data(0, 128)
+    try:
+        if not data.find("\n") < 0:
+            return json.loads(data[0:data.find("\n")])
+    except Exception as e:
+        pass
+    return {}
+
+
+def load():
+    """Loads the settings from flash, called once before any other function"""
+    global _flash, _cache, _seq, _wpos, _dirty
+    _lock.acquire()
+    try:
+        if _flash is None:
+            _flash = qspiflash.QSpiFlash()
+        seqs = []
+        for b in range(_NUM_BLOCKS):
+            h = _flash.read_data((_FIRST_BLOCK + b) * _BLOCK_SIZE, _HDR)
+            seq = (h[0] << 24) | (h[1] << 16) | (h[2] << 8) | h[3]
+            if seq != _ERASED and seq % _NUM_BLOCKS == b:
+                seqs.append(seq)
+        top = -1
+        for seq in seqs:
+            if seq > top:
+                top = seq
+        _cache = None
+        _staged.clear()
+        while len(seqs) > 0:
+            # newest first
+            i = 0
+            for j in range(1, len(seqs)):
+                if seqs[j] > seqs[i]:
+                    i = j
+            seq = seqs.pop(i)
+            addr = _addr(seq)
+            end = addr + _BLOCK_SIZE
+            pos = addr + _HDR
+            r = _read_record(pos, end)
+            if r is None or r[0] != _SNAPSHOT:
+                # interrupted compaction, use the previous block
+                continue
+            _cache = json.loads(r[1])
+            _seq = seq
+            _dirty = False
+            while True:
+                pos += _REC + len(r[1])
+                r = _read_record(pos, end)
+                if r is None:
+                    break
+                if r[0] == _UPDATE:
+                    upd = json.loads(r[1])
+                    for k in upd:
+                        if upd[k] is None:
+                            if k in _cache:
+                                del _cache[k]
+                        else:
+                            _cache[k] = upd[k]
+            _wpos = pos - addr
+            if _wpos < _BLOCK_SIZE and _flash.read_data(pos, 1)[0] != 0xFF:
+                _dirty = True
+            break
+        if _cache is None:
+            _cache = _legacy()
+            _seq = top
+            _dirty = True
+    except Exception as e:
+        _lock.release()
+        raise e
+    _lock.release()
+
+
+def get(key, default=None):
+    if key in _staged:
+        v = _staged[key]
+        return default if v is None else v
+    if key in _cache:
+        return _cache[key]
+    return default
+
+
+def read():
+    """Returns a copy of the committed settings"""
+    res = {}
+    for k in _cache:
+        res[k] = _cache[k]
+    return res
+
+
+def set(key, value):
+    """Stages a change, value None removes the key; saved on commit()"""
+    _lock.acquire()
+    _staged[key] = value
+    _lock.release()
+
+
+def remove(key):
+    _lock.acquire()
+    _staged[key] = None
+    _lock.release()
+
+
+def commit():
+    """Writes all staged changes as a single record; raises ValueError,
+    dropping them, if the settings would not fit a flash block"""
+    global _cache
+    _lock.acquire()
+    try:
+        upd = {}
+        for k in _staged:
+            v = _staged[k]
+            if v is None:
+                if k in _cache:
+                    upd[k] = None
+            elif k not in _cache or _cache[k] != v:
+                upd[k] = v
+        _staged.clear()
+        cache = _cache
+        if len(upd) > 0:
+            cache = {}
+            for k in _cache:
+                cache[k] = _cache[k]
+            for k in upd:
+                if upd[k] is None:
+                    del cache[k]
+                else:
+                    cache[k] = upd[k]
+        if _dirty:
+            _compact(_record(_SNAPSHOT, cache))
+        elif len(upd) > 0:
+            rec = _record(_UPDATE, upd)
+            if _wpos + len(rec) > _BLOCK_SIZE:
+                _compact(_record(_SNAPSHOT, cache))
+            else:
+                # the snapshot of cache is no longer than the records of
+                # the block, so it is only checked when compacting
+                _append(rec)
+        _cache = cache
+    except Exception as e:
+        _lock.release()
+        raise e
+    _lock.release()
+
+
+def erase():
+    """Removes all settings"""
+    global _cache, erases
+    _lock.acquire()
+    try:
+        _staged.clear()
+        _flash.erase_block(0)
+        erases += 1
+        _compact(_record(_SNAPSHOT, {}))
+        _cache = {}
+    except Exception as e:
+        _lock.release()
+        raise e
+    _lock.release()
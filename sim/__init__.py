@@ -0,0 +1,11 @@
+"""Host-side simulation of the Polaris firmware.
+
+The unmodified application modules are loaded under CPython with stand-ins
+for the Zerynth VM builtins and the Polaris hardware libraries, and run on
+a virtual clock. A scenario drives the board inputs and the network, and
+the run reports publishes, bytes sent, wake-ups, flash usage and latency.
+
+    python -m sim.run --seconds 900
+
+This package is a development tool and is not part of the device build.
+"""
@@ -0,0 +1,112 @@
+"""Cost of the accelerometer sampler: wake-ups, lock acquisitions and CPU per sample.
+
+Only accel.py runs, on a board whose accelerometer returns gravity plus
+vibration noise, while a reader thread calls the getters every --period
+ms as the telemetry task does. Every acquisition of a firmware lock is
+counted, and each run of accel._update() is timed on the host; the time
+is CPython time, meant to compare versions of accel.py on the same host,
+for instance the sampler before the block processing:
+
+    git worktree add /tmp/base efc3554~1
+    python -m sim.bench_accel --root . --root /tmp/base [--seconds N] [--period MS]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from sim.board import Board
+from sim.kernel import Kernel
+from sim.zerynth import ROOT, Loader
+
+
+def bench(root=None, seconds=60, period=2000, seed=1):
+    kernel = Kernel(until=seconds * 1000)
+    board = Board(kernel, seed)
+    board.vibration = 0.02
+    loader = Loader(kernel, board, root or ROOT)
+    locks = [0, 0]      # acquisitions, acquisitions that had to wait
+    threading = loader.fakes["threading"]
+    Lock = threading.Lock
+
+    class CountingLock(Lock):
+
+        def acquire(self, *args, **kw):
+            locks[0] += 1
+            if self.locked():
+                locks[1] += 1
+            return Lock.acquire(self, *args, **kw)
+    threading.Lock = CountingLock
+
+    accel = loader.load("accel")
+    cpu = [0, 0.0]      # samples, seconds
+    getters = [0, 0]    # failed calls, max virtual ms blocked
+    update = accel._update
+
+    def timed():
+        t = time.perf_counter()
+        update()
+        cpu[1] += time.perf_counter() - t
+        cpu[0] += 1
+    accel._update = timed
+
+    def reader():
+        # early versions assign globals in start() and get_sigma() without a
+        # global statement, which CPython rejects: the sampler is started
+        # here and a failing getter is dropped, releasing the lock it held
+        fns = [accel.get_pitchroll, accel.get_sigma, accel.get_temperature]
+        accel.start()
+        if len(kernel.threads) == 1:
+            loader.builtins["thread"](accel._run, "Accel Task")
+        while True:
+            kernel.sleep(period)
+            t = kernel.now
+            for fn in list(fns):
+                try:
+                    fn()
+                except Exception:
+                    getters[0] += 1
+                    fns.remove(fn)
+                    lock = getattr(accel, "_lock", None)
+                    if lock is not None and lock.locked():
+                        lock.release()
+            getters[1] = max(getters[1], kernel.now - t)
+
+    kernel.spawn(reader, (), "reader")
+    kernel.run()
+    sampler = 0
+    for name in kernel.wakeups:
+        if name.startswith("accel."):
+            sampler += kernel.wakeups[name]
+    return {
+        "wakeups": sampler / float(seconds),
+        "locks": locks[0] / float(seconds),
+        "contended": locks[1],
+        "samples": cpu[0] / float(seconds),
+        "us": 1e6 * cpu[1] / max(1, cpu[0]),
+        "reads": (board.reads.get("accel", 0) + board.reads.get("temperature", 0)) / float(seconds),
+        "blocked": getters[1],
+        "failed": getters[0],
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Measure the accelerometer sampler")
+    p.add_argument("--root", action="append", default=[], help="firmware directory, repeat to compare")
+    p.add_argument("--seconds", type=int, default=60)
+    p.add_argument("--period", type=int, default=2000, help="getter period in ms")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args(argv)
+    print("%-16s %9s %9s %9s %9s %9s %11s %10s" % ("firmware", "wakeup/s", "locks/s", "contended", "samples/s",
+                                                   "us/sample", "bus reads/s", "blocked ms"))
+    for root in args.root or [None]:
+        r = bench(root, args.seconds, args.period, args.seed)
+        name = os.path.basename(os.path.abspath(root or ".")) if root != "." else "."
+        print("%-16s %9.1f %9.1f %9d %9.1f %9.1f %11.1f %10d" % (name[-16:], r["wakeups"], r["locks"], r["contended"],
+                                                                 r["samples"], r["us"], r["reads"], r["blocked"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
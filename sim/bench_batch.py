@@ -0,0 +1,80 @@
+"""Payload bytes and publish calls per hour, one message per fix against batches.
+
+The firmware drives the default route over and over with main.batch_size
+set to each --size in turn; size 1 publishes one message per fix. Alarms
+are published on their own in every run. The bytes on air add --overhead
+bytes per publish to the payload: the MQTT, TLS and TCP/IP headers of the
+publish and of its acknowledgement, about 200 bytes with QoS 1. Usage:
+
+    python -m sim.bench_batch [--seconds N] [--size N ...] [--compact] [--fixed] [--overhead B]
+
+With --fixed, positions are reported at every gps_period instead of
+adaptively, as before track.py.
+"""
+
+import argparse
+import json
+import sys
+
+from sim.run import default_scenario, simulate
+
+_LAP = 900      # s, length of the default route
+
+
+def _points(payload, codec):
+    v = json.loads(payload)
+    if isinstance(v, list):
+        return len(v)
+    z = v.get("values", v).get("z")
+    if z is not None:
+        return len(codec.decode(codec.unhexlify(z)))
+    return 1
+
+
+def bench(size, seconds=3600, compact=False, fixed=False, overhead=200, seed=1):
+    scenario = []
+    for t in range(0, seconds, _LAP):
+        scenario.extend(default_scenario(t + 60))
+    overrides = {"main.batch_size": size, "main.compact_telemetry": compact}
+    if fixed:
+        overrides["main.adaptive_reporting"] = False
+    kernel, board, loader, reason = simulate(seconds, seed, scenario=scenario, overrides=overrides)
+    codec = loader.modules["codec"]
+    calls = 0
+    data = 0
+    points = 0
+    for m in board.broker.messages:
+        if m[1] == "telemetry":
+            calls += 1
+            data += len(m[2])
+            points += _points(m[2], codec)
+    scale = 3600.0 / seconds
+    return {"calls": calls * scale, "bytes": data * scale, "air": (data + calls * overhead) * scale,
+            "points": points * scale}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Compare batched telemetry with one message per fix")
+    p.add_argument("--seconds", type=int, default=3600)
+    p.add_argument("--size", type=int, action="append", default=[], help="points per message, repeat to compare")
+    p.add_argument("--compact", action="store_true", help="publish compact telemetry")
+    p.add_argument("--fixed", action="store_true", help="report positions at a fixed period")
+    p.add_argument("--overhead", type=int, default=200, help="bytes on air per publish besides the payload")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args(argv)
+    sizes = args.size or [1, 6, 12]
+    base = None
+    print("%-6s %10s %10s %10s %10s %10s %8s" % ("batch", "publish/h", "points/h", "payload/h", "air/h",
+                                                 "air/pt", "saved"))
+    for size in sizes:
+        r = bench(size, args.seconds, args.compact, args.fixed, args.overhead, args.seed)
+        if base is None:
+            base = r
+        saved = 100.0 * (1 - r["air"] / base["air"]) if base["air"] > 0 else 0
+        print("%-6d %10.0f %10.0f %10.0f %10.0f %10.1f %7.0f%%" % (size, r["calls"], r["points"], r["bytes"],
+                                                                   r["air"], r["air"] / max(1, r["points"]), saved))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
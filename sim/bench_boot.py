@@ -0,0 +1,79 @@
+"""Time to first publish and to the first GNSS fix after a cold and a warm boot.
+
+The cold boot starts with only the user settings in flash. The board is
+power cycled at --cycle seconds for a warm boot, with whatever the first
+boot saved, with the ignition on. The receiver needs --ttff ms for a fix without aiding, or
+--aided ms after a valid position and time are injected. Usage:
+
+    python -m sim.bench_boot [--cycle S] [--register MS] [--cloud MS] [--ttff MS] [--aided MS]
+"""
+
+import argparse
+import sys
+
+from sim.kernel import SimReset
+from sim.run import simulate
+
+
+def _power_cycle(board):
+    raise SimReset("power cycle")
+
+
+def _first(board, topic, since):
+    for m in board.broker.messages:
+        if m[1] == topic and m[0] >= since:
+            return m[0] - since
+    return None
+
+
+def _after(times, since):
+    for t in times:
+        if t >= since:
+            return t - since
+    return None
+
+
+def bench(cycle=120, register=8000, cloud=2000, ttff=35000, aided=12000, seed=1):
+    res = {}
+
+    def setup(b):
+        b.ignition = 1
+        b.register_time = register
+        b.cloud_latency = cloud
+        b.ttff_cold = ttff
+        b.ttff_aided = aided
+
+    scenario = [(0, setup), (cycle, _power_cycle)]
+    kernel, board, loader, reason = simulate(cycle + 120, seed, scenario=scenario)
+    for i in range(len(board.boot_times)):
+        t = board.boot_times[i]
+        res[i] = (_first(board, "attributes", t), _first(board, "telemetry", t), _after(board.fix_times, t))
+    res["cloud_calls"] = board.cloud_calls
+    res["flash_writes"] = board.flash.writes
+    res["aids"] = len(board.aids)
+    return res
+
+
+def _s(ms):
+    return "-" if ms is None else "%.1f" % (ms / 1000.0)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark boot time")
+    p.add_argument("--cycle", type=int, default=120, help="time of the power cycle in s")
+    p.add_argument("--register", type=int, default=8000, help="network registration time in ms")
+    p.add_argument("--cloud", type=int, default=2000, help="cloud API round trip in ms")
+    p.add_argument("--ttff", type=int, default=35000, help="time to first fix without aiding in ms")
+    p.add_argument("--aided", type=int, default=12000, help="time to first fix after aiding in ms")
+    args = p.parse_args(argv)
+    r = bench(args.cycle, args.register, args.cloud, args.ttff, args.aided)
+    print("%-6s %14s %14s %14s" % ("boot", "attributes s", "telemetry s", "first fix s"))
+    for i, name in ((0, "cold"), (1, "warm")):
+        if i in r:
+            print("%-6s %14s %14s %14s" % (name, _s(r[i][0]), _s(r[i][1]), _s(r[i][2])))
+    print("Cloud API calls: %d, flash writes: %d, GNSS aiding sent: %d" % (r["cloud_calls"], r["flash_writes"], r["aids"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Bytes saved by the telemetry dead-band filter, and the staleness it adds.
+
+The firmware runs with the filter bypassed on a day-like trace: a drive
+with the ignition on, the engine warming up and the road changing slope,
+then a long stop while the vehicle cools down and the battery discharges.
+Every telemetry record is recorded before filtering and replayed through
+deadband.apply(). The report gives the JSON and compact payload of the
+points with and without the filter and, per field, how many values were
+sent, the longest time a value went unsent and the largest difference
+between the true value and the last sent one. Usage:
+
+    python -m sim.bench_deadband [--seconds N] [--drive S] [--seed N]
+"""
+
+import argparse
+import json
+import math
+import sys
+
+from sim.board import Board
+from sim.kernel import Kernel
+from sim.run import simulate
+from sim.zerynth import Loader
+
+
+def _scenario(seconds, drive, seed):
+    events = [(60, lambda b: setattr(b, "ignition", 1))]
+
+    def step(t):
+        def f(b):
+            r = b.rng
+            on = t < drive
+            if on:
+                # engine warming up, alternator charging
+                b.temperature = 35.0 - 10.0 * math.exp(-t / 900.0) + r.uniform(-0.3, 0.3)
+                b.main_voltage = 14.1 + r.uniform(-0.1, 0.1)
+                slope = math.radians(4.0 * math.sin(t / 400.0))
+                b.gravity = (math.sin(slope), 0.0, math.cos(slope))
+                b.nsat = 8 + r.randint(-2, 3)
+                b.hdop = 0.8 + r.uniform(0.0, 0.5)
+                b.position = (b.position[0], b.position[1], 120.0 + 30.0 * math.sin(t / 600.0))
+                b.drive(50 + r.randint(-10, 10), (b.cog + r.choice((0, 0, 0, 15, -15, 90))) % 360)
+            else:
+                stop = t - drive
+                b.temperature = 15.0 + 20.0 * math.exp(-stop / 3600.0) + r.uniform(-0.2, 0.2)
+                b.main_voltage = 12.6 - 0.3 * stop / 86400.0 + r.uniform(-0.02, 0.02)
+                b.gravity = (0.0, 0.0, 1.0)
+                b.nsat = 9 + r.randint(-1, 1)
+                b.hdop = 0.9 + r.uniform(-0.1, 0.1)
+                if b.ignition:
+                    b.ignition = 0
+                    b.drive(0, b.cog)
+        return f
+
+    for t in range(60, seconds, 30):
+        events.append((t, step(t)))
+    return events
+
+
+def record(seconds=14400, drive=3600, seed=1):
+    """Runs the firmware with the filter bypassed, returns [(now, record)]."""
+    trace = []
+
+    def setup(loader):
+        deadband = loader.load("deadband")
+
+        def bypass(r, now):
+            trace.append((now, list(r)))
+        deadband.apply = bypass
+
+    simulate(seconds, seed, scenario=_scenario(seconds, drive, seed), setup=setup)
+    return trace
+
+
+def replay(trace):
+    """Runs the trace through a fresh filter, returns a dict of results."""
+    kernel = Kernel()
+    loader = Loader(kernel, Board(kernel, 1))
+    deadband = loader.load("deadband")
+    codec = loader.load("codec")
+    angles = deadband._ANGLES
+    res = {"points": len(trace), "json": [0, 0], "compact": [0, 0], "fields": {}}
+    sent = {}
+    for f in deadband.FIELDS:
+        # values in, values sent, max staleness ms, max error
+        res["fields"][codec.FIELDS[f[0]][0]] = [0, 0, 0, 0.0]
+    for now, t in trace:
+        out = list(t)
+        deadband.apply(out, now)
+        res["json"][0] += len(json.dumps(codec.format(t)))
+        res["json"][1] += len(json.dumps(codec.format(out)))
+        res["compact"][0] += codec.encode([(None, t)])
+        res["compact"][1] += codec.encode([(None, out)])
+        for f in deadband.FIELDS:
+            i = f[0]
+            if t[i] is None:
+                continue
+            s = res["fields"][codec.FIELDS[i][0]]
+            s[0] += 1
+            if out[i] is not None:
+                s[1] += 1
+                sent[i] = (t[i], now)
+                continue
+            last = sent[i]
+            err = abs(t[i] - last[0])
+            if i in angles and err > 180:
+                err = 360 - err
+            s[2] = max(s[2], now - last[1])
+            s[3] = max(s[3], err)
+    return res
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark the telemetry dead-band filter")
+    p.add_argument("--seconds", type=int, default=14400)
+    p.add_argument("--drive", type=int, default=3600, help="length of the drive in s")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args(argv)
+    r = replay(record(args.seconds, args.drive, args.seed))
+    print("Points: %d" % r["points"])
+    for kind in ("json", "compact"):
+        b = r[kind]
+        print("%-8s %7d -> %7d bytes, %4.1f%% saved" % (kind, b[0], b[1], 100.0 * (b[0] - b[1]) / max(1, b[0])))
+    print("%-12s %6s %6s %12s %10s" % ("field", "values", "sent", "max stale s", "max error"))
+    for name in sorted(r["fields"]):
+        f = r["fields"][name]
+        print("%-12s %6d %6d %12.0f %10.3f" % (name, f[0], f[1], f[2] / 1000.0, f[3]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Cost of the geofence check with synthetic fence sets.
+
+Fences (half circles of 50-500 m, half polygons of 4-8 vertices up to
+1 km across, plus a few regional ones of 20-50 km) are scattered over a
+--area km square; a vehicle drives through them for --fixes fixes, one
+every 2 s at 50 km/h. For each set size the report gives the fences tested
+per fix with the grid index and without it (every fence), the host time per
+fix, the index size and the events, which must match the ones found
+testing every fence. Usage:
+
+    python -m sim.bench_geofence [--fences N,N,...] [--area KM] [--fixes N]
+"""
+
+import argparse
+import math
+import random
+import sys
+import time
+
+from sim.board import Board
+from sim.kernel import Kernel
+from sim.zerynth import Loader
+
+_LAT = 45.4642
+_LON = 9.1900
+
+
+def _offset(lat, lon, dx, dy):
+    k = 6371000.0 * math.pi / 180
+    return lat + dy / k, lon + dx / (k * math.cos(math.radians(lat)))
+
+
+def fences(n, area, rng):
+    """Returns n random fences over an area km wide."""
+    res = []
+    half = area * 500.0
+    for i in range(n):
+        lat, lon = _offset(_LAT, _LON, rng.uniform(-half, half), rng.uniform(-half, half))
+        if i % 50 == 49:
+            r = rng.uniform(10000, 25000)
+        else:
+            r = rng.uniform(50, 500)
+        if i % 2 == 0:
+            res.append([i + 1, lat, lon, r])
+            continue
+        v = []
+        nv = rng.randint(4, 8)
+        for j in range(nv):
+            a = 2 * math.pi * j / nv
+            p = _offset(lat, lon, r * math.cos(a) * rng.uniform(0.5, 1.0), r * math.sin(a) * rng.uniform(0.5, 1.0))
+            v.extend(p)
+        res.append([i + 1, v])
+    return res
+
+
+def route(nfixes, area, rng):
+    """Returns a wandering route of nfixes positions, 28 m apart."""
+    res = []
+    lat, lon = _LAT, _LON
+    cog = 0.0
+    half = area * 450.0
+    x = y = 0.0
+    for _ in range(nfixes):
+        cog += rng.uniform(-0.2, 0.2)
+        x += 28 * math.sin(cog)
+        y += 28 * math.cos(cog)
+        if abs(x) > half or abs(y) > half:
+            cog += math.pi
+        res.append(_offset(lat, lon, x, y))
+    return res
+
+
+def _events(geofence, now):
+    res = []
+    while True:
+        ev = geofence.get_event(now)
+        if ev is None:
+            return res
+        res.append(ev)
+
+
+def bench(n, area=50, nfixes=5000, seed=1):
+    rng = random.Random(seed)
+    kernel = Kernel()
+    loader = Loader(kernel, Board(kernel, seed))
+    geofence = loader.load("geofence")
+    fs = fences(n, area, rng)
+    path = route(nfixes, area, rng)
+    geofence.load(fs)
+    res = {"fences": geofence.count(), "large": len(geofence._large), "cells": len(geofence._grid),
+           "entries": sum(len(c) for c in geofence._grid.values())}
+    tested = 0
+    tested_max = 0
+    events = []
+    t0 = time.perf_counter()
+    for k in range(nfixes):
+        geofence.check(path[k][0], path[k][1], k * 2000)
+        tested += geofence.tested
+        tested_max = max(tested_max, geofence.tested)
+        events.extend(_events(geofence, k * 2000))
+    res["us"] = (time.perf_counter() - t0) * 1e6 / nfixes
+    # every fence, with the same hysteresis
+    inside = set()
+    brute = []
+    t0 = time.perf_counter()
+    for k in range(nfixes):
+        lat, lon = path[k]
+        for i in range(geofence.count()):
+            if i in inside:
+                if not geofence.contains(i, lat, lon, geofence._MARGIN):
+                    inside.discard(i)
+                    brute.append((fs[i][0], geofence.FENCE_EXIT))
+            elif geofence.contains(i, lat, lon):
+                inside.add(i)
+                brute.append((fs[i][0], geofence.FENCE_ENTER))
+    res["brute_us"] = (time.perf_counter() - t0) * 1e6 / nfixes
+    res["tested"] = tested / float(nfixes)
+    res["tested_max"] = tested_max
+    res["events"] = len(events)
+    res["dwell"] = len([e for e in events if e[1] == geofence.FENCE_DWELL])
+    indexed = sorted((e[0], e[1]) for e in events if e[1] != geofence.FENCE_DWELL)
+    res["match"] = indexed == sorted(brute)
+    return res
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark the geofence index")
+    p.add_argument("--fences", default="100,300,500")
+    p.add_argument("--area", type=int, default=50, help="side of the area in km")
+    p.add_argument("--fixes", type=int, default=5000)
+    args = p.parse_args(argv)
+    print("%7s %6s %8s %8s %11s %8s %8s %10s %7s %6s" % ("fences", "large", "cells", "entries", "tested/fix",
+                                                       "max", "us/fix", "all us/fix", "events", "match"))
+    err = 0
+    for n in args.fences.split(","):
+        r = bench(int(n), args.area, args.fixes)
+        print("%7d %6d %8d %8d %11.1f %8d %8.1f %10.1f %7d %6s" % (r["fences"], r["large"], r["cells"], r["entries"],
+                                                                 r["tested"], r["tested_max"], r["us"],
+                                                                 r["brute_us"], r["events"], r["match"]))
+        if not r["match"]:
+            err = 1
+    return err
+
+
+if __name__ == "__main__":
+    sys.exit(main())
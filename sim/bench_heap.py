@@ -0,0 +1,163 @@
+"""Heap allocations of the telemetry loop over a long run.
+
+The firmware drives the default route over and over with the console
+rendered to a sink, so every print formats its arguments as on the device.
+The firmware runs twice. In the first run tracemalloc gives the heap
+high-water mark over the memory in use at the first telemetry cycle and
+the heap growth from the end of the first lap to the end of the run. In
+the second, each run of the telemetry task is traced opcode by opcode: an
+opcode after which more memory is in use counts as one allocation. Int
+objects below 2**30 are not counted, the Zerynth VM keeps them unboxed.
+
+The sizes are CPython object sizes, larger than on the VM; the numbers are
+meant to compare firmware versions on the same run, for instance the
+working tree with the previous commit:
+
+    git worktree add /tmp/base HEAD~1
+    python -m sim.bench_heap --root . --root /tmp/base [--seconds N] [--compact]
+"""
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+from sim.board import Board
+from sim.run import default_scenario, simulate
+
+_LAP = 900      # s, length of the default route
+_INT = 28       # bytes of a CPython int below 2**30
+
+
+class _Sink(object):
+
+    def write(self, data):
+        pass
+
+
+class _SoakBoard(Board):
+    # the broker keeps no payloads, so they don't count as retained
+
+    def __init__(self, kernel, seed=1):
+        Board.__init__(self, kernel, seed)
+        self.published = 0
+        broker = self.broker
+
+        def publish(topic, payload):
+            self.published += 1
+            broker.bytes += len(payload)
+            return True
+        broker.publish = publish
+
+
+def soak(root, seconds=14400, compact=False, seed=1, count=False):
+    """Runs the firmware in root, returns a dict of results.
+
+    With count, the telemetry task is traced to count its allocations; the
+    frames the tracer keeps make the heap figures of that run unreliable.
+    """
+    # cycles, allocations, bytes, max allocations in a cycle; running totals,
+    # so the bench itself doesn't grow the heap
+    cycles = [0, 0, 0, 0]
+    heap = [None, 0, 0, 0]  # at the first cycle, high-water mark, after the first lap, at the end
+    state = [0, 0, 0, 0]    # memory in use, kernel switch count, allocations, bytes
+
+    def measure(fn, kernel):
+        def step(frame, event, arg):
+            cur = tracemalloc.get_traced_memory()[0]
+            d = cur - state[0]
+            # skip the frame the tracer makes for each call, and the memory
+            # other threads took while this one slept
+            if d > 0 and d != _INT and event != "call" and kernel._order == state[1]:
+                state[2] += 1
+                state[3] += d
+            state[0] = cur
+            state[1] = kernel._order
+            return step
+
+        def trace(frame, event, arg):
+            frame.f_trace_opcodes = True
+            return step(frame, event, arg)
+
+        def task():
+            tracemalloc.reset_peak()
+            state[0] = tracemalloc.get_traced_memory()[0]
+            state[1] = kernel._order
+            state[2] = 0
+            state[3] = 0
+            if heap[0] is None:
+                heap[0] = state[0]
+            if count:
+                sys.settrace(trace)
+            try:
+                fn()
+            finally:
+                sys.settrace(None)
+            cycles[0] += 1
+            cycles[1] += state[2]
+            cycles[2] += state[3]
+            cycles[3] = max(cycles[3], state[2])
+            cur, peak = tracemalloc.get_traced_memory()
+            heap[1] = max(heap[1], peak)
+            if kernel.now < _LAP * 1000:
+                heap[2] = cur
+            heap[3] = cur
+        return task
+
+    def setup(loader):
+        scheduler = loader.load("scheduler")
+        add = scheduler.add
+
+        def measured_add(fn, name, *args):
+            if name == "telemetry":
+                fn = measure(fn, loader.kernel)
+            return add(fn, name, *args)
+        scheduler.add = measured_add
+
+    scenario = []
+    for t in range(0, seconds, _LAP):
+        scenario.extend(default_scenario(t + 60))
+    overrides = {"main.compact_telemetry": True} if compact else None
+    tracemalloc.start()
+    try:
+        kernel, board, loader, reason = simulate(seconds, seed, latency=0, scenario=scenario, out=_Sink(),
+                                                 setup=setup, overrides=overrides, board=_SoakBoard, root=root)
+    finally:
+        tracemalloc.stop()
+    n = max(1, cycles[0])
+    return {
+        "cycles": cycles[0],
+        "allocs": cycles[1] / n,
+        "allocs_max": cycles[3],
+        "bytes": cycles[2] / n,
+        "heap_max": heap[1] - heap[0],
+        "growth": heap[3] - heap[2],
+        "published": board.published,
+        "payload": board.broker.bytes,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Measure the heap churn of the telemetry loop")
+    p.add_argument("--root", action="append", default=[], help="firmware directory, repeat to compare")
+    p.add_argument("--seconds", type=int, default=14400)
+    p.add_argument("--compact", action="store_true", help="publish compact telemetry")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args(argv)
+    roots = args.root or [None]
+    print("%-16s %7s %9s %9s %9s %9s %8s %8s %9s" % ("firmware", "cycles", "allocs", "max", "bytes",
+                                                     "heap max", "growth", "publish", "payload"))
+    for root in roots:
+        r = soak(root, args.seconds, args.compact, args.seed)
+        a = soak(root, args.seconds, args.compact, args.seed, count=True)
+        for k in ("allocs", "allocs_max", "bytes"):
+            r[k] = a[k]
+        name = os.path.basename(os.path.abspath(root or ".")) if root != "." else "."
+        print("%-16s %7d %9.1f %9d %9.0f %9d %8d %8d %9d" % (name[-16:], r["cycles"], r["allocs"], r["allocs_max"],
+                                                         r["bytes"], r["heap_max"], r["growth"], r["published"],
+                                                         r["payload"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
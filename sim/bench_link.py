@@ -0,0 +1,81 @@
+"""Time to reconnect and telemetry gap after connection faults.
+
+The board drives with the ignition on and, at --fault seconds, loses the
+connection at one layer: the MQTT session, the data connection, the modem
+(stuck until restarted) or the network coverage (back after --coverage
+seconds). Reboots caused by mcu.reset() are simulated. Usage:
+
+    python -m sim.bench_link [--seconds N] [--fault S] [--coverage S]
+"""
+
+import argparse
+import json
+import sys
+
+from sim.run import simulate
+
+
+def _scenario(kind, fault, coverage):
+    events = [(20, lambda b: setattr(b, "ignition", 1)), (30, lambda b: b.drive(50, 90))]
+    if kind == "coverage":
+        events.append((fault, lambda b: b.link(False)))
+        events.append((fault + coverage, lambda b: b.link(True)))
+    else:
+        events.append((fault, lambda b: b.fault(kind)))
+    return events
+
+
+def _points(broker):
+    # (delivery time, point time) of every telemetry point, in ms since boot
+    res = []
+    for m in broker.messages:
+        if m[1] != "telemetry":
+            continue
+        data = json.loads(m[2])
+        if not isinstance(data, list):
+            data = [data]
+        for p in data:
+            if isinstance(p, dict) and "ts" in p:
+                res.append((m[0], int(p["ts"])))
+    return res
+
+
+def bench(kind, seconds=600, fault=200, coverage=60, seed=1):
+    kernel, board, loader, reason = simulate(seconds, seed, scenario=_scenario(kind, fault, coverage))
+    epoch = board.epoch * 1000
+    points = _points(board.broker)
+    recover = None
+    for t in board.connects:
+        if t > fault * 1000:
+            recover = t - fault * 1000
+            break
+    # longest interval without points, around the fault
+    times = sorted(p[1] - epoch for p in points)
+    gap = 0
+    for i in range(1, len(times)):
+        if times[i] > fault * 1000 and times[i - 1] < (fault + 900) * 1000:
+            gap = max(gap, times[i] - times[i - 1])
+    late = 0
+    for p in points:
+        if p[0] - (p[1] - epoch) > 10000:
+            late += 1
+    return {"kind": kind, "recover": recover, "gap": gap, "late": late, "points": len(points),
+            "boots": board.boots, "reason": reason}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark connection recovery")
+    p.add_argument("--seconds", type=int, default=600)
+    p.add_argument("--fault", type=int, default=200, help="time of the fault in s")
+    p.add_argument("--coverage", type=int, default=60, help="length of the coverage loss in s")
+    args = p.parse_args(argv)
+    print("%-9s %12s %8s %7s %6s %6s" % ("fault", "reconnect s", "gap s", "points", "late", "boots"))
+    for kind in ("mqtt", "data", "modem", "coverage"):
+        r = bench(kind, args.seconds, args.fault, args.coverage)
+        rec = "-" if r["recover"] is None else "%.1f" % (r["recover"] / 1000.0)
+        print("%-9s %12s %8.1f %7d %6d %6d" % (kind, rec, r["gap"] / 1000.0, r["points"], r["late"], r["boots"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Main loop timing and publish queue depth with a slow, lossy broker.
+
+The firmware drives the default route over and over while every publish
+takes --latency ms and fails with probability --loss. Each run of the
+scheduler tasks is timed on the virtual clock. The report gives, for each
+firmware, the longest run of the telemetry task, the longest gap between
+runs of the input task (main.status_period) and between watchdog kicks
+(5000 ms), the depth of the publish queue sampled at every run of the
+input task and the telemetry points that reached the broker, directly or
+from the backlog. Usage:
+
+    git worktree add /tmp/base HEAD~1
+    python -m sim.bench_queue --root . --root /tmp/base [--seconds N] [--latency MS] [--loss P]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from sim.run import default_scenario, simulate
+
+_LAP = 900      # s, length of the default route
+
+
+def _points(payload):
+    v = json.loads(payload)
+    if isinstance(v, list):
+        return len(v)
+    return 1
+
+
+def soak(root, seconds=1800, latency=3000, loss=0.3, seed=1):
+    """Runs the firmware in root, returns a dict of results."""
+    runs = {}               # task name -> [runs, total ms, max ms, max gap ms, last start]
+    depth = [0, 0, 0]       # samples, sum, max
+
+    def measure(fn, name, loader):
+        kernel = loader.kernel
+        s = runs.setdefault(name, [0, 0, 0, 0, None])
+
+        def task():
+            start = kernel.now
+            if s[4] is not None and start - s[4] > s[3]:
+                s[3] = start - s[4]
+            s[4] = start
+            fn()
+            d = kernel.now - start
+            s[0] += 1
+            s[1] += d
+            s[2] = max(s[2], d)
+            outbox = loader.modules.get("outbox")
+            if name == "inputs" and outbox is not None:
+                n = outbox.depth()
+                depth[0] += 1
+                depth[1] += n
+                depth[2] = max(depth[2], n)
+        return task
+
+    def setup(loader):
+        scheduler = loader.load("scheduler")
+        add = scheduler.add
+
+        def measured_add(fn, name, *args):
+            return add(measure(fn, name, loader), name, *args)
+        scheduler.add = measured_add
+
+    scenario = []
+    for t in range(0, seconds, _LAP):
+        scenario.extend(default_scenario(t + 60))
+    kernel, board, loader, reason = simulate(seconds, seed, loss=loss, latency=latency, scenario=scenario,
+                                             setup=setup, root=root)
+    telemetry = runs.get("telemetry", [0, 0, 0, 0, None])
+    outbox = loader.modules.get("outbox")
+    return {
+        "telemetry_avg": telemetry[1] / max(1, telemetry[0]),
+        "telemetry_max": telemetry[2],
+        "poll_gap": runs.get("inputs", [0, 0, 0, 0])[3],
+        "kick_gap": runs.get("watchdog", [0, 0, 0, 0])[3],
+        "depth_avg": depth[1] / depth[0] if depth[0] > 0 else None,
+        "depth_max": depth[2] if depth[0] > 0 else None,
+        "dropped": outbox.dropped if outbox is not None else None,
+        "coalesced": outbox.coalesced if outbox is not None else None,
+        "points": sum(_points(m[2]) for m in board.broker.messages if m[1] == "telemetry"),
+        "failed": board.broker.failed,
+    }
+
+
+def _v(x, fmt):
+    return "-" if x is None else fmt % x
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Measure the main loop and the publish queue with a slow broker")
+    p.add_argument("--root", action="append", default=[], help="firmware directory, repeat to compare")
+    p.add_argument("--seconds", type=int, default=1800)
+    p.add_argument("--latency", type=int, default=3000, help="publish round trip in ms")
+    p.add_argument("--loss", type=float, default=0.3, help="publish failure probability")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args(argv)
+    print("%-16s %9s %9s %9s %9s %9s %9s %8s %9s %7s %7s" % (
+        "firmware", "telem avg", "telem max", "poll gap", "kick gap", "depth avg", "depth max", "dropped",
+        "coalesced", "points", "failed"))
+    for root in args.root or [None]:
+        r = soak(root, args.seconds, args.latency, args.loss, args.seed)
+        name = os.path.basename(os.path.abspath(root)) if root not in (None, ".") else "."
+        print("%-16s %9.0f %9d %9d %9d %9s %9s %8s %9s %7d %7d" % (
+            name[-16:], r["telemetry_avg"], r["telemetry_max"], r["poll_gap"], r["kick_gap"],
+            _v(r["depth_avg"], "%.2f"), _v(r["depth_max"], "%d"), _v(r["dropped"], "%d"),
+            _v(r["coalesced"], "%d"), r["points"], r["failed"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""Throughput of the modem passthrough and of the terminal line editor.
+
+A paste arrives on the console at the baud rate. For the passthrough the
+modem port echoes everything back (as with ATE1), so every byte crosses the
+bridge in both directions; for the line editor the paste is a single long
+line. The report gives sustained bytes/second and the bytes dropped by the
+driver FIFOs. Usage:
+
+    python -m sim.bench_serial [--bytes N] [--baud B] [--fifo N] [--call-us US]
+"""
+
+import argparse
+import random
+import sys
+
+from sim.board import Board
+from sim.kernel import Kernel
+from sim.uart import Uart
+from sim.zerynth import Loader
+
+
+def bench(nbytes=20000, baud=115200, fifo=128, call_us=20, seed=1):
+    """Returns a dict with the results of a passthrough run."""
+    kernel = Kernel(until=3600000)
+    board = Board(kernel, seed)
+    loader = Loader(kernel, board)
+    polaris = loader.fakes["fortebit.polaris"]
+    console = Uart(kernel, baud, fifo, fifo, call_us)
+    modem = Uart(kernel, baud, fifo, fifo, call_us)
+    modem.peer = modem
+    board.serial_ports[polaris.polaris.gsm.SERIAL] = modem
+    rng = random.Random(seed)
+    data = bytes(rng.randrange(32, 127) for _ in range(nbytes))
+    res = {"bytes": nbytes}
+
+    def firmware():
+        utils = loader.load("utils")
+        utils.modem = polaris.modem.init()
+        utils.do_modem_passthru(console)
+
+    def paste():
+        kernel.sleep(100)
+        base = len(console.out)
+        res["start"] = kernel.now
+        sent = 0
+        acc = 0.0
+        while sent < nbytes:
+            kernel.sleep(1)
+            acc += console.rate()
+            n = int(acc)
+            acc -= n
+            console.feed(data[sent:sent + n])
+            sent += n
+        last = kernel.now
+        seen = len(console.out)
+        while kernel.now - last < 200:
+            kernel.sleep(1)
+            if len(console.out) != seen:
+                seen = len(console.out)
+                last = kernel.now
+        res["end"] = last
+        res["delivered"] = seen - base
+        console.feed(b"^")
+
+    kernel.spawn(paste, (), "paste")
+    kernel.spawn(firmware, (), "firmware")
+    res["reason"] = kernel.run()
+    res["dropped_console"] = console.dropped
+    res["dropped_modem"] = modem.dropped
+    res["calls"] = console.calls + modem.calls
+    res["rate"] = res["delivered"] * 1000.0 / max(1, res["end"] - res["start"])
+    return res
+
+
+def bench_line(nbytes=2000, baud=115200, fifo=128, call_us=20, seed=1):
+    """Returns a dict with the results of reading one pasted line."""
+    kernel = Kernel(until=3600000)
+    board = Board(kernel, seed)
+    console = Uart(kernel, baud, fifo, fifo, call_us)
+    # the firmware console is the same serial port
+    loader = Loader(kernel, board, out=console, stamp=False)
+    rng = random.Random(seed)
+    data = bytes(rng.randrange(32, 127) for _ in range(nbytes)) + b"\r"
+    res = {"bytes": nbytes}
+
+    def firmware():
+        utils = loader.load("utils")
+        line = utils.input_line(console)
+        res["end"] = kernel.now
+        res["delivered"] = len(line)
+
+    def paste():
+        kernel.sleep(100)
+        res["start"] = kernel.now
+        sent = 0
+        acc = 0.0
+        while sent < len(data):
+            kernel.sleep(1)
+            acc += console.rate()
+            n = int(acc)
+            acc -= n
+            console.feed(data[sent:sent + n])
+            sent += n
+        # press enter again if the terminator was dropped
+        kernel.sleep(1000)
+        if "end" not in res:
+            console.feed(b"\r")
+
+    kernel.spawn(paste, (), "paste")
+    kernel.spawn(firmware, (), "firmware")
+    res["reason"] = kernel.run()
+    res["dropped_console"] = console.dropped
+    res["dropped_modem"] = 0
+    res["calls"] = console.calls
+    res["rate"] = res["delivered"] * 1000.0 / max(1, res["end"] - res["start"])
+    return res
+
+
+def _print(title, r, baud):
+    print(title)
+    print("  Pasted: %d bytes at %d baud (%.0f bytes/s)" % (r["bytes"], baud, baud / 10.0))
+    print("  Delivered: %d bytes in %d ms, %.0f bytes/s" % (r["delivered"], r["end"] - r["start"], r["rate"]))
+    print("  Dropped: console %d, modem %d, lost %d" % (r["dropped_console"], r["dropped_modem"], r["bytes"] - r["delivered"]))
+    print("  Stream calls: %d" % r["calls"])
+    if r["reason"] is not None:
+        print("  Stopped:", repr(r["reason"]))
+        return 1
+    return 0
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark the modem passthrough")
+    p.add_argument("--bytes", type=int, default=20000)
+    p.add_argument("--baud", type=int, default=115200)
+    p.add_argument("--fifo", type=int, default=128, help="driver FIFO size in bytes")
+    p.add_argument("--call-us", type=int, default=20, help="CPU time of a stream call in us")
+    args = p.parse_args(argv)
+    err = _print("Modem passthrough:", bench(args.bytes, args.baud, args.fifo, args.call_us), args.baud)
+    err |= _print("Line editor:", bench_line(args.bytes // 10, args.baud, args.fifo, args.call_us), args.baud)
+    return err
+
+
+if __name__ == "__main__":
+    sys.exit(main())
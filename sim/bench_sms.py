@@ -0,0 +1,80 @@
+"""Flash erases and modem calls for a burst of SMS with several commands each.
+
+The firmware boots parked and, after --idle seconds, receives --messages
+SMS from two senders, each with --commands settings changes. The report
+gives, for each firmware, the modem calls listing the messages while idle
+(per hour), then from the burst to the reset it asks for: the flash
+erases and writes, the list_sms, delete_sms and send_sms calls, the
+replies sent and the time to the reset. Usage:
+
+    git worktree add /tmp/base 3cb0073~1
+    python -m sim.bench_sms --root . --root /tmp/base [--messages N] [--commands N]
+"""
+
+import argparse
+import os
+import sys
+
+from sim.kernel import SimReset
+from sim.run import simulate
+
+_COMMANDS = ["apn=web%d.apn", "email=fleet%d@example.com", "name=Truck %d"]
+_CALLS = ("list_sms", "delete_sms", "send_sms")
+
+
+def burst(messages, commands):
+    """Returns the (text, sender) of the burst."""
+    res = []
+    for i in range(messages):
+        text = ",".join(_COMMANDS[(i + j) % len(_COMMANDS)] % i for j in range(commands))
+        res.append((text, "+39%d" % (i % 2)))
+    return res
+
+
+def bench(root, messages=3, commands=2, idle=600, seed=1):
+    """Runs the firmware in root up to its reset, returns a dict of results."""
+    start = {}
+
+    def send(board):
+        start["t"] = board.kernel.now
+        start["erases"] = board.flash.erases
+        start["writes"] = board.flash.writes
+        start["reads"] = dict(board.reads)
+        for text, sender in burst(messages, commands):
+            board.send_sms(text, sender)
+
+    kernel, board, loader, reason = simulate(idle + 1200, seed, scenario=[(idle, send)], reboot=False, root=root)
+    reads = start["reads"]
+    res = {
+        "idle": reads.get("list_sms", 0) * 3600.0 / idle,
+        "erases": board.flash.erases - start["erases"],
+        "writes": board.flash.writes - start["writes"],
+        "replies": len(board.sms_out),
+        "reset": (kernel.now - start["t"]) / 1000.0 if isinstance(reason, SimReset) else None,
+    }
+    for name in _CALLS:
+        res[name] = board.reads.get(name, 0) - reads.get(name, 0)
+    return res
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Measure the flash and modem cost of a burst of SMS commands")
+    p.add_argument("--root", action="append", default=[], help="firmware directory, repeat to compare")
+    p.add_argument("--messages", type=int, default=3)
+    p.add_argument("--commands", type=int, default=2, help="settings changes per message")
+    p.add_argument("--idle", type=int, default=600, help="seconds before the burst")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args(argv)
+    print("%-16s %8s %7s %7s %9s %10s %8s %8s %8s" % ("firmware", "idle l/h", "erases", "writes", "list_sms",
+                                                     "delete_sms", "send_sms", "replies", "reset s"))
+    for root in args.root or [None]:
+        r = bench(root, args.messages, args.commands, args.idle, args.seed)
+        name = os.path.basename(os.path.abspath(root)) if root not in (None, ".") else "."
+        print("%-16s %8.0f %7d %7d %9d %10d %8d %8d %8s" % (
+            name[-16:], r["idle"], r["erases"], r["writes"], r["list_sms"], r["delete_sms"], r["send_sms"],
+            r["replies"], "-" if r["reset"] is None else "%.1f" % r["reset"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Reported points and path deviation, adaptive reporting against a fixed period.
+
+A sensor trace (see sim/replay.py) is replayed through the firmware twice:
+with adaptive reporting and track simplification, and with a position at
+every gps_period. The fixes in the trace, one every fix_period, are the
+true path. The deviation of a fix is its distance from the reported path
+between the two reported points around it in time. Without a trace file,
+one is recorded from a winding drive with stops. Usage:
+
+    python -m sim.bench_track [drive.trace] [--seconds N] [--seed N]
+"""
+
+import argparse
+import json
+import math
+import sys
+
+from sim.replay import FIX, decode, record, replay_board
+from sim.run import SETTINGS, simulate
+
+
+def winding(seconds):
+    """Returns a scenario that turns every 20 s, with stops and a fast stretch."""
+    events = [(20, lambda b: setattr(b, "ignition", 1))]
+    cog = 0
+    for i, t in enumerate(range(40, seconds - 60, 20)):
+        cog += 45 if (i // 3) % 2 == 0 else -45
+        if i % 15 == 14:
+            speed = 0
+        elif i % 40 < 10:
+            speed = 110
+        else:
+            speed = 50
+        events.append((t, lambda b, s=speed, c=cog: b.drive(s, c)))
+    events.append((seconds - 50, lambda b: b.drive(0, 0)))
+    events.append((seconds - 30, lambda b: setattr(b, "ignition", 0)))
+    return events
+
+
+def _xy(lat, lon, lat0, lon0):
+    k = math.radians(1) * 6371000.0
+    return ((lon - lon0) * k * math.cos(math.radians(lat0)), (lat - lat0) * k)
+
+
+def _deviation(p, a, b):
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    l2 = dx * dx + dy * dy
+    t = 0.0
+    if l2 > 0:
+        t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / l2))
+    return math.hypot(p[0] - a[0] - t * dx, p[1] - a[1] - t * dy)
+
+
+def _reported(board):
+    # (kernel ms, lat, lon) of every telemetry point with a position
+    res = []
+    for m in board.broker.messages:
+        if m[1] != "telemetry":
+            continue
+        data = json.loads(m[2])
+        for p in data if isinstance(data, list) else [data]:
+            v = p.get("values", {})
+            if "ts" in p and "latitude" in v:
+                res.append((int(p["ts"]) - board.epoch * 1000, float(v["latitude"]), float(v["longitude"])))
+    res.sort()
+    return res
+
+
+def bench(records, adaptive=True, seed=1):
+    truth = [(t, v[0], v[1]) for t, kind, v in records if kind == FIX and v is not None]
+    seconds = records[-1][0] // 1000 + 1
+    overrides = {"main.adaptive_reporting": adaptive}
+    kernel, board, loader, reason = simulate(seconds, seed, scenario=[], settings=SETTINGS, overrides=overrides,
+                                             board=replay_board(records))
+    points = _reported(board)
+    lat0, lon0 = truth[0][1], truth[0][2]
+    path = [(p[0], _xy(p[1], p[2], lat0, lon0)) for p in points]
+    dmax = 0.0
+    dsum = 0.0
+    n = 0
+    j = 0
+    for t, lat, lon in truth:
+        while j + 1 < len(path) and path[j + 1][0] <= t:
+            j += 1
+        if j + 1 >= len(path) or path[j][0] > t:
+            continue
+        d = _deviation(_xy(lat, lon, lat0, lon0), path[j][1], path[j + 1][1])
+        dmax = max(dmax, d)
+        dsum += d
+        n += 1
+    return {"points": len(points), "max": dmax, "avg": dsum / max(1, n), "fixes": len(truth),
+            "bytes": board.broker.bytes}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Compare adaptive position reporting with a fixed period")
+    p.add_argument("trace", nargs="?", help="trace file, recorded from a winding drive if omitted")
+    p.add_argument("--seconds", type=int, default=1800, help="length of the recorded drive")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args(argv)
+    if args.trace:
+        with open(args.trace, "rb") as f:
+            records = decode(f.read())
+    else:
+        records = decode(record(args.seconds, args.seed, winding(args.seconds)))
+    print("%-9s %7s %9s %9s %9s" % ("reporting", "points", "max dev m", "avg dev m", "bytes"))
+    for name, adaptive in (("fixed", False), ("adaptive", True)):
+        r = bench(records, adaptive, args.seed)
+        print("%-9s %7d %9.1f %9.1f %9d" % (name, r["points"], r["max"], r["avg"], r["bytes"]))
+    print("True path: %d fixes" % r["fixes"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""Scriptable state of the simulated board, network and flash."""
+
+import json
+import math
+import random
+
+
+class Buffer(bytearray):
+    """Data read from flash; like Zerynth bytes, it accepts str arguments."""
+
+    def find(self, sub, *args):
+        if isinstance(sub, str):
+            sub = sub.encode("latin-1")
+        return bytearray.find(self, sub, *args)
+
+
+class Flash(object):
+    """NOR flash in RAM: erases set a block to 0xFF, writes can only clear bits."""
+
+    BLOCK_SIZE = 0x10000
+
+    def __init__(self, size=0x800000):
+        self.mem = bytearray(b"\xff" * size)
+        self.erases = 0
+        self.writes = 0
+        self.bytes_written = 0
+        self.reads = 0
+        self.block_erases = {}
+
+    def erase_block(self, addr):
+        addr -= addr % self.BLOCK_SIZE
+        self.mem[addr:addr + self.BLOCK_SIZE] = b"\xff" * self.BLOCK_SIZE
+        self.erases += 1
+        blk = addr // self.BLOCK_SIZE
+        self.block_erases[blk] = self.block_erases.get(blk, 0) + 1
+
+    def write(self, addr, data):
+        for i in range(len(data)):
+            self.mem[addr + i] &= data[i]
+        self.writes += 1
+        self.bytes_written += len(data)
+
+    def read(self, addr, n):
+        self.reads += 1
+        return Buffer(self.mem[addr:addr + n])
+
+    def preload_settings(self, values):
+        """Stores settings in the legacy format of block 0."""
+        self.mem[0:self.BLOCK_SIZE] = b"\xff" * self.BLOCK_SIZE
+        data = (json.dumps(values) + "\n").encode("latin-1")
+        self.mem[0:len(data)] = data
+
+
+class Broker(object):
+    """In-process stand-in for the MQTT broker behind the cellular link."""
+
+    def __init__(self, kernel, seed=1):
+        self.kernel = kernel
+        self.rng = random.Random(seed)
+        self.up = True
+        self.latency = 150          # ms, publish round trip
+        self.loss = 0.0             # probability a publish fails
+        self.messages = []          # (time, topic, payload)
+        self.failed = 0
+        self.bytes = 0
+
+    def publish(self, topic, payload):
+        self.kernel.sleep(self.latency)
+        if not self.up or (self.loss > 0 and self.rng.random() < self.loss):
+            self.failed += 1
+            return False
+        self.messages.append((self.kernel.now, topic, payload))
+        self.bytes += len(payload)
+        return True
+
+    def count(self, topic=None):
+        if topic is None:
+            return len(self.messages)
+        n = 0
+        for m in self.messages:
+            if m[1] == topic:
+                n += 1
+        return n
+
+
+class Board(object):
+    """Inputs, sensors and peripherals seen by the firmware.
+
+    A scenario changes these fields over virtual time; the fake libraries in
+    sim.zerynth read them and count every hardware access in `reads`.
+    """
+
+    def __init__(self, kernel, seed=1):
+        self.kernel = kernel
+        self.seed = seed
+        self.rng = random.Random(seed)
+        # digital inputs
+        self.ignition = 0
+        self.sos = 0
+        # power
+        self.main_voltage = 12.6
+        self.batt_voltage = 4.1
+        self.backup = False
+        self.charger = 0
+        self.charging = False
+        # accelerometer, g and degrees Celsius
+        self.gravity = (0.0, 0.0, 1.0)
+        self.vibration = 0.005
+        self.temperature = 25.0
+        # GNSS
+        self.epoch = 1571000000     # unix time at boot
+        self.gnss_on = True
+        self.nsat = 9
+        self.hdop = 0.9
+        self.position = (45.4642, 9.1900, 120.0)
+        self.speed = 0.0            # km/h
+        self.cog = 0.0
+        self._moved = 0
+        self.travelled = 0.0        # m
+        self.jitter = 0.0           # m, random error of the fixes
+        self.ttff_cold = 35000      # ms to the first fix without aiding
+        self.ttff_aided = 12000     # ms with a valid position and time
+        self.gnss_started = 0
+        self.gnss_aided = None      # time of a valid aiding sentence
+        self.aids = []              # aiding sentences received
+        self.fix_times = []         # time the receiver got its first fix, after each start
+        # modem and cellular link
+        self.network = True         # network coverage
+        self.register_time = 8000   # ms from modem startup to registration
+        self.modem_started = 0
+        self.modem_ok = True        # False when the modem is stuck
+        self.attached = False       # data connection active
+        self.devices = []           # cloud clients, dropped on faults
+        self.connects = []          # times of successful cloud connections
+        self.rtc_latency = 120      # ms, AT command round trip
+        self.rtc_synced = False     # modem RTC set by the network time
+        self.sms_in = []            # (text, sender)
+        self.sms_out = []
+        self._sms_index = 0
+        self.console = bytearray()  # serial terminal input
+        self.modem_serial = bytearray()
+        self.serial_ports = {}      # port -> stream replacing the defaults
+        # LEDs and accounting
+        self.leds = {"red": False, "green": False}
+        self.reads = {}
+        self.watchdog_timeout = 0
+        self.watchdog_kick = 0
+        self.watchdog_expired = 0
+        self.registered = True
+        self.cloud_latency = 2000   # ms, HTTPS round trip to the cloud API
+        self.cloud_calls = 0
+        self.heap_free = 40000
+        self.flash = Flash()
+        self.broker = Broker(kernel, seed)
+
+    def read(self, name, value):
+        self.reads[name] = self.reads.get(name, 0) + 1
+        return value
+
+    def unix_time(self):
+        return self.epoch + self.kernel.now // 1000
+
+    def acceleration(self):
+        v = self.vibration
+        r = self.rng
+        g = self.gravity
+        return (g[0] + r.uniform(-v, v), g[1] + r.uniform(-v, v), g[2] + r.uniform(-v, v))
+
+    def move(self):
+        """Advances the position at the current speed and course."""
+        now = self.kernel.now
+        dt = (now - self._moved) / 1000.0
+        self._moved = now
+        if self.speed <= 0 or dt <= 0:
+            return
+        d = self.speed / 3.6 * dt
+        self.travelled += d
+        lat, lon, alt = self.position
+        dlat = d * math.cos(math.radians(self.cog)) / 111320.0
+        dlon = d * math.sin(math.radians(self.cog)) / (111320.0 * math.cos(math.radians(lat)))
+        self.position = (lat + dlat, lon + dlon, alt)
+
+    def drive(self, speed, cog):
+        self.move()
+        self.speed = speed
+        self.cog = cog % 360
+        self.vibration = 0.02 if speed > 0 else 0.005
+
+    def fault(self, kind):
+        """Breaks the connection at one layer: mqtt, data or modem."""
+        if kind == "modem":
+            self.modem_ok = False
+        if kind in ("modem", "data"):
+            self.attached = False
+        for d in self.devices:
+            d.connected = False
+
+    def registered_network(self):
+        return self.network and self.modem_ok and self.kernel.now - self.modem_started >= self.register_time
+
+    def link(self, up):
+        """Network coverage: without it every connection is lost."""
+        self.broker.up = up
+        self.network = up
+        if not up:
+            self.fault("data")
+
+    def send_sms(self, text, sender="+390000000000"):
+        self._sms_index += 1
+        self.sms_in.append((text, sender, self._sms_index))
+
+    def type(self, text):
+        self.console.extend(text.encode("latin-1"))
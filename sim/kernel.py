@@ -0,0 +1,225 @@
+"""Virtual clock and cooperative threads for running the firmware on the host.
+
+Every firmware thread runs on its own Python thread, but only one of them
+holds the baton at any time. A thread gives it back when it sleeps or waits
+on a lock or event; the kernel then resumes the next runnable thread and,
+when none is runnable, advances the virtual clock straight to the earliest
+wake-up. Code between two yields takes no virtual time, so runs are fast and
+fully deterministic.
+"""
+
+import threading
+
+
+class SimExit(BaseException):
+    """Raised in firmware threads when the simulation is over."""
+
+
+class SimReset(BaseException):
+    """Raised by mcu.reset(); ends the simulation run."""
+
+
+class _Thread(object):
+
+    def __init__(self, kernel, fn, args, name, order):
+        self.kernel = kernel
+        self.fn = fn
+        self.args = args
+        self.name = name
+        self.wake = kernel.now
+        self.order = order
+        self.waiting = None     # object with ready() when blocked on it
+        self.finished = False
+        self.error = None
+        self.go = threading.Event()
+        self.py = threading.Thread(target=self._main, name=name)
+        self.py.daemon = True
+
+    def _main(self):
+        self.go.wait()
+        self.go.clear()
+        try:
+            if self.kernel.stopped is None:
+                self.fn(*self.args)
+        except SimExit:
+            pass
+        except SimReset as e:
+            self.kernel.stop(e)
+        except Exception as e:
+            # an uncaught exception only terminates the thread, as on the VM
+            self.error = e
+            self.kernel.log("Thread %s failed: %r" % (self.name, e))
+        self.finished = True
+        self.kernel._switch(self)
+
+
+class Kernel(object):
+    """Deterministic scheduler of firmware threads on a virtual clock in ms."""
+
+    def __init__(self, until=None):
+        self.now = 0
+        self.until = until
+        self.stopped = None
+        self.current = None
+        self.threads = []
+        self.timer_wakeups = 0      # distinct instants the clock advanced to
+        self.wakeups = {}           # thread name -> resumes after sleeping or waiting
+        self._order = 0
+        self._done = threading.Event()
+        self.log = print
+
+    def spawn(self, fn, args=(), name=None):
+        """Creates a firmware thread, runnable at the current time."""
+        self._order += 1
+        if name is None:
+            name = "thread-%d" % self._order
+        t = _Thread(self, fn, args, name, self._order)
+        self.threads.append(t)
+        t.py.start()
+        return t
+
+    def run(self):
+        """Runs until every thread ends, the time limit or a reset.
+
+        Returns the reason the run stopped (None when all threads ended).
+        """
+        self._switch(None)
+        self._done.wait()
+        return self.stopped
+
+    def reboot(self):
+        """Clears the threads after a stop, keeping the clock and counters."""
+        for t in self.threads:
+            t.py.join()
+        self.threads = []
+        self.stopped = None
+        self.current = None
+        self._done.clear()
+
+    def stop(self, reason):
+        if self.stopped is None:
+            self.stopped = reason
+        for t in self.threads:
+            if not t.finished and t is not self.current:
+                t.go.set()
+        self._done.set()
+
+    # called from firmware threads
+
+    def sleep(self, ms):
+        me = self.current
+        me.wake = self.now + max(0, int(ms))
+        self._order += 1
+        me.order = self._order
+        self._switch(me)
+        name = me.name
+        self.wakeups[name] = self.wakeups.get(name, 0) + 1
+
+    def block(self, obj, timeout=None):
+        """Waits until obj.ready() or timeout ms have passed."""
+        me = self.current
+        me.waiting = obj
+        me.wake = None if timeout is None else self.now + max(0, int(timeout))
+        self._order += 1
+        me.order = self._order
+        self._switch(me)
+        me.waiting = None
+        name = me.name
+        self.wakeups[name] = self.wakeups.get(name, 0) + 1
+
+    def _runnable_at(self, t):
+        if t.finished:
+            return None
+        if t.waiting is not None:
+            if t.waiting.ready():
+                return self.now
+            return t.wake
+        return t.wake
+
+    def _switch(self, me):
+        nxt = None
+        nxt_at = None
+        if self.stopped is None:
+            for t in self.threads:
+                at = self._runnable_at(t)
+                if at is None:
+                    continue
+                if nxt is None or at < nxt_at or (at == nxt_at and t.order < nxt.order):
+                    nxt = t
+                    nxt_at = at
+        if nxt is None:
+            if self.stopped is None and any(not t.finished for t in self.threads):
+                self.stop(RuntimeError("deadlock: all threads blocked"))
+            else:
+                self.stop(self.stopped)
+        else:
+            if nxt_at > self.now:
+                if self.until is not None and nxt_at > self.until:
+                    self.now = self.until
+                    nxt = None
+                    self.stop(SimExit("time limit"))
+                else:
+                    self.now = nxt_at
+                    self.timer_wakeups += 1
+        if nxt is not None and nxt is not me:
+            self.current = nxt
+            nxt.go.set()
+        if me is None or me.finished:
+            return
+        if self.stopped is None and nxt is not me:
+            me.go.wait()
+            me.go.clear()
+        if self.stopped is not None:
+            raise SimExit()
+
+
+def make_threading(kernel):
+    """Returns the classes of the firmware `threading` module."""
+
+    class Lock(object):
+
+        def __init__(self):
+            self._locked = False
+
+        def ready(self):
+            return not self._locked
+
+        def acquire(self, blocking=True, timeout=-1):
+            while self._locked:
+                if not blocking:
+                    return False
+                kernel.block(self, None if timeout is None or timeout < 0 else timeout)
+                if timeout is not None and timeout >= 0 and self._locked:
+                    return False
+            self._locked = True
+            return True
+
+        def release(self):
+            self._locked = False
+
+        def locked(self):
+            return self._locked
+
+    class Event(object):
+
+        def __init__(self):
+            self._flag = False
+
+        def ready(self):
+            return self._flag
+
+        def set(self):
+            self._flag = True
+
+        def clear(self):
+            self._flag = False
+
+        def is_set(self):
+            return self._flag
+
+        def wait(self, timeout=None):
+            if not self._flag:
+                kernel.block(self, timeout)
+            return self._flag
+
+    return Lock, Event
@@ -0,0 +1,309 @@
+"""Record sensor traces and replay them through the firmware on the virtual clock.
+
+The firmware writes a trace to the console after the terminal command
+"trace" (see trace.py). A trace file holds the raw records; it is made
+from a console log of the device, or recorded from a simulation:
+
+    python -m sim.replay extract console.log drive.trace
+    python -m sim.replay record --seconds 3600 drive.trace
+
+A replay boots the unmodified firmware on a board whose accelerometer,
+GNSS, inputs and supply voltages return the traced values at each virtual
+time, and prints the usual report. Module constants can be changed for the
+run, to compare algorithm variants on the same drive:
+
+    python -m sim.replay run drive.trace --set accel._ACCEL_LP_COEF=0.1 --set main.max_hdop=2.0
+"""
+
+import argparse
+import ast
+import bisect
+import sys
+import time
+
+from sim.board import Board
+from sim.run import SETTINGS, default_scenario, report, simulate
+
+ACCEL = 0x61
+TEMP = 0x74
+FIX = 0x66
+NOFIX = 0x6E
+INPUTS = 0x69
+SENSOR = 0x73
+
+TS_EPOCH = 1500000000
+
+
+def _get(data, pos):
+    # zigzag varint, as codec._get()
+    v = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        v |= (b & 0x7F) << shift
+        shift += 7
+        if b < 0x80:
+            break
+    if v & 1:
+        return -((v + 1) >> 1), pos
+    return v >> 1, pos
+
+
+def extract(lines):
+    """Returns the records of each trace found in console log lines."""
+    traces = []
+    for line in lines:
+        i = line.find("#T ")
+        if i < 0:
+            continue
+        body = line[i + 3:].strip()
+        if body.startswith("start"):
+            traces.append(bytearray())
+        elif len(traces) > 0 and not body.startswith("stop"):
+            traces[-1].extend(bytes.fromhex(body))
+    return traces
+
+
+def decode(data):
+    """Returns the records as a list of (ms from start, type, values)."""
+    res = []
+    pos = 0
+    t = 0
+    accel = [0, 0, 0]
+    fix = [0, 0]
+    while pos < len(data):
+        kind = data[pos]
+        dt, pos = _get(data, pos + 1)
+        t += dt
+        if kind == ACCEL:
+            for i in range(3):
+                d, pos = _get(data, pos)
+                accel[i] += d
+            values = (accel[0] / 1000.0, accel[1] / 1000.0, accel[2] / 1000.0)
+        elif kind == FIX:
+            v = []
+            for i in range(8):
+                x, pos = _get(data, pos)
+                v.append(x)
+            fix[0] += v[0]
+            fix[1] += v[1]
+            values = (fix[0] / 1e6, fix[1] / 1e6, v[2] / 10.0, v[3] / 10.0, v[4] / 10.0, v[5], v[6] / 100.0,
+                      v[7] + TS_EPOCH)
+        elif kind == NOFIX:
+            values = None
+        elif kind == TEMP:
+            v, pos = _get(data, pos)
+            values = v / 100.0
+        elif kind == INPUTS:
+            ign, pos = _get(data, pos)
+            sos, pos = _get(data, pos)
+            values = (ign, sos)
+        elif kind == SENSOR:
+            src, pos = _get(data, pos)
+            v, pos = _get(data, pos)
+            values = (src, v / 1000.0 if src < 2 else v // 1000)
+        else:
+            raise ValueError("bad record type 0x%02x at %d" % (kind, pos))
+        res.append((t, kind, values))
+    return res
+
+
+class _Stream(object):
+
+    def __init__(self, records):
+        self.times = [r[0] for r in records]
+        self.values = [r[1] for r in records]
+
+    def at(self, t):
+        i = bisect.bisect_right(self.times, t) - 1
+        return None if i < 0 else self.values[i]
+
+
+class _Traced(object):
+    # board attribute read from a trace stream, the board default before it
+
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+
+    def __get__(self, board, cls=None):
+        if board is None:
+            return self
+        v = self.fn(board)
+        return board.__dict__["_" + self.name] if v is None else v
+
+    def __set__(self, board, value):
+        board.__dict__["_" + self.name] = value
+
+
+def _sensor(i):
+    return lambda b: b.trace_at(SENSOR + i)
+
+
+def _fix(i):
+    def f(b):
+        v = b.trace_at(FIX)
+        return v[i] if v else None
+    return f
+
+
+def _nsat(b):
+    # no satellites while the receiver had no fix
+    v = b.trace_at(FIX)
+    if v is None:
+        return None
+    return v[5] if v else 0
+
+
+class ReplayBoard(Board):
+    """Board whose inputs follow a decoded trace, from kernel time offset."""
+
+    records = []
+    offset = 0
+
+    acceleration_v = _Traced("acceleration_v", lambda b: b.trace_at(ACCEL))
+    temperature = _Traced("temperature", lambda b: b.trace_at(TEMP))
+    ignition = _Traced("ignition", lambda b: b._input(0))
+    sos = _Traced("sos", lambda b: b._input(1))
+    main_voltage = _Traced("main_voltage", _sensor(0))
+    batt_voltage = _Traced("batt_voltage", _sensor(1))
+    backup = _Traced("backup", _sensor(2))
+    charger = _Traced("charger", _sensor(3))
+    speed = _Traced("speed", _fix(3))
+    cog = _Traced("cog", _fix(4))
+    nsat = _Traced("nsat", _nsat)
+    hdop = _Traced("hdop", _fix(6))
+
+    def __init__(self, kernel, seed=1):
+        streams = {}
+        for t, kind, values in self.records:
+            if kind == SENSOR:
+                kind, values = SENSOR + values[0], values[1]
+            elif kind == NOFIX:
+                kind, values = FIX, ()
+            streams.setdefault(kind, []).append((t, values))
+        self._streams = dict((k, _Stream(v)) for k, v in streams.items())
+        Board.__init__(self, kernel, seed)
+        self.ttff_cold = 0
+        self.duration = self.records[-1][0] if len(self.records) > 0 else 0
+        for t, kind, values in self.records:
+            if kind == FIX and values is not None:
+                self.epoch = values[7] - (t + self.offset) // 1000
+                break
+
+    def trace_at(self, kind):
+        s = self._streams.get(kind)
+        if s is None:
+            return None
+        return s.at(self.kernel.now - self.offset)
+
+    def _input(self, i):
+        v = self.trace_at(INPUTS)
+        return None if v is None else v[i]
+
+    def acceleration(self):
+        return self.acceleration_v if self.trace_at(ACCEL) is not None else Board.acceleration(self)
+
+    def move(self):
+        pass
+
+    @property
+    def position(self):
+        v = self.trace_at(FIX)
+        if not v:
+            return self.__dict__["_position"]
+        return (v[0], v[1], v[2])
+
+    @position.setter
+    def position(self, value):
+        self.__dict__["_position"] = value
+
+
+def replay_board(records, offset=0):
+    """Returns a board class replaying records, for simulate(board=...)."""
+    return type("Replay", (ReplayBoard,), {"records": records, "offset": offset})
+
+
+class _Capture(object):
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.append(data)
+
+
+def record(seconds, seed=1, scenario=None):
+    """Runs a scenario, the default one if None, with tracing from boot and
+    returns the trace."""
+    capture = _Capture()
+
+    def setup(loader):
+        loader.load("trace").start(capture)
+
+    simulate(seconds, seed, scenario=scenario or default_scenario(), setup=setup)
+    return extract(["#T start"] + capture.lines)[0]
+
+
+def _value(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Record and replay sensor traces")
+    sub = p.add_subparsers(dest="cmd")
+    e = sub.add_parser("extract", help="extract a trace from a console log")
+    e.add_argument("log")
+    e.add_argument("trace")
+    e.add_argument("--index", type=int, default=-1, help="trace to extract, the last by default")
+    r = sub.add_parser("record", help="record a trace from the default simulation")
+    r.add_argument("trace")
+    r.add_argument("--seconds", type=int, default=900)
+    r.add_argument("--seed", type=int, default=1)
+    u = sub.add_parser("run", help="replay a trace through the firmware")
+    u.add_argument("trace")
+    u.add_argument("--set", action="append", default=[], metavar="MODULE.NAME=VALUE",
+                   help="replace a module constant")
+    u.add_argument("--offset", type=int, default=0, help="kernel time in ms at the start of the trace")
+    u.add_argument("--seed", type=int, default=1)
+    u.add_argument("--quiet", action="store_true", help="hide the firmware console")
+    args = p.parse_args(argv)
+    if args.cmd == "extract":
+        with open(args.log, errors="replace") as f:
+            traces = extract(f)
+        if len(traces) == 0:
+            print("No trace found")
+            return 1
+        data = traces[args.index]
+    elif args.cmd == "record":
+        data = record(args.seconds, args.seed)
+    elif args.cmd == "run":
+        with open(args.trace, "rb") as f:
+            records = decode(f.read())
+        overrides = {}
+        for s in args.set:
+            k, _, v = s.partition("=")
+            overrides[k] = _value(v)
+        seconds = (records[-1][0] + args.offset) // 1000 + 1 if len(records) > 0 else 0
+        t0 = time.time()
+        res = simulate(seconds, args.seed, scenario=[], out=None if args.quiet else sys.stdout,
+                       settings=SETTINGS, overrides=overrides, board=replay_board(records, args.offset))
+        wall = time.time() - t0
+        report(*res)
+        print("Replayed %d records, %d s in %.1f s (%.0fx)" % (len(records), seconds, wall, seconds / max(wall, 1e-3)))
+        return 0
+    else:
+        p.print_help()
+        return 1
+    with open(args.trace, "wb") as f:
+        f.write(data)
+    print("%s: %d records, %d bytes" % (args.trace, len(decode(data)), len(data)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""Runs the firmware against a scripted scenario and prints a report.
+
+The default scenario boots parked with the ignition off, drives a route
+with turns and stops, presses SOS, loses the network for a while and parks
+again. Usage:
+
+    python -m sim.run [--seconds N] [--seed N] [--loss P] [--latency MS] [--quiet]
+"""
+
+import argparse
+import sys
+
+from sim.board import Board
+from sim.kernel import Kernel, SimExit, SimReset
+from sim.zerynth import ROOT, Loader
+
+SETTINGS = {"name": "Polaris", "apn": "sim.apn", "email": "sim@example.com"}
+
+
+def default_scenario(t0=60):
+    """Returns a list of (seconds, action(board)) for the default run."""
+
+    def ignition(v):
+        def f(b):
+            b.ignition = v
+        return f
+
+    def sos(v):
+        def f(b):
+            b.sos = v
+        return f
+
+    def drive(speed, cog):
+        return lambda b: b.drive(speed, cog)
+
+    def link(up):
+        return lambda b: b.link(up)
+
+    return [
+        (t0, ignition(1)),
+        (t0 + 20, drive(30, 90)),
+        (t0 + 60, drive(50, 90)),
+        (t0 + 120, drive(50, 180)),
+        (t0 + 150, sos(1)),
+        (t0 + 153, sos(0)),
+        (t0 + 180, drive(90, 200)),
+        (t0 + 240, link(False)),
+        (t0 + 270, link(True)),
+        (t0 + 300, drive(0, 200)),
+        (t0 + 330, drive(40, 270)),
+        (t0 + 420, drive(60, 0)),
+        (t0 + 540, drive(0, 0)),
+        (t0 + 560, ignition(0)),
+    ]
+
+
+def simulate(seconds=900, seed=1, loss=0.0, latency=150, scenario=None, out=None, settings=SETTINGS,
+             reboot=True, setup=None, overrides=None, board=None, root=None):
+    """Runs main.py for the given virtual seconds, returns (kernel, board, loader, reason).
+
+    With reboot, mcu.reset() restarts the firmware from scratch on the same
+    board and flash; board.boots counts the restarts. setup(loader) is
+    called before each boot, to preload or patch application modules.
+    overrides are passed to the Loader; board(kernel, seed) makes the board.
+    root is the firmware directory, the one of this package by default.
+    """
+    kernel = Kernel(until=seconds * 1000)
+    board = (board or Board)(kernel, seed)
+    board.broker.loss = loss
+    board.broker.latency = latency
+    board.boots = 0
+    board.boot_times = []
+    if settings is not None:
+        board.flash.preload_settings(settings)
+    if scenario is None:
+        scenario = default_scenario()
+    events = list(scenario)
+
+    def script():
+        while len(events) > 0:
+            at, action = events[0]
+            if at * 1000 > kernel.now:
+                kernel.sleep(at * 1000 - kernel.now)
+            events.pop(0)
+            action(board)
+
+    while True:
+        loader = Loader(kernel, board, root or ROOT, out=out, overrides=overrides)
+        board.boot_times.append(kernel.now)
+        kernel.spawn(script, (), "scenario")
+        if setup is not None:
+            setup(loader)
+        loader.start("main")
+        reason = kernel.run()
+        if not (reboot and isinstance(reason, SimReset)):
+            break
+        board.boots += 1
+        board.devices = []
+        kernel.reboot()
+    return kernel, board, loader, reason
+
+
+def report(kernel, board, loader, reason, out=sys.stdout):
+    w = out.write
+    broker = board.broker
+    w("Stopped at %.3f s: %r, %d reboots\n" % (kernel.now / 1000.0, reason, getattr(board, "boots", 0)))
+    w("Publishes: %d ok, %d failed, %d payload bytes\n" % (len(broker.messages), broker.failed, broker.bytes))
+    for topic in ("telemetry", "attributes"):
+        w("  %s: %d\n" % (topic, broker.count(topic)))
+    w("Timer wake-ups: %d\n" % kernel.timer_wakeups)
+    for name in sorted(kernel.wakeups):
+        w("  %s: %d\n" % (name, kernel.wakeups[name]))
+    flash = board.flash
+    w("Flash: %d erases, %d writes, %d bytes\n" % (flash.erases, flash.writes, flash.bytes_written))
+    w("Hardware reads:\n")
+    for name in sorted(board.reads):
+        w("  %s: %d\n" % (name, board.reads[name]))
+    alarm = loader.modules.get("alarm")
+    if alarm is not None:
+        w("Alarms: %d sent, latency last %d ms, max %d ms\n" % (alarm.sent, alarm.latency_last, alarm.latency_max))
+    diag = loader.modules.get("diag")
+    if diag is not None:
+        w("Stages (count, min, avg, p50, p95, max ms):\n")
+        for i in range(len(diag._NAMES)):
+            st = diag.stats(i)
+            if st[1] > 0:
+                w("  %s: %s\n" % (st[0], ", ".join(str(v) for v in st[1:])))
+    link = loader.modules.get("link")
+    if link is not None:
+        w("Link: %d outages, recovered %s, last %d ms, max %d ms\n" % (link.outages, link.recovered, link.outage_last, link.outage_max))
+    trip = loader.modules.get("trip")
+    if trip is not None:
+        w("Odometer: %.3f km, travelled %.3f km\n" % (trip.odometer / 1000.0, board.travelled / 1000.0))
+    store = loader.modules.get("store")
+    if store is not None and store._flash is not None:
+        w("Backlog: pending %s, dropped records %d\n" % (store.pending(), store.dropped))
+    if board.watchdog_expired:
+        w("Watchdog expired: %d\n" % board.watchdog_expired)
+    for t in kernel.threads:
+        if t.error is not None:
+            w("Thread %s failed: %r\n" % (t.name, t.error))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Run the Polaris firmware on a virtual clock")
+    p.add_argument("--seconds", type=int, default=900)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--loss", type=float, default=0.0, help="publish failure probability")
+    p.add_argument("--latency", type=int, default=150, help="publish round trip in ms")
+    p.add_argument("--quiet", action="store_true", help="hide the firmware console")
+    args = p.parse_args(argv)
+    res = simulate(args.seconds, args.seed, args.loss, args.latency, out=None if args.quiet else sys.stdout)
+    report(*res)
+    reason = res[3]
+    return 0 if reason is None or isinstance(reason, SimExit) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""Tests of the firmware modules on the host.
+
+The modules are loaded as in a simulation, with the Zerynth stand-ins, on a
+fresh board and flash for each test. Run them with:
+
+    python -m unittest discover -s sim/tests -t .
+"""
+
+from sim.board import Board
+from sim.kernel import Kernel
+from sim.zerynth import Loader
+
+
+def firmware(board=None, overrides=None):
+    """Returns a Loader on a new board, or on board to simulate a reset."""
+    if board is None:
+        board = Board(Kernel())
+    else:
+        board.kernel.reboot()
+    return Loader(board.kernel, board, overrides=overrides)
+
+
+def call(loader, fn, *args):
+    """Runs fn(*args) in a firmware thread on the virtual clock and returns
+    its result; exceptions are raised in the caller."""
+    kernel = loader.kernel
+    res = []
+
+    def main():
+        res.append(fn(*args))
+    t = kernel.spawn(main, (), "test")
+    kernel.run()
+    if t.error is not None:
+        raise t.error
+    kernel.reboot()
+    return res[0]
+
+
+def run(loader, ms, *fns):
+    """Runs each fn in its own firmware thread for ms of virtual time;
+    the first exception of a thread is raised in the caller."""
+    kernel = loader.kernel
+    kernel.until = kernel.now + ms
+    threads = [kernel.spawn(fn, (), fn.__name__) for fn in fns]
+    kernel.run()
+    kernel.until = None
+    kernel.reboot()
+    for t in threads:
+        if t.error is not None:
+            raise t.error
@@ -0,0 +1,105 @@
+import time
+import unittest
+
+from sim.tests import call, firmware
+
+
+def _tm(secs):
+    t = time.gmtime(secs)
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, 0)
+
+
+class AidingTest(unittest.TestCase):
+
+    def boot(self, board=None):
+        # loads settings and aiding as after a reset, returns aiding and a receiver
+        loader = firmware(board)
+        settings = loader.load("settings")
+        call(loader, settings.load)
+        aiding = loader.load("aiding")
+        aiding.load()
+        self.loader = loader
+        self.board = loader.board
+        self.settings = settings
+        return aiding, loader.fakes["fortebit.polaris"].gnss.init()
+
+    def fix(self, dlat=0.0):
+        p = self.board.position
+        return (p[0] + dlat, p[1], p[2])
+
+    def now(self):
+        return self.board.unix_time()
+
+    def test_save_restore(self):
+        aiding, gnss = self.boot()
+        self.assertFalse(aiding.inject(gnss, _tm(self.now())))
+        aiding.update(self.fix(), self.now())
+        self.assertEqual(aiding.saves, 1)
+        aiding, gnss = self.boot(self.board)
+        self.assertTrue(aiding.inject(gnss, _tm(self.now())))
+        self.assertTrue(aiding.injected)
+        self.assertEqual(len(self.board.aids), 1)
+        self.assertTrue(self.board.aids[0][1].startswith("$PMTK741,45.464200,9.190000,120,"))
+        # accepted by the receiver stand-in: right position and time
+        self.assertIsNotNone(self.board.gnss_aided)
+
+    def test_save_policy(self):
+        aiding, gnss = self.boot()
+        t = self.now()
+        aiding.update(self.fix(), t)
+        # moved, but too soon
+        aiding.update(self.fix(0.01), t + aiding._SAVE_PERIOD - 1)
+        self.assertEqual(aiding.saves, 1)
+        # later, but not moved enough
+        aiding.update(self.fix(0.0005), t + aiding._SAVE_PERIOD)
+        self.assertEqual(aiding.saves, 1)
+        aiding.update(self.fix(0.01), t + aiding._SAVE_PERIOD)
+        self.assertEqual(aiding.saves, 2)
+        # parked, saved again before the record expires
+        aiding.update(self.fix(0.01), t + aiding._SAVE_PERIOD + aiding._MAX_AGE // 2)
+        self.assertEqual(aiding.saves, 3)
+        # save() writes only a newer fix
+        aiding.save()
+        aiding.save()
+        self.assertEqual(aiding.saves, 3)
+        aiding.update(self.fix(0.01), t + aiding._SAVE_PERIOD + aiding._MAX_AGE // 2 + 10)
+        aiding.save()
+        self.assertEqual(aiding.saves, 4)
+        aiding, gnss = self.boot(self.board)
+        self.assertEqual(aiding._saved[3], t + aiding._SAVE_PERIOD + aiding._MAX_AGE // 2 + 10)
+
+    def test_expiry(self):
+        aiding, gnss = self.boot()
+        t = self.now()
+        aiding.update(self.fix(), t)
+        aiding, gnss = self.boot(self.board)
+        self.assertFalse(aiding.inject(gnss, _tm(t + aiding._MAX_AGE + 1)))
+        # a clock behind the record is wrong
+        self.assertFalse(aiding.inject(gnss, _tm(t - 1)))
+        self.assertEqual(self.board.aids, [])
+        self.assertTrue(aiding.inject(gnss, _tm(t + aiding._MAX_AGE)))
+
+    def test_rtc_default(self):
+        # the modem RTC is only valid once the network set it
+        aiding, gnss = self.boot()
+        aiding.update(self.fix(), self.now())
+        aiding, gnss = self.boot(self.board)
+        modem = self.loader.fakes["fortebit.polaris"].modem.init()
+        call(self.loader, modem.startup)
+        tm = call(self.loader, modem.rtc)
+        self.assertFalse(aiding.valid_time(tm))
+        self.assertFalse(aiding.inject(gnss, tm))
+        self.assertFalse(aiding.valid_time(None))
+        self.assertEqual(self.board.aids, [])
+        kernel = self.loader.kernel
+
+        def registered():
+            kernel.sleep(self.board.register_time)
+            return modem.rtc()
+        tm = call(self.loader, registered)
+        self.assertTrue(aiding.valid_time(tm))
+        self.assertTrue(aiding.inject(gnss, tm))
+
+
+if __name__ == "__main__":
+    unittest.main()
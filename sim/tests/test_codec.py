@@ -0,0 +1,103 @@
+import unittest
+
+from sim.tests import firmware
+
+
+class CodecTest(unittest.TestCase):
+
+    def setUp(self):
+        loader = firmware()
+        self.codec = loader.load("codec")
+        self.record = loader.load("record")
+
+    def point(self, ts, **values):
+        r = self.record.new()
+        for k in values:
+            r[getattr(self.record, k.upper())] = values[k]
+        return (ts, r)
+
+    def roundtrip(self, points):
+        n = self.codec.encode(points)
+        return self.codec.decode(bytes(self.codec.buffer()[0:n]))
+
+    def check(self, points):
+        decimals = dict((f[0], f[1]) for f in self.codec.FIELDS)
+        res = self.roundtrip(points)
+        self.assertEqual(len(res), len(points))
+        for (ts, r), (dts, values) in zip(points, res):
+            self.assertEqual(dts, None if ts is None else int(ts))
+            expect = {}
+            for i, f in enumerate(self.codec.FIELDS):
+                if r[i] is not None:
+                    expect[f[0]] = r[i]
+            self.assertEqual(sorted(values), sorted(expect))
+            for k in expect:
+                # rounded to the field decimals
+                self.assertAlmostEqual(values[k], expect[k], delta=0.5 * 10 ** -decimals[k] + 1e-9)
+        return res
+
+    def test_single(self):
+        self.check([self.point("1571000000123", latitude=45.464211, longitude=9.190012, speed=50.3,
+                               altitude=120.5, ignition=1, temperature=24.75)])
+
+    def test_missing_fields(self):
+        # delta coded fields missing from the previous point are sent whole
+        self.check([
+            self.point("1571000000000", latitude=45.5, longitude=9.2, altitude=120.0),
+            self.point("1571000010000", speed=12.0),
+            self.point("1571000020000", latitude=45.500123, longitude=9.200456),
+            self.point("1571000030000", latitude=45.500200, altitude=80.0),
+            self.point("1571000040000"),
+        ])
+
+    def test_negative_deltas(self):
+        self.check([
+            self.point("1571000000000", latitude=45.5, longitude=9.2, altitude=300.0),
+            self.point("1571000002000", latitude=45.499001, longitude=9.199001, altitude=-12.5),
+            self.point("1571000004000", latitude=-33.868820, longitude=-151.209295, altitude=-400.0),
+        ])
+        self.check([self.point("1571000000000", temperature=-12.34, pitch=-45.6, roll=-0.1, event_g=-1.25)])
+
+    def test_no_timestamp(self):
+        res = self.check([
+            self.point(None, latitude=45.5, longitude=9.2, sos=1),
+            self.point("1571000005500", latitude=45.6, longitude=9.3),
+            self.point(None, ignition=0),
+        ])
+        self.assertEqual([p[0] for p in res], [None, 1571000005500, None])
+
+    def test_timestamps(self):
+        # seconds are delta coded, milliseconds sent as they are
+        self.check([
+            self.point("1571000000999", sos=1),
+            self.point("1571000000001", sos=0),
+            self.point("1500000000000", sos=1),
+            self.point("1899999999500", sos=0),
+        ])
+
+    def test_all_fields(self):
+        r = self.record.new()
+        for i, f in enumerate(self.codec.FIELDS):
+            r[i] = 1.5 * (i + 1) if f[1] > 0 else i + 1
+        self.check([("1571000000000", r), ("1571000001000", r)])
+
+    def test_buffer_grows(self):
+        points = []
+        for i in range(100):
+            points.append(self.point(str(1571000000000 + i * 1000), latitude=45.0 + i * 1e-4,
+                                     longitude=9.0 - i * 1e-4, speed=float(i)))
+        self.check(points)
+
+    def test_hexlify(self):
+        data = bytes(range(256))
+        self.assertEqual(self.codec.hexlify(data), data.hex())
+        self.assertEqual(self.codec.hexlify(data, 3), "000102")
+        self.assertEqual(self.codec.unhexlify(data.hex()), bytearray(data))
+
+    def test_bad_version(self):
+        self.assertRaises(ValueError, self.codec.decode, b"")
+        self.assertRaises(ValueError, self.codec.decode, bytes([self.codec.VERSION + 1, 0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import json
+import random
+import unittest
+
+from sim.run import simulate
+from sim.tests import call, firmware
+from sim.tests.test_settings import FaultyFlash, PowerLoss
+
+
+def _polygons(n, seed=1):
+    # n squares of about 200 m with 4 vertices, about 100 bytes each
+    rng = random.Random(seed)
+    res = []
+    for i in range(n):
+        lat = round(45.2 + rng.random() * 0.5, 6)
+        lon = round(9.0 + rng.random() * 0.5, 6)
+        res.append([i, [lat, lon, lat + 0.002, lon, lat + 0.002, lon + 0.002, lat, lon + 0.002]])
+    return res
+
+
+class FencesTest(unittest.TestCase):
+
+    def boot(self, board=None):
+        loader = firmware(board)
+        self.board = loader.board
+        fences = loader.load("fences")
+        return fences, fences.load()
+
+    def test_empty(self):
+        fences, fence_set = self.boot()
+        self.assertEqual(fence_set, None)
+
+    def test_save_load(self):
+        fences, fence_set = self.boot()
+        large = _polygons(400)
+        self.assertGreater(len(json.dumps(large)), 40000)
+        for fence_set in ([[1, 45.46, 9.19, 150.0]], large, [], [[2, 45.0, 9.0, 10]]):
+            fences.save(fence_set)
+            fences, loaded = self.boot(self.board)
+            self.assertEqual(loaded, fence_set)
+        # the blocks are used in turn
+        self.assertEqual(self.board.flash.block_erases, {8: 2, 9: 2})
+
+    def test_too_large(self):
+        fences, fence_set = self.boot()
+        fences.save([[1, 45.46, 9.19, 150.0]])
+        erases = self.board.flash.erases
+        self.assertRaises(ValueError, fences.save, _polygons(700))
+        self.assertEqual(self.board.flash.erases, erases)
+        fences, fence_set = self.boot(self.board)
+        self.assertEqual(fence_set, [[1, 45.46, 9.19, 150.0]])
+
+    def test_power_loss(self):
+        # a set is replaced entirely or not at all
+        rng = random.Random(1)
+        old = _polygons(100, 1)
+        new = _polygons(300, 2)
+        for trial in range(30):
+            board = firmware().board
+            board.flash = FaultyFlash()
+            fences, fence_set = self.boot(board)
+            fences.save(old)
+            board.flash.budget = rng.randint(0, 50000)
+            try:
+                fences.save(new)
+                lost = False
+            except PowerLoss:
+                lost = True
+            board.flash.budget = None
+            fences, fence_set = self.boot(board)
+            self.assertEqual(fence_set, old if lost else new)
+            # the next save does not erase the set in use
+            board.flash.budget = 1
+            self.assertRaises(PowerLoss, fences.save, [])
+            board.flash.budget = None
+            fences, fence_set = self.boot(board)
+            self.assertEqual(fence_set, old if lost else new)
+
+
+class ProvisioningTest(unittest.TestCase):
+
+    def test_terminal(self):
+        fence_set = _polygons(400)
+
+        def typist(text):
+            return lambda b: b.type(text)
+        scenario = [(30, typist("+++")), (35, typist("fences\r")), (40, typist(json.dumps(fence_set) + "\r")),
+                    (45, typist("+++\r"))]
+        kernel, board, loader, reason = simulate(60, scenario=scenario)
+        self.assertEqual(loader.modules["geofence"].count(), 400)
+        self.assertEqual(board.boots, 0)
+        # not in the settings, kept across a reset
+        self.assertNotIn("fences", loader.modules["settings"].read())
+        loader = firmware(board)
+        fences = loader.load("fences")
+        self.assertEqual(call(loader, fences.load), fence_set)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+
+from sim.tests import call, firmware
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        loader = firmware(overrides={"store._NUM_BLOCKS": 4})
+        self.loader = loader
+        self.outbox = loader.load("outbox")
+        self.store = loader.modules["store"]
+        self.store.init()
+
+    def fill(self, n=None, **extra):
+        # queues position points at ts "1000", "2000"...
+        outbox = self.outbox
+        for i in range(n or outbox._SIZE):
+            values = {"latitude": 45.0 + i, "longitude": 9.0, "speed": 50.0}
+            values.update(extra)
+            self.assertTrue(outbox.put(values, str(1000 * (i + 1)), outbox.POINT))
+
+    def queued(self):
+        outbox = self.outbox
+        res = []
+        for k in range(outbox._count):
+            i = (outbox._head + k) % outbox._SIZE
+            res.append((outbox._ts[i], outbox._values[i]))
+        return res
+
+    def backlog(self):
+        res = []
+
+        def publish(values, ts):
+            res.append((ts, values))
+            return True
+        call(self.loader, self.outbox._unspill)
+        call(self.loader, self.store.drain, publish, 100)
+        return res
+
+    def test_positions_merged(self):
+        self.fill()
+        self.assertTrue(self.outbox.put({"latitude": 50.0, "longitude": 9.5}, "9000"))
+        q = self.queued()
+        self.assertEqual(len(q), self.outbox._SIZE)
+        self.assertEqual(q[-1], ("9000", {"latitude": 50.0, "longitude": 9.5, "speed": 50.0}))
+        self.assertEqual(self.outbox.coalesced, 1)
+        self.assertEqual(self.outbox.dropped, 0)
+
+    def test_event_not_merged(self):
+        # the older point keeps its event, its position and its time
+        self.fill(self.outbox._SIZE - 1)
+        self.outbox.put({"latitude": 47.0, "longitude": 9.0, "event": 2, "sos": 1}, "8000")
+        self.outbox.put({"latitude": 48.0, "longitude": 9.1, "speed": 12.0}, "9000")
+        q = self.queued()
+        self.assertEqual(q[-2], ("8000", {"latitude": 47.0, "longitude": 9.0, "event": 2, "sos": 1}))
+        self.assertEqual(q[-1], ("9000", {"latitude": 48.0, "longitude": 9.1, "speed": 12.0}))
+        self.assertEqual(self.outbox.coalesced, 0)
+        # the oldest went to the backlog, nothing was lost
+        self.assertEqual(self.outbox.displaced, 1)
+        self.assertEqual(self.outbox.dropped, 0)
+        self.assertEqual(self.backlog(), [("1000", {"latitude": 45.0, "longitude": 9.0, "speed": 50.0})])
+
+    def test_sensor_values_not_merged(self):
+        self.fill(battery=12.5)
+        self.outbox.put({"latitude": 50.0, "longitude": 9.5}, "9000")
+        self.assertEqual(self.queued()[-1], ("9000", {"latitude": 50.0, "longitude": 9.5}))
+        self.assertEqual(self.outbox.displaced, 1)
+
+    def test_no_position_not_merged(self):
+        # the older position must not take the time of the newer point
+        self.fill()
+        self.outbox.put({"ignition": 0, "trip_distance": 12.3}, "9000")
+        q = self.queued()
+        self.assertEqual(q[-2][0], "8000")
+        self.assertEqual(q[-1], ("9000", {"ignition": 0, "trip_distance": 12.3}))
+        self.assertEqual(self.backlog()[0][0], "1000")
+
+    def test_batches_joined(self):
+        outbox = self.outbox
+        for i in range(outbox._SIZE):
+            outbox.put([{"ts": str(i), "values": {"speed": i}}], None, outbox.BATCH)
+        outbox.put([{"ts": "x", "values": {"speed": 0}}], None, outbox.BATCH)
+        self.assertEqual(len(self.queued()[-1][1]), 2)
+        self.assertEqual(outbox.coalesced, 1)
+
+    def test_in_flight_untouched(self):
+        self.fill()
+        self.outbox._busy = True
+        self.outbox.put({"ignition": 1}, "9000")
+        q = self.queued()
+        self.assertEqual(q[0][0], "1000")
+        self.assertEqual(q[1][0], "3000")
+        self.assertEqual(self.backlog()[0][0], "2000")
+
+    def test_drop_policies(self):
+        outbox = self.outbox
+        outbox._policy = outbox.DROP_NEWEST
+        self.fill()
+        self.assertFalse(outbox.put({"latitude": 50.0}, "9000"))
+        self.assertEqual(self.queued()[-1][0], "8000")
+        outbox._policy = outbox.DROP_OLDEST
+        self.assertTrue(outbox.put({"latitude": 50.0}, "9000"))
+        self.assertEqual([q[0] for q in self.queued()][0:2], ["2000", "3000"])
+        self.assertEqual((outbox.dropped, outbox.displaced), (2, 0))
+        self.assertEqual(self.backlog(), [])
+
+    def test_attributes_dropped(self):
+        outbox = self.outbox
+        outbox.put({"name": "x"}, None, outbox.ATTRIBUTES)
+        self.fill(outbox._SIZE - 1)
+        outbox.put({"ignition": 1}, "9000")
+        self.assertEqual((outbox.dropped, outbox.displaced), (1, 0))
+        self.assertEqual(self.backlog(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+
+from sim.kernel import SimReset
+from sim.run import simulate
+from sim.tests import call, firmware
+
+
+class ResetTest(unittest.TestCase):
+
+    def boot(self, board=None, load=True):
+        loader = firmware(board)
+        self.loader = loader
+        self.board = loader.board
+        self.utils = loader.load("utils")
+        self.settings = loader.modules["settings"]
+        self.trip = loader.modules["trip"]
+        self.aiding = loader.modules["aiding"]
+        call(loader, self.settings.load)
+        if load:
+            self.trip.load()
+            self.aiding.load()
+
+    def reset(self):
+        kernel = self.loader.kernel
+        kernel.spawn(self.utils.reset, (), "test")
+        self.assertIsInstance(kernel.run(), SimReset)
+
+    def test_saves_before_reset(self):
+        self.boot()
+        self.trip.odometer = 1234.5
+        self.aiding.update((45.46, 9.19, 120.0), self.board.unix_time())
+        self.aiding.update((45.47, 9.19, 120.0), self.board.unix_time() + 60)
+        self.reset()
+        self.boot(self.board)
+        self.assertEqual(self.trip.odometer, 1234.5)
+        self.assertEqual(self.aiding._saved[0:2], [45.47, 9.19])
+
+    def test_before_load(self):
+        # a reset before the odometer is loaded does not overwrite it
+        self.boot()
+        self.trip.odometer = 1000.0
+        self.trip.save()
+        self.boot(self.board, load=False)
+        self.reset()
+        self.boot(self.board)
+        self.assertEqual(self.trip.odometer, 1000.0)
+
+    def test_erase(self):
+        # nothing is written back after the settings are erased
+        self.boot()
+        self.trip.odometer = 1000.0
+        self.trip.save()
+        self.trip.odometer = 2000.0
+        self.utils.eraseSettings()
+        self.reset()
+        self.boot(self.board)
+        self.assertEqual(self.settings.read(), {})
+        self.assertEqual(self.trip.odometer, 0.0)
+
+    def test_link_reset(self):
+        # the link is down for 400 s while driving: the link manager resets
+        # the MCU and the next boot starts from the odometer at the reset
+        loaders = []
+
+        def ignition(b):
+            b.ignition = 1
+        scenario = [(30, ignition), (40, lambda b: b.drive(60, 90)), (200, lambda b: b.link(False)),
+                    (600, lambda b: b.link(True))]
+        kernel, board, loader, reason = simulate(700, scenario=scenario, setup=loaders.append)
+        self.assertEqual(board.boots, 1)
+        self.assertEqual(loaders[0].modules["link"].resets, 1)
+        at_reset = loaders[0].modules["trip"].odometer
+        self.assertGreater(at_reset, 5000.0)
+        self.boot(board)
+        self.assertEqual(self.trip.odometer, at_reset)
+
+
+if __name__ == "__main__":
+    unittest.main()
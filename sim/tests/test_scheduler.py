@@ -0,0 +1,118 @@
+import unittest
+
+from sim.run import simulate
+from sim.tests import firmware, run
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loader = firmware()
+        self.scheduler = self.loader.load("scheduler")
+        self.kernel = self.loader.kernel
+        self.runs = {}
+
+    def task(self, name, busy=0):
+        def fn():
+            self.runs.setdefault(name, []).append(self.kernel.now)
+            if busy > 0:
+                self.kernel.sleep(busy)
+        return fn
+
+    def test_shared_wakeups(self):
+        sch = self.scheduler
+        sch.add(self.task("a"), "a", 1000)
+        sch.add(self.task("b"), "b", 2000)
+        sch.add(self.task("c"), "c", 5000)
+        run(self.loader, 10000, sch.run)
+        self.assertEqual(self.runs["a"], list(range(0, 10001, 1000)))
+        self.assertEqual(self.runs["b"], list(range(0, 10001, 2000)))
+        self.assertEqual(self.runs["c"], [0, 5000, 10000])
+        # one wake-up per distinct deadline
+        self.assertEqual(sch.wakeups, 11)
+
+    def test_overruns(self):
+        sch = self.scheduler
+        slow = sch.add(self.task("slow", 2500), "slow", 1000)
+        fast = sch.add(self.task("fast"), "fast", 1000, 500)
+        run(self.loader, 10000, sch.run)
+        # the slow task keeps its phase, skipping the deadlines it missed
+        self.assertEqual(self.runs["slow"], [0, 3000, 6000, 9000])
+        name, runs, overruns, avg, jitter, busy = sch.stats(slow)
+        # the last run ends after the test
+        self.assertEqual((runs, overruns, jitter, busy), (4, 3, 0, 2500))
+        # and holds up the other one
+        name, runs, overruns, avg, jitter, busy = sch.stats(fast)
+        self.assertEqual((runs, overruns, jitter), (3, 3, 2000))
+
+    def test_trigger_from_thread(self):
+        sch = self.scheduler
+        task = sch.add(self.task("event"), "event", 60000)
+        sch.add(self.task("tick"), "tick", 10000)
+
+        def source():
+            for t in (1234, 2500, 7001):
+                self.kernel.sleep(t - self.kernel.now)
+                sch.trigger(task)
+        run(self.loader, 10000, sch.run, source)
+        self.assertEqual(self.runs["event"], [0, 1234, 2500, 7001])
+        # one wake-up per event, no polling in between
+        self.assertEqual(sch.wakeups, 5)
+
+    def test_trigger_delay(self):
+        sch = self.scheduler
+        task = sch.add(self.task("led"), "led", 5000)
+
+        def source():
+            self.kernel.sleep(1000)
+            sch.trigger(task, 200)
+            # a later deadline doesn't postpone the task
+            sch.trigger(task, 3000)
+        run(self.loader, 7000, sch.run, source)
+        # the period restarts from the triggered run
+        self.assertEqual(self.runs["led"], [0, 1200, 6200])
+
+    def test_set_period(self):
+        sch = self.scheduler
+        task = sch.add(self.task("t"), "t", 1000)
+
+        def source():
+            self.kernel.sleep(2500)
+            sch.set_period(task, 3000)
+        run(self.loader, 12000, sch.run, source)
+        self.assertEqual(self.runs["t"], [0, 1000, 2000, 5000, 8000, 11000])
+
+
+class LoopWakeupsTest(unittest.TestCase):
+    # the firmware with the inputs polled every 200 ms and the terminal
+    # every 400 ms, as in the fixed-sleep loop, against the defaults
+
+    def test_fewer_wakeups(self):
+        polled = simulate(900, overrides={"main.status_period": 200, "main.terminal_period": 400})
+        woken = simulate(900)
+        a = polled[2].modules["scheduler"].wakeups
+        b = woken[2].modules["scheduler"].wakeups
+        self.assertLess(b * 3, a)
+        self.assertLess(woken[0].wakeups["main"] * 3, polled[0].wakeups["main"])
+        # same publish cadence
+        ta = [m[0] for m in polled[1].broker.messages]
+        tb = [m[0] for m in woken[1].broker.messages]
+        self.assertEqual(len(ta), len(tb))
+        for x, y in zip(ta, tb):
+            self.assertLessEqual(abs(x - y), 200)
+        self.assertLessEqual(woken[2].modules["alarm"].latency_max, polled[2].modules["alarm"].latency_max)
+        # the CPU wakes at every 10 ms accelerometer sample, the other
+        # threads wake on the same ticks
+        self.assertLessEqual(woken[0].timer_wakeups, polled[0].timer_wakeups)
+
+    def test_fewer_timer_wakeups(self):
+        # with the accelerometer sampled every second, the ticks of the
+        # other threads are no longer hidden by its own
+        slow = {"accel._ACCEL_UPDATE": 1000}
+        polled = simulate(900, overrides=dict(slow, **{"main.status_period": 200, "main.terminal_period": 400}))
+        woken = simulate(900, overrides=slow)
+        self.assertLess(woken[0].timer_wakeups * 4, polled[0].timer_wakeups * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import random
+import unittest
+
+from sim.board import Flash
+from sim.tests import call, firmware
+
+
+class PowerLoss(Exception):
+    pass
+
+
+class FaultyFlash(Flash):
+    """Loses power after budget more bytes are written or erased, in the
+    middle of a write; an erase counts as one byte."""
+
+    budget = None
+
+    def spend(self, n):
+        if self.budget is None:
+            return n
+        n = min(n, self.budget)
+        self.budget -= n
+        return n
+
+    def erase_block(self, addr):
+        if self.spend(1) < 1:
+            raise PowerLoss()
+        Flash.erase_block(self, addr)
+
+    def write(self, addr, data):
+        n = self.spend(len(data))
+        Flash.write(self, addr, data[0:n])
+        if n < len(data):
+            raise PowerLoss()
+
+
+def _open(board=None):
+    loader = firmware(board)
+    settings = loader.load("settings")
+    call(loader, settings.load)
+    return settings, loader.board
+
+
+def _commit(settings, values):
+    for k in values:
+        if values[k] is None:
+            settings.remove(k)
+        else:
+            settings.set(k, values[k])
+    settings.commit()
+
+
+class SettingsTest(unittest.TestCase):
+
+    def test_reload(self):
+        settings, board = _open()
+        board.flash.preload_settings({"apn": "tm", "email": "a@b.it"})
+        settings, board = _open(board)
+        self.assertEqual(settings.read(), {"apn": "tm", "email": "a@b.it"})
+        _commit(settings, {"apn": "web", "email": None, "period": 30})
+        settings, board = _open(board)
+        self.assertEqual(settings.read(), {"apn": "web", "period": 30})
+
+    def test_compaction(self):
+        # 20 KB values fill a block in three commits
+        settings, board = _open()
+        for i in range(20):
+            _commit(settings, {"k%d" % (i % 2): chr(65 + i) * 20000, "n": i})
+        self.assertGreater(settings.erases, 4)
+        settings, board = _open(board)
+        self.assertEqual(settings.read(), {"k0": "S" * 20000, "k1": "T" * 20000, "n": 19})
+
+    def test_append_cost(self):
+        # a commit that fits the block serializes only its update
+        settings, board = _open()
+        _commit(settings, {"big": "x" * 30000})
+        record = settings._record
+        sizes = []
+
+        def counted(rtype, obj):
+            rec = record(rtype, obj)
+            sizes.append(len(rec))
+            return rec
+        settings._record = counted
+        _commit(settings, {"apn": "tm"})
+        self.assertEqual(len(sizes), 1)
+        self.assertLess(sizes[0], 100)
+
+    def test_too_large(self):
+        settings, board = _open()
+        _commit(settings, {"apn": "tm"})
+        erases = board.flash.erases
+        writes = board.flash.writes
+        # a single value over the limit
+        settings.set("fences", "x" * settings.MAX_SIZE)
+        settings.set("apn", "web")
+        self.assertRaises(ValueError, settings.commit)
+        # an update that forces a compaction the snapshot would not fit
+        _commit(settings, {"a": "x" * (settings.MAX_SIZE // 2)})
+        erases = board.flash.erases
+        writes = board.flash.writes
+        settings.set("b", "x" * (settings.MAX_SIZE // 2))
+        self.assertRaises(ValueError, settings.commit)
+        self.assertEqual((board.flash.erases, board.flash.writes), (erases, writes))
+        self.assertEqual(settings.get("apn"), "tm")
+        self.assertEqual(settings.get("b"), None)
+        self.assertEqual(sorted(settings.read()), ["a", "apn"])
+        # later commits still work and survive a reset
+        for i in range(5):
+            _commit(settings, {"n": i, "a": str(i) * 20000})
+        settings, board = _open(board)
+        self.assertEqual(settings.read(), {"apn": "tm", "n": 4, "a": "4" * 20000})
+
+    def test_power_loss(self):
+        # every commit is kept or lost entirely, whatever byte the power
+        # is lost at, and the commits after a reset are not lost
+        rng = random.Random(1)
+        for trial in range(100):
+            board = firmware().board
+            board.flash = FaultyFlash()
+            settings, board = _open(board)
+            expect = {}
+            for i in range(rng.randint(0, 4)):
+                values = {"k%d" % rng.randint(0, 3): str(i) * rng.randint(1, 20000), "n": i}
+                _commit(settings, values)
+                expect.update(values)
+            values = {"k%d" % rng.randint(0, 3): "new" * rng.randint(1, 7000), "n": None}
+            board.flash.budget = rng.randint(0, 25000)
+            try:
+                _commit(settings, values)
+                lost = False
+            except PowerLoss:
+                lost = True
+            board.flash.budget = None
+            settings, board = _open(board)
+            if not lost:
+                expect.update(values)
+                del expect["n"]
+            self.assertEqual(settings.read(), dict((k, v) for k, v in expect.items() if v is not None))
+            for i in range(3):
+                _commit(settings, {"k0": str(i) * 20000, "after": i})
+            settings, board = _open(board)
+            self.assertEqual(settings.get("after"), 2)
+            self.assertEqual(settings.get("k0"), "2" * 20000)
+
+    def test_write_error(self):
+        # a failed write without a reset: the commit raises, the cache keeps
+        # the old values and the next commits are saved
+        settings, board = _open()
+        board.flash = FaultyFlash()
+        board.flash.mem = bytearray(b"\xff" * len(board.flash.mem))
+        for budget in (0, 1, 5, 7, 20000, 30005):
+            settings, board = _open(board)
+            before = settings.read()
+            board.flash.budget = budget
+            self.assertRaises(PowerLoss, _commit, settings, {"k": "x" * 30000, "n": budget})
+            board.flash.budget = None
+            self.assertEqual(settings.read(), before)
+            _commit(settings, {"ok": budget})
+            _commit(settings, {"k": "y" * 30000})
+            settings, board = _open(board)
+            self.assertEqual(settings.get("ok"), budget)
+            self.assertEqual(settings.get("k"), "y" * 30000)
+
+
+if __name__ == "__main__":
+    unittest.main()
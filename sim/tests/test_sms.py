@@ -0,0 +1,106 @@
+import unittest
+
+from sim.tests import call, firmware
+
+
+class ParseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.utils = firmware().load("utils")
+
+    def test_commands(self):
+        changes = {}
+        res = self.utils.parse_sms("apn=web.tim.it,EMAIL=a@b.it, name = Truck 12 ", changes)
+        self.assertEqual(res, [["apn web.tim.it saved", "apn", "web.tim.it"],
+                               ["email a@b.it saved", "email", "a@b.it"],
+                               ["name changed Truck 12", "name", "Truck 12"]])
+        self.assertEqual(changes, {"apn": "web.tim.it", "email": "a@b.it", "name": "Truck 12"})
+
+    def test_spaces_removed(self):
+        changes = {}
+        self.utils.parse_sms("apn= web .it ,email=a @b.it", changes)
+        self.assertEqual(changes, {"apn": "web.it", "email": "a@b.it"})
+
+    def test_invalid(self):
+        changes = {"apn": "old"}
+        res = self.utils.parse_sms("apn=bad apn!,email=nobody,hello,=x,name", changes)
+        self.assertEqual(res, [["apn badapn! invalid", None, None], ["email nobody invalid", None, None]])
+        self.assertEqual(changes, {"apn": "old"})
+
+    def test_unknown_and_empty(self):
+        changes = {}
+        self.assertEqual(self.utils.parse_sms("", changes), [])
+        self.assertEqual(self.utils.parse_sms("reboot,status=1,,", changes), [])
+        self.assertEqual(changes, {})
+
+    def test_erase(self):
+        changes = {"apn": "old", "name": "x"}
+        res = self.utils.parse_sms("email=a@b.it,erase,apn=new", changes)
+        self.assertEqual(res, [["email a@b.it saved", "email", "a@b.it"], ["erase done", None, None],
+                               ["apn new saved", "apn", "new"]])
+        self.assertEqual(changes, {"*erase": True, "apn": "new"})
+
+    def test_last_wins(self):
+        changes = {}
+        self.utils.parse_sms("apn=one,apn=two", changes)
+        self.assertEqual(changes, {"apn": "two"})
+
+
+class ReadTest(unittest.TestCase):
+
+    def setUp(self):
+        loader = firmware()
+        self.loader = loader
+        self.board = loader.board
+        self.board.flash.preload_settings({"apn": "tm", "email": "a@b.it", "name": "Polaris"})
+        self.utils = loader.load("utils")
+        self.settings = loader.modules["settings"]
+        call(loader, self.settings.load)
+        self.utils.modem = loader.fakes["fortebit.polaris"].modem.init()
+
+    def read(self):
+        return call(self.loader, self.utils.read_and_parse_sms)
+
+    def replies(self):
+        res = {}
+        for num, text in self.board.sms_out:
+            res.setdefault(num, []).append(text)
+        return res
+
+    def test_burst(self):
+        self.board.send_sms("apn=web,name=Van", "+391")
+        self.board.send_sms("email=c@d.it", "+392")
+        self.board.send_sms("name=Van 2", "+391")
+        self.assertTrue(self.read())
+        self.assertEqual(self.board.sms_in, [])
+        self.assertEqual(self.replies(), {"+391": ["apn web saved,name Van replaced,name changed Van 2"],
+                                          "+392": ["email c@d.it saved"]})
+        self.assertEqual(self.settings.read(), {"apn": "web", "email": "c@d.it", "name": "Van 2"})
+
+    def test_erase_amends_replies(self):
+        # changes staged before an erase are dropped, so are their replies
+        self.board.send_sms("apn=web", "+391")
+        self.board.send_sms("email=c@d.it,erase", "+392")
+        self.board.send_sms("name=Van", "+393")
+        self.assertTrue(self.read())
+        self.assertEqual(self.replies(), {"+391": ["apn web erased"], "+392": ["email c@d.it erased,erase done"],
+                                          "+393": ["name changed Van"]})
+        self.assertEqual(self.settings.read(), {"name": "Van"})
+
+    def test_no_change(self):
+        self.board.send_sms("apn=tm,hello", "+391")
+        self.board.send_sms("status", "+392")
+        self.assertFalse(self.read())
+        self.assertEqual(self.replies(), {"+391": ["apn tm saved"]})
+        self.assertEqual(self.board.sms_in, [])
+
+    def test_pages(self):
+        for i in range(25):
+            self.board.send_sms("name=n%d" % i, "+391")
+        self.assertTrue(self.read())
+        self.assertEqual(self.settings.get("name"), "n24")
+        self.assertEqual(len(self.board.sms_out), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
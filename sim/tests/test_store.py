@@ -0,0 +1,165 @@
+import unittest
+
+from sim.tests import call, firmware
+
+_BLOCKS = 4
+
+
+def _open(board=None):
+    loader = firmware(board, {"store._NUM_BLOCKS": _BLOCKS})
+    store = loader.load("store")
+    store.init()
+    return store, loader.board
+
+
+def _drain(store, sent, fail_after=None):
+    def publish(values, ts):
+        if fail_after is not None and len(sent) >= fail_after:
+            return False
+        sent.append(ts)
+        return True
+    return store.drain(publish, 1000)
+
+
+class StoreTest(unittest.TestCase):
+
+    def test_order(self):
+        store, board = _open()
+        self.assertFalse(store.pending())
+        for i in range(10):
+            self.assertTrue(store.push(str(i), {"speed": i}))
+        self.assertTrue(store.pending())
+        self.assertEqual(store.peek(), [str(0), {"speed": 0}])
+        sent = []
+        self.assertEqual(_drain(store, sent), 10)
+        self.assertEqual(sent, [str(i) for i in range(10)])
+        self.assertFalse(store.pending())
+        self.assertEqual(store.peek(), None)
+
+    def test_wrap_around(self):
+        # a quarter of a block per record, the ring holds 4 blocks
+        store, board = _open()
+        pad = "x" * (store._BLOCK_SIZE // 4 - 64)
+        n = 0
+        while store.dropped == 0:
+            self.assertTrue(store.push(str(n), {"pad": pad}))
+            n += 1
+        # only the ring is used, and each block was erased about as often
+        used = [b for b in board.flash.block_erases if board.flash.block_erases[b] > 0]
+        self.assertEqual(sorted(used), list(range(store._FIRST_BLOCK, store._FIRST_BLOCK + _BLOCKS)))
+        for i in range(3 * _BLOCKS * 4):
+            store.push(str(n), {"pad": pad})
+            n += 1
+        erases = [board.flash.block_erases[b] for b in used]
+        self.assertLessEqual(max(erases) - min(erases), 1)
+        sent = []
+        _drain(store, sent)
+        # the newest records survive, in order and without gaps
+        self.assertEqual(sent[-1], str(n - 1))
+        self.assertEqual(sent, [str(i) for i in range(n - len(sent), n)])
+        self.assertGreaterEqual(len(sent), (_BLOCKS - 1) * 3)
+        # every record lost is counted
+        self.assertEqual(store.dropped, n - len(sent))
+
+    def test_reset_recovery(self):
+        store, board = _open()
+        for i in range(20):
+            store.push(str(i), {"speed": i})
+        sent = []
+        _drain(store, sent, fail_after=7)
+        self.assertEqual(len(sent), 7)
+        store, board = _open(board)
+        self.assertTrue(store.pending())
+        _drain(store, sent)
+        self.assertEqual(sent, [str(i) for i in range(20)])
+        # appends continue after the recovered records
+        store.push("20", {"speed": 20})
+        store, board = _open(board)
+        _drain(store, sent)
+        self.assertEqual(sent, [str(i) for i in range(21)])
+
+    def test_no_duplicates(self):
+        store, board = _open()
+        # 7 records per block, within the ring
+        pad = "x" * (store._BLOCK_SIZE // 8)
+        for i in range(20):
+            store.push(str(i), {"pad": pad})
+        sent = []
+        # a reset after every few records, in the middle of blocks
+        while store.pending():
+            _drain(store, sent, fail_after=len(sent) + 3)
+            store, board = _open(board)
+            if store.peek() is None:
+                break
+        self.assertEqual(sent, [str(i) for i in range(20)])
+        store, board = _open(board)
+        _drain(store, sent)
+        self.assertEqual(len(sent), 20)
+
+    def test_read_marks(self):
+        # small records over three blocks, a reset resumes at the last mark
+        store, board = _open()
+        pad = "x" * 200
+        n = 0
+        while store._seq < 2 or store._wpos < store._BLOCK_SIZE // 2:
+            store.push(str(n), {"pad": pad})
+            n += 1
+        sent = []
+        _drain(store, sent, fail_after=n - 10)
+        store, board = _open(board)
+        self.assertEqual(store._tail, 2)
+        reads = board.flash.reads
+        self.assertEqual(store.peek()[0], str(n - 10))
+        self.assertLessEqual(board.flash.reads - reads, 2 * store._MARK_STEP // 200)
+        _drain(store, sent)
+        self.assertEqual(sent, [str(i) for i in range(n)])
+        # blocks entirely sent are marked as such
+        store, board = _open(board)
+        self.assertEqual(store._tail, 2)
+        self.assertEqual(store.peek(), None)
+        self.assertFalse(store.pending())
+
+    def test_timestamp(self):
+        loader = firmware(None, {"store._NUM_BLOCKS": _BLOCKS})
+        store = loader.load("store")
+        clock = loader.load("clock")
+        kernel = loader.kernel
+
+        def stored():
+            store.init()
+            kernel.sleep(1000)
+            store.push(None, {"speed": 1})
+            # the clock is synced after the point was stored
+            kernel.sleep(1000)
+            clock.sync((2024, 5, 1, 12, 0, 0, 0))
+            kernel.sleep(1000)
+            store.push(None, {"speed": 2})
+        call(loader, stored)
+        unix = 1714564800
+        self.assertEqual(store.peek(), [str(unix - 1) + "000", {"speed": 1}, 1000])
+        # local times of a previous boot are of no use
+        loader = firmware(loader.board, {"store._NUM_BLOCKS": _BLOCKS})
+        store = loader.load("store")
+        call(loader, store.init)
+        loader.load("clock").sync((2024, 5, 1, 13, 0, 0, 0))
+        self.assertEqual(store.peek(), [None, {"speed": 1}, 1000])
+        store.pop()
+        # stored with the time of the synced clock
+        self.assertEqual(store.peek(), [str(unix + 1) + "000", {"speed": 2}])
+
+    def test_interrupted_write(self):
+        store, board = _open()
+        for i in range(3):
+            store.push(str(i), {"speed": i})
+        # power lost while programming a record: header written, data not
+        addr = store._addr(store._seq) + store._wpos
+        board.flash.write(addr, bytes([store._MAGIC, store._PENDING, 0, 40]))
+        store, board = _open(board)
+        store.push("3", {"speed": 3})
+        sent = []
+        _drain(store, sent)
+        self.assertEqual(sent, ["0", "1", "2", "3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
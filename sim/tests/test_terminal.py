@@ -0,0 +1,131 @@
+import unittest
+
+from sim.tests import firmware, run
+
+
+class ScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.utils = firmware().load("utils")
+
+    def scan(self, *blocks):
+        # (data, t) blocks, returns the result of each
+        return [self.utils._scan(bytearray(data, "latin-1"), t) for data, t in blocks]
+
+    def test_single_block(self):
+        self.assertEqual(self.scan(("+++", 0)), [True])
+        self.assertEqual(self.scan(("ab+++cd", 5000)), [True])
+
+    def test_noise_resets(self):
+        self.assertEqual(self.scan(("++x+", 0), ("+", 100)), [False, False])
+        self.assertEqual(self.scan(("+", 200)), [True])
+        self.assertEqual(self.scan(("+ ++", 0), ("\\r+", 10)), [False, False])
+
+    def test_split_in_window(self):
+        self.assertEqual(self.scan(("+", 0), ("+", 500), ("+", 999)), [False, False, True])
+        self.assertEqual(self.scan(("++", 10000), ("+", 10999)), [False, True])
+
+    def test_window_edge(self):
+        # the window starts at the first '+', the sequence restarts at the
+        # first '+' outside it
+        self.assertEqual(self.scan(("+", 0), ("+", 500), ("+", 1000)), [False, False, False])
+        self.assertEqual(self.scan(("+", 1500), ("+", 1999)), [False, True])
+        self.assertEqual(self.scan(("++", 0), ("+", 1000), ("++", 1999)), [False, False, True])
+        self.assertEqual(self.scan(("+", 0), ("+", 950), ("+", 1050), ("+", 1100)), [False, False, False, False])
+        self.assertEqual(self.scan(("+", 1949)), [True])
+
+    def test_many_plus(self):
+        # detected at the third, the rest of the block is not scanned
+        self.assertEqual(self.scan(("++++++", 0), ("+", 10)), [True, False])
+        self.assertEqual(self.scan(("++", 20)), [True])
+
+    def test_interleaved(self):
+        self.assertEqual(self.scan(("+a+b+", 0), ("+.+.+.", 10)), [False, False])
+
+
+class ReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        loader = firmware()
+        self.loader = loader
+        self.board = loader.board
+        self.utils = loader.load("utils")
+        self.console = loader.fakes["streams"].serial()
+        self.notified = []
+
+    def notify(self):
+        self.notified.append(self.loader.kernel.now)
+
+    def typist(self, keys):
+        # keys is a list of (ms, text)
+        kernel = self.loader.kernel
+        board = self.board
+
+        def typist():
+            for at, text in keys:
+                kernel.sleep(at - kernel.now)
+                board.type(text)
+        return typist
+
+    def start(self):
+        utils = self.utils
+        console = self.console
+        notify = self.notify
+
+        def reader():
+            utils.start_terminal(console, notify)
+        return reader
+
+    def test_burst(self):
+        # a kilobyte of noise with the sequence in the middle, in one block
+        noise = "".join(chr(32 + i % 90) for i in range(1000)).replace("+", "-")
+        run(self.loader, 1000, self.start(), self.typist([(120, noise + "+++" + noise)]))
+        self.assertTrue(self.utils.terminal_requested())
+        self.assertEqual(len(self.notified), 1)
+        self.assertEqual(self.notified, [120])
+        # the whole burst is drained with the sequence
+        self.assertEqual(self.console.available(), 0)
+
+    def test_noise_only(self):
+        noise = "".join(chr(32 + i % 90) for i in range(300)).replace("+", "-")
+        keys = [(100 + i * 7, noise) for i in range(100)] + [(900, "++"), (1950, "+")]
+        run(self.loader, 3000, self.start(), self.typist(keys))
+        self.assertFalse(self.utils.terminal_requested())
+        self.assertEqual(self.notified, [])
+        self.assertEqual(self.console.available(), 0)
+
+    def test_typed_in_window(self):
+        keys = [(100, "+"), (600, "+"), (1040, "+"), (2000, "x")]
+        run(self.loader, 3000, self.start(), self.typist(keys))
+        self.assertTrue(self.utils.terminal_requested())
+        self.assertEqual(len(self.notified), 1)
+        self.assertEqual(self.notified, [1040])
+        # the reader stays off the port until the terminal is done
+        self.assertEqual(self.console.available(), 1)
+
+    def test_typed_too_slowly(self):
+        keys = [(100, "+"), (600, "+"), (1200, "+"), (1500, "+"), (3000, "+")]
+        run(self.loader, 4000, self.start(), self.typist(keys))
+        self.assertFalse(self.utils.terminal_requested())
+        self.assertEqual(self.notified, [])
+
+    def test_terminal_done(self):
+        keys = [(100, "+++"), (500, "+++")]
+        run(self.loader, 1000, self.start(), self.typist(keys))
+        self.assertEqual(self.notified, [100])
+        self.utils.terminal_done()
+        self.assertFalse(self.utils.terminal_requested())
+        # the second sequence waited in the driver, a new reader finds it
+        self.utils._terminal_thread = None
+        run(self.loader, 1000, self.start())
+        self.assertTrue(self.utils.terminal_requested())
+        self.assertEqual(len(self.notified), 2)
+
+    def test_no_input(self):
+        # the reader sleeps on the port while nothing is typed
+        run(self.loader, 60000, self.start())
+        self.assertEqual(self.loader.kernel.wakeups.get("utils._terminal_reader", 0), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import calendar
+import time
+import unittest
+
+from sim.tests import firmware
+
+
+def _gm(secs):
+    t = time.gmtime(secs)
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec)
+
+
+class TimestampTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ts = firmware().load("timestamp")
+
+    def check(self, tm):
+        secs = calendar.timegm(tm + (0, 0, 0))
+        self.assertEqual(self.ts.to_unix(tm), secs, tm)
+        self.assertEqual(self.ts.from_unix(secs), tm, secs)
+
+    def test_epoch(self):
+        self.check((1970, 1, 1, 0, 0, 0))
+        self.assertEqual(self.ts.from_unix(0), (1970, 1, 1, 0, 0, 0))
+        self.assertEqual(self.ts.from_unix(-1), (1969, 12, 31, 23, 59, 59))
+
+    def test_leap_days(self):
+        for year in (1972, 2000, 2016, 2020, 2024, 2400):
+            self.check((year, 2, 28, 23, 59, 59))
+            self.check((year, 2, 29, 0, 0, 0))
+            self.check((year, 2, 29, 23, 59, 59))
+            self.check((year, 3, 1, 0, 0, 0))
+            self.check((year, 12, 31, 23, 59, 59))
+            self.check((year + 1, 1, 1, 0, 0, 0))
+
+    def test_century_years(self):
+        # divisible by 100 but not by 400: no February 29th
+        for year in (1900, 2100, 2200, 2300):
+            self.check((year, 2, 28, 23, 59, 59))
+            self.check((year, 3, 1, 0, 0, 0))
+            self.check((year, 12, 31, 12, 0, 0))
+        self.assertEqual(self.ts.to_unix((2100, 3, 1, 0, 0, 0)) - self.ts.to_unix((2100, 2, 28, 0, 0, 0)), 86400)
+        self.assertEqual(self.ts.to_unix((2000, 3, 1, 0, 0, 0)) - self.ts.to_unix((2000, 2, 28, 0, 0, 0)), 2 * 86400)
+
+    def test_every_day(self):
+        # noon and the last second of every day from 1968 to 2104
+        start = calendar.timegm((1968, 1, 1, 0, 0, 0, 0, 0, 0))
+        end = calendar.timegm((2104, 12, 31, 0, 0, 0, 0, 0, 0))
+        for day in range(start, end + 1, 86400):
+            for secs in (day + 43200, day + 86399):
+                tm = _gm(secs)
+                self.assertEqual(self.ts.from_unix(secs), tm)
+                self.assertEqual(self.ts.to_unix(tm), secs)
+
+    def test_gnss_tuple(self):
+        # fixes and the modem RTC give a 7th field, ignored
+        self.assertEqual(self.ts.to_unix((2019, 10, 13, 21, 33, 20, 0)), 1571002400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Serial ports with baud rate timing and driver FIFOs of limited size."""
+
+
+class Uart(object):
+    """A UART as seen through a Zerynth stream.
+
+    Bytes arriving on the wire go to a receive FIFO of rx_size bytes and are
+    dropped when it is full. Writes fill a transmit FIFO that drains at the
+    baud rate and only block while it is full; written bytes are delivered
+    to peer.feed() (or kept in `out`). Every stream call costs call_us of
+    CPU time, which is charged to the calling firmware thread.
+    """
+
+    def __init__(self, kernel, baud=115200, rx_size=128, tx_size=128, call_us=20):
+        self.kernel = kernel
+        self.baud = baud
+        self.rx_size = rx_size
+        self.tx_size = tx_size
+        self.call_us = call_us
+        self.rx = bytearray()
+        self.out = bytearray()
+        self.peer = None
+        self.received = 0
+        self.dropped = 0
+        self.calls = 0
+        self._tx_level = 0.0
+        self._tx_time = 0
+        self._debt = 0
+
+    def rate(self):
+        """Bytes per ms on the wire (8N1)."""
+        return self.baud / 10000.0
+
+    def feed(self, data):
+        free = self.rx_size - len(self.rx)
+        if len(data) > free:
+            self.dropped += len(data) - free
+            data = data[0:free]
+        self.rx.extend(data)
+        self.received += len(data)
+
+    def _call(self):
+        self.calls += 1
+        self._debt += self.call_us
+        if self._debt >= 1000:
+            ms = self._debt // 1000
+            self._debt -= ms * 1000
+            self.kernel.sleep(ms)
+
+    def _drain(self):
+        now = self.kernel.now
+        self._tx_level = max(0.0, self._tx_level - (now - self._tx_time) * self.rate())
+        self._tx_time = now
+
+    # stream interface
+
+    def available(self):
+        self._call()
+        return len(self.rx)
+
+    def read(self, n=1):
+        self._call()
+        n = min(n, len(self.rx))
+        data = bytes(self.rx[0:n])
+        del self.rx[0:n]
+        return data
+
+    def write(self, data):
+        self._call()
+        if isinstance(data, str):
+            data = data.encode("latin-1")
+        pos = 0
+        while pos < len(data):
+            self._drain()
+            free = int(self.tx_size - self._tx_level)
+            if free <= 0:
+                self.kernel.sleep(1)
+                continue
+            chunk = bytes(data[pos:pos + free])
+            self._tx_level += len(chunk)
+            pos += len(chunk)
+            if self.peer is not None:
+                self.peer.feed(chunk)
+            else:
+                self.out.extend(chunk)
@@ -0,0 +1,469 @@
+"""Stand-ins for the Zerynth VM and the Polaris libraries, and the app loader.
+
+Application modules are executed from the project root in their own
+namespace: their builtins are replaced with the Zerynth ones (sleep, thread,
+__ORD, __lookup, ...) and their imports are resolved first to the fakes
+below, then to the other application modules, then to the host Python.
+sys.modules is never touched, so several runs can share one process.
+"""
+
+import builtins
+import calendar
+import json
+import os
+import random
+import re
+import time
+import types
+
+from sim.kernel import SimReset, make_threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PRIO_LOWEST = 0
+PRIO_LOWER = 1
+PRIO_LOW = 2
+PRIO_NORMAL = 3
+PRIO_HIGH = 4
+PRIO_HIGHER = 5
+PRIO_HIGHEST = 6
+
+
+class zbytes(bytes):
+    """Zerynth bytes: built from str as well."""
+
+    def __new__(cls, x=b"", *args):
+        if isinstance(x, str) and not args:
+            x = x.encode("latin-1")
+        return bytes.__new__(cls, x, *args)
+
+
+class zstr(str):
+    """Zerynth str: bytes and bytearray convert to their text."""
+
+    def __new__(cls, x="", *args):
+        if isinstance(x, (bytes, bytearray)) and not args:
+            x = bytes(x).decode("latin-1")
+        return str.__new__(cls, x, *args)
+
+
+def _module(name, **attrs):
+    m = types.ModuleType(name)
+    for k in attrs:
+        setattr(m, k, attrs[k])
+    return m
+
+
+class _Stream(object):
+    """Serial port; read(n) blocks until n bytes have been received."""
+
+    def __init__(self, rx, tx, kernel):
+        self.rx = rx
+        self.tx = tx
+        self.kernel = kernel
+        self._want = 0
+
+    def available(self):
+        return len(self.rx)
+
+    def ready(self):
+        return len(self.rx) >= self._want
+
+    def read(self, n=1):
+        if len(self.rx) < n:
+            self._want = n
+            self.kernel.block(self)
+        data = zbytes(self.rx[0:n])
+        del self.rx[0:n]
+        return data
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("latin-1")
+        self.tx.extend(data)
+
+
+_RTC_DEFAULT = 315964800    # 1980-01-06, modem RTC after power on
+
+
+def _time_tuple(secs):
+    t = time.gmtime(secs)
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, 0)
+
+
+def make_fakes(kernel, board):
+    """Returns a dict of fake module name -> module for one simulated board."""
+    k = kernel
+    b = board
+    Lock, Event = make_threading(kernel)
+
+    # polaris board support
+    def _led(name, on):
+        def f():
+            b.leds[name] = on
+        return f
+
+    def _charger(on):
+        b.charging = bool(on)
+
+    polaris = _module(
+        "polaris",
+        init=lambda: None,
+        ledRedOn=_led("red", True), ledRedOff=_led("red", False),
+        ledGreenOn=_led("green", True), ledGreenOff=_led("green", False),
+        getIgnitionStatus=lambda: b.read("ignition", b.ignition),
+        getEmergencyStatus=lambda: b.read("sos", b.sos),
+        readMainVoltage=lambda: b.read("main_voltage", b.main_voltage),
+        readBattVoltage=lambda: b.read("batt_voltage", b.batt_voltage),
+        isBatteryBackup=lambda: b.read("backup", b.backup),
+        getChargerStatus=lambda: b.read("charger", b.charger),
+        setBatteryCharger=_charger,
+        gsm=_module("gsm", SERIAL="SERIAL2"),
+    )
+
+    class Modem(object):
+
+        def startup(self):
+            k.sleep(2000)
+            b.modem_ok = True
+            b.modem_started = k.now
+            b.rtc_synced = False
+
+        def shutdown(self):
+            k.sleep(500)
+            b.attached = False
+
+        def bypass(self, on):
+            pass
+
+        def rtc(self):
+            k.sleep(b.rtc_latency)
+            b.read("rtc", None)
+            # the default date until the network sets the clock
+            if not b.rtc_synced and b.registered_network():
+                b.rtc_synced = True
+            if not b.rtc_synced:
+                return _time_tuple(_RTC_DEFAULT + (k.now - b.modem_started) // 1000)
+            return _time_tuple(b.unix_time())
+
+        def pending_sms(self):
+            return len(b.sms_in)
+
+        def list_sms(self, unread, maxsms, offset):
+            k.sleep(b.rtc_latency)
+            b.read("list_sms", None)
+            res = []
+            for m in b.sms_in[offset:offset + maxsms]:
+                res.append((m[0], m[1], "19/10/13,12:00:00+08", m[2]))
+            return res
+
+        def delete_sms(self, index):
+            b.read("delete_sms", None)
+            for m in b.sms_in:
+                if m[2] == index:
+                    b.sms_in.remove(m)
+                    break
+
+        def send_sms(self, num, text):
+            k.sleep(b.rtc_latency)
+            b.read("send_sms", None)
+            b.sms_out.append((num, text))
+
+    modem = _module("modem", init=lambda: Modem())
+
+    class Gnss(object):
+
+        def __init__(self):
+            self.debug = False
+            self.rate = 1000
+            self.fixed = False
+
+        def start(self):
+            b.gnss_started = k.now
+            b.gnss_aided = None
+            self.fixed = False
+
+        def set_rate(self, ms):
+            self.rate = ms
+
+        def send(self, sentence):
+            # only the PMTK741 position and time aiding is understood
+            b.aids.append((k.now, sentence))
+            body, _, cs = sentence.strip()[1:].partition("*")
+            chk = 0
+            for c in body.encode():
+                chk ^= c
+            f = body.split(",")
+            if f[0] != "PMTK741" or int(cs, 16) != chk or len(f) != 10:
+                return
+            lat, lon = float(f[1]), float(f[2])
+            t = [int(x) for x in f[4:10]]
+            secs = calendar.timegm((t[0], t[1], t[2], t[3], t[4], t[5], 0, 0, 0))
+            # a wrong position or time is no better than a cold start
+            far = abs(lat - b.position[0]) > 0.5 or abs(lon - b.position[1]) > 0.5
+            if not far and abs(secs - b.unix_time()) <= 10:
+                b.gnss_aided = k.now
+
+        def has_fix(self):
+            if not b.gnss_on or b.nsat < 4:
+                return False
+            if not self.fixed:
+                ttff = b.gnss_started + b.ttff_cold
+                if b.gnss_aided is not None:
+                    ttff = min(ttff, max(b.gnss_started, b.gnss_aided) + b.ttff_aided)
+                if k.now < ttff:
+                    return False
+                self.fixed = True
+                b.fix_times.append(ttff)
+            return True
+
+        def fix(self):
+            b.read("gnss", None)
+            b.move()
+            lat, lon, alt = b.position
+            if b.jitter > 0:
+                lat += b.rng.gauss(0, b.jitter) / 111320.0
+                lon += b.rng.gauss(0, b.jitter) / 78000.0
+            # (lat, lon, alt, speed, cog, nsat, hdop, vdop, pdop, utc time)
+            return (lat, lon, alt, b.speed, b.cog, b.nsat, b.hdop, b.hdop, b.hdop,
+                    _time_tuple(b.unix_time()))
+
+    gnss = _module("gnss", init=lambda: Gnss())
+
+    class Accelerometer(object):
+
+        def acceleration(self):
+            b.read("accel", None)
+            return b.acceleration()
+
+        def temperature(self):
+            return b.read("temperature", b.temperature)
+
+    accelerometer = _module("accelerometer", Accelerometer=Accelerometer)
+
+    class QSpiFlash(object):
+
+        def erase_block(self, addr):
+            b.flash.erase_block(addr)
+
+        def __setitem__(self, addr, data):
+            b.flash.write(addr, data)
+
+        def read_data(self, addr, n):
+            return b.flash.read(addr, n)
+
+    qspiflash = _module("qspiflash", QSpiFlash=QSpiFlash)
+
+    def _cloud_call():
+        b.cloud_calls += 1
+        k.sleep(b.cloud_latency)
+
+    def _token(imei, uid):
+        _cloud_call()
+        return "SIMTOKEN"
+
+    def _is_registered(device, email):
+        _cloud_call()
+        return b.registered
+
+    def _register(device, email):
+        _cloud_call()
+        b.registered = True
+        return True
+
+    cloud = _module("cloud", getAccessToken=_token, isRegistered=_is_registered, register=_register)
+
+    # fortebit iot
+    class MqttClient(object):
+
+        def __init__(self, token, ctx):
+            self.token = token
+            self.debug = False
+
+    class Device(object):
+
+        def __init__(self, token, client, ctx=None):
+            self.client = client(token, ctx)
+            self.connected = False
+            b.devices.append(self)
+
+        def connect(self):
+            # TCP and TLS handshakes
+            k.sleep(b.broker.latency * 4)
+            self.connected = b.broker.up and b.attached and b.modem_ok
+            if self.connected:
+                b.connects.append(k.now)
+            return self.connected
+
+        def is_connected(self):
+            return self.connected
+
+        def run(self):
+            pass
+
+        def publish_telemetry(self, values, ts=None):
+            if not self.connected:
+                return False
+            if ts is not None:
+                values = {"ts": ts, "values": values}
+            return b.broker.publish("telemetry", json.dumps(values))
+
+        def publish_attributes(self, attrs):
+            if not self.connected:
+                return False
+            return b.broker.publish("attributes", json.dumps(attrs))
+
+    iot = _module("iot", Device=Device)
+    mqtt_client = _module("mqtt_client", MqttClient=MqttClient)
+
+    # wireless
+    def _attach(apn):
+        k.sleep(1000)
+        if not b.registered_network():
+            raise IOError("attach failed")
+        b.attached = True
+
+    def _detach():
+        b.attached = False
+
+    gsm = _module(
+        "gsm",
+        mobile_info=lambda: ("359000000000000", "8939000000000000000"),
+        network_info=lambda: ("GSM", 222, 10, "Sim", 1, 2, b.registered_network(), True),
+        attach=_attach,
+        detach=_detach,
+        link_info=lambda: ("10.0.0.2", "8.8.8.8"),
+    )
+    rng = random.Random(b.seed)
+
+    # VM and standard Zerynth modules
+    def _reset():
+        raise SimReset("mcu.reset")
+
+    def _watchdog(n, timeout):
+        b.watchdog_timeout = timeout
+        b.watchdog_kick = k.now
+
+    def _kick():
+        if b.watchdog_timeout and k.now - b.watchdog_kick > b.watchdog_timeout:
+            b.watchdog_expired += 1
+        b.watchdog_kick = k.now
+
+    def _serial(*args, **kw):
+        port = args[0] if len(args) > 0 else None
+        if port in b.serial_ports:
+            return b.serial_ports[port]
+        if port == polaris.gsm.SERIAL:
+            return _Stream(b.modem_serial, bytearray(), k)
+        return _Stream(b.console, bytearray(), k)
+
+    fortebit_polaris = _module("fortebit.polaris", polaris=polaris, modem=modem, gnss=gnss,
+                               accelerometer=accelerometer, qspiflash=qspiflash, cloud=cloud)
+    fortebit_iot = _module("fortebit.iot", iot=iot, mqtt_client=mqtt_client)
+    return {
+        "fortebit": _module("fortebit", polaris=fortebit_polaris, iot=fortebit_iot),
+        "fortebit.polaris": fortebit_polaris,
+        "fortebit.iot": fortebit_iot,
+        "wireless": _module("wireless", gsm=gsm),
+        "vm": _module("vm", set_option=lambda opt, v: None, info=lambda: ("SIM", "polaris_3g", "r2.3.0", "sim"),
+                      VM_OPT_RESET_ON_EXCEPTION=0, VM_OPT_TRACE_ON_EXCEPTION=1,
+                      VM_OPT_RESET_ON_HARDFAULT=2, VM_OPT_TRACE_ON_HARDFAULT=3),
+        "sfw": _module("sfw", watchdog=_watchdog, kick=_kick, watchdog_triggered=lambda: False),
+        "mcu": _module("mcu", reset=_reset, uid=lambda: [0x53, 0x49, 0x4d, 0x01]),
+        "timers": _module("timers", now=lambda: k.now),
+        "streams": _module("streams", serial=_serial),
+        "ssl": _module("ssl", create_ssl_context=lambda **kw: None, CERT_REQUIRED=1, SERVER_AUTH=2),
+        "requests": _module("requests"),
+        "pwr": _module("pwr", PWR_STOP=1, go_to_sleep=lambda ms, mode: k.sleep(ms)),
+        "threading": _module("threading", Lock=Lock, Event=Event),
+        "random": _module("random", random=rng.random, randint=rng.randint, seed=rng.seed),
+        "gc": _module("gc", info=lambda: (65536, b.heap_free, 0, 0), collect=lambda: None),
+    }
+
+
+class Loader(object):
+    """Loads application modules for one simulated board.
+
+    overrides maps "module.name" to a value replacing the one of the
+    module's top-level assignment, e.g. {"main.gps_period": 5000}.
+    """
+
+    def __init__(self, kernel, board, root=ROOT, out=None, stamp=True, overrides=None):
+        self.kernel = kernel
+        self.board = board
+        self.root = root
+        self.overrides = overrides or {}
+        self.fakes = make_fakes(kernel, board)
+        self.modules = {}
+        self.out = out
+        self.stamp = stamp
+        self._bol = True
+        self.builtins = dict(builtins.__dict__)
+        self.builtins.update({
+            "__import__": self._import,
+            "print": self._print,
+            "sleep": lambda ms, *args: kernel.sleep(ms),
+            "thread": self._thread,
+            "__ORD": lambda c: ord(c),
+            "__lookup": lambda key: key,
+            "SSL_CACERT_DST_ROOT_CA_X3": "SSL_CACERT_DST_ROOT_CA_X3",
+            "bytes": zbytes,
+            "str": zstr,
+            "PRIO_LOWEST": PRIO_LOWEST, "PRIO_LOWER": PRIO_LOWER, "PRIO_LOW": PRIO_LOW,
+            "PRIO_NORMAL": PRIO_NORMAL, "PRIO_HIGH": PRIO_HIGH, "PRIO_HIGHER": PRIO_HIGHER,
+            "PRIO_HIGHEST": PRIO_HIGHEST,
+        })
+
+    def _print(self, *args, sep=" ", end="\n", **kw):
+        if self.out is None:
+            return
+        text = sep.join(builtins.str(a) for a in args) + end
+        if self._bol and self.stamp:
+            text = "[%9.3f] " % (self.kernel.now / 1000.0) + text
+        self._bol = text.endswith("\n")
+        self.out.write(text)
+
+    def _thread(self, fn, *args, prio=PRIO_NORMAL, **kw):
+        name = "%s.%s" % (fn.__globals__.get("__name__", "?"), fn.__name__)
+        return self.kernel.spawn(fn, args, name)
+
+    def _is_app(self, name):
+        return "." not in name and os.path.isfile(os.path.join(self.root, name + ".py"))
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if name in self.fakes:
+            mod = self.fakes[name]
+            if not fromlist and "." in name:
+                return self.fakes[name.split(".")[0]]
+            return mod
+        if level == 0 and self._is_app(name):
+            return self.load(name)
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def load(self, name):
+        """Imports application module name, once."""
+        if name in self.modules:
+            return self.modules[name]
+        path = os.path.join(self.root, name + ".py")
+        with open(path) as f:
+            src = f.read()
+        for key in self.overrides:
+            mod_name, _, var = key.rpartition(".")
+            if mod_name != name:
+                continue
+            # same line count, so tracebacks stay right
+            src, n = re.subn(r"^%s\s*=.*$" % re.escape(var), "%s = %r" % (var, self.overrides[key]), src,
+                             count=1, flags=re.M)
+            if n == 0:
+                raise KeyError("no top-level assignment of " + key)
+        code = compile(src, path, "exec")
+        mod = types.ModuleType(name)
+        mod.__file__ = path
+        mod.__dict__["__builtins__"] = self.builtins
+        self.modules[name] = mod
+        exec(code, mod.__dict__)
+        return mod
+
+    def start(self, name="main"):
+        """Spawns the firmware thread that runs module name."""
+        return self.kernel.spawn(self.load, (name,), name)
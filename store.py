@@ -0,0 +1,274 @@
+# Store-and-forward log for telemetry records that could not be published.
+#
+# Records are appended to a ring of flash blocks placed after the settings
+# block, so flash usage is bounded and erases rotate over the whole ring.
+# Each block starts with a 4 bytes sequence number (big endian) and _MARKS
+# read marks, followed by records with the layout:
+#   magic (1) | flag (1) | length (2) | payload (length)
+# The payload is the JSON encoding of [timestamp, telemetry], or of
+# [None, telemetry, local time] for a point stored before the clock was
+# synced, which gets its timestamp when resent if the clock has been synced
+# since, in the same boot. When a record has been sent its flag byte is
+# cleared in place (bits can only go 1 -> 0), so nothing is erased until the
+# block is recycled. The read offset is written to the next free mark (16
+# bits) every _MARK_STEP bytes of sent records, and 0 once the whole block
+# has been sent, so after a reset reading resumes at the last mark instead
+# of walking every record already sent.
+
+import json
+import timers
+import clock
+from fortebit.polaris import qspiflash
+
+_BLOCK_SIZE = 0x10000   # erase block size of the QSPI flash
+_FIRST_BLOCK = 16       # blocks before this are reserved (settings)
+_NUM_BLOCKS = 32        # 2MB of backlog
+_MARKS = 32             # read marks per block
+_MARK_STEP = _BLOCK_SIZE // _MARKS
+_HDR = 4 + 2 * _MARKS   # block header size (sequence number, read marks)
+_DONE = 0               # read mark of a block entirely sent
+_REC = 4                # record header size
+_MAGIC = 0xA5
+_PENDING = 0xFF
+_SENT = 0x00
+_ERASED = 0xFFFFFFFF
+
+_flash = None
+_seq = 0                # sequence of the block being written (head)
+_wpos = _HDR            # write offset in head block
+_tail = 0               # sequence of the block with the oldest record
+_rpos = _HDR            # read offset in tail block
+_cur = None             # (address, size) of the record returned by peek()
+_mark = 0               # next free read mark in tail block
+_marked = _HDR          # read offset of the last mark
+_boot = (0, _HDR)       # (sequence, offset) of the first record of this boot
+
+dropped = 0             # records lost because the ring was full
+
+
+def _addr(seq):
+    return (_FIRST_BLOCK + seq % _NUM_BLOCKS) * _BLOCK_SIZE
+
+
+def _read_u32(addr):
+    b = _flash.read_data(addr, 4)
+    return (b[0] << 24) | (b[1] << 16) | (b[2] << 8) | b[3]
+
+
+def _read_rec(addr):
+    # returns (flag, length) or None at the end of written data
+    b = _flash.read_data(addr, _REC)
+    if b[0] != _MAGIC:
+        return None
+    n = (b[2] << 8) | b[3]
+    return (b[1], n)
+
+
+def _read_marks(seq):
+    # returns (next free mark, last marked offset) of block seq
+    b = _flash.read_data(_addr(seq), 4 + 2 * _MARKS)
+    if ((b[0] << 24) | (b[1] << 16) | (b[2] << 8) | b[3]) != seq:
+        return (0, _HDR)
+    pos = _HDR
+    i = 0
+    while i < _MARKS:
+        m = (b[4 + 2 * i] << 8) | b[5 + 2 * i]
+        if m == 0xFFFF:
+            break
+        pos = m
+        i += 1
+    return (i, pos)
+
+
+def _write_mark(pos):
+    global _mark, _marked
+    _flash[_addr(_tail) + 4 + 2 * _mark] = bytes([pos >> 8, pos & 0xFF])
+    _mark += 1
+    _marked = pos
+
+
+def _count_pending(seq, pos):
+    # pending records of block seq from offset pos on
+    addr = _addr(seq)
+    n = 0
+    while pos + _REC <= _BLOCK_SIZE:
+        r = _read_rec(addr + pos)
+        if r is None or pos + _REC + r[1] > _BLOCK_SIZE:
+            break
+        if r[0] == _PENDING:
+            n += 1
+        pos += _REC + r[1]
+    return n
+
+
+def _open_block(seq):
+    addr = _addr(seq)
+    _flash.erase_block(addr)
+    _flash[addr] = bytes([(seq >> 24) & 0xFF, (seq >> 16) & 0xFF, (seq >> 8) & 0xFF, seq & 0xFF])
+
+
+def _next_block():
+    global _seq, _wpos, _tail, _rpos, _cur, _mark, _marked, dropped
+    _seq += 1
+    if _seq - _tail >= _NUM_BLOCKS:
+        # ring is full, discard the oldest block
+        n = 0
+        while _tail <= _seq - _NUM_BLOCKS:
+            n += _count_pending(_tail, _rpos)
+            _tail += 1
+            _rpos = _HDR
+        print("Backlog full, dropping oldest records:", n)
+        dropped += n
+        _cur = None
+        _mark = 0
+        _marked = _HDR
+    _open_block(_seq)
+    _wpos = _HDR
+
+
+def init():
+    """Scans the flash ring and recovers read and write positions"""
+    global _flash, _seq, _wpos, _tail, _rpos, _cur, _mark, _marked, _boot
+    _flash = qspiflash.QSpiFlash()
+    _cur = None
+    _mark = 0
+    _marked = _HDR
+    seqs = []
+    for b in range(_NUM_BLOCKS):
+        seq = _read_u32((_FIRST_BLOCK + b) * _BLOCK_SIZE)
+        if seq != _ERASED and seq % _NUM_BLOCKS == b:
+            seqs.append(seq)
+    if len(seqs) == 0:
+        _seq = 0
+        _tail = 0
+        _open_block(0)
+        _wpos = _HDR
+        _rpos = _HDR
+        _boot = (0, _HDR)
+        return
+    _seq = max(seqs)
+    _tail = _seq
+    for seq in seqs:
+        if seq > _seq - _NUM_BLOCKS and seq < _tail:
+            _tail = seq
+    # skip the blocks entirely sent, resume at the last read mark
+    m = _read_marks(_tail)
+    while m[1] == _DONE and _tail != _seq:
+        _tail += 1
+        m = _read_marks(_tail)
+    _mark = m[0]
+    _marked = m[1] if m[1] != _DONE else _HDR
+    _rpos = _marked
+    # find end of data in head block
+    addr = _addr(_seq)
+    _wpos = _HDR
+    while _wpos + _REC <= _BLOCK_SIZE:
+        r = _read_rec(addr + _wpos)
+        if r is None:
+            break
+        if _wpos + _REC + r[1] > _BLOCK_SIZE:
+            # corrupted header, continue on a fresh block
+            _wpos = _BLOCK_SIZE
+            break
+        _wpos += _REC + r[1]
+    if _wpos + _REC <= _BLOCK_SIZE and _flash.read_data(addr + _wpos, 1)[0] != 0xFF:
+        # interrupted write, don't program over it
+        _wpos = _BLOCK_SIZE
+    _boot = (_seq, _wpos)
+    print("Backlog blocks:", _seq - _tail + 1)
+
+
+def push(ts, telemetry):
+    """Appends a record to the log, returns False if it can't be stored.
+    A point without timestamp is stored with the current time"""
+    global _wpos
+    if _flash is None:
+        return False
+    if ts is None:
+        ts = clock.stamp()
+    if ts is None:
+        rec = [None, telemetry, timers.now()]
+    else:
+        rec = [ts, telemetry]
+    rec = bytes(json.dumps(rec) + "\n")
+    n = len(rec)
+    if _HDR + _REC + n > _BLOCK_SIZE:
+        return False
+    if _wpos + _REC + n > _BLOCK_SIZE:
+        _next_block()
+    _flash[_addr(_seq) + _wpos] = bytes([_MAGIC, _PENDING, n >> 8, n & 0xFF]) + rec
+    _wpos += _REC + n
+    return True
+
+
+def pending():
+    """Returns True if there may be records waiting to be sent"""
+    return _flash is not None and (_tail != _seq or _rpos < _wpos)
+
+
+def peek():
+    """Returns the oldest pending record as (timestamp, telemetry) or None"""
+    global _tail, _rpos, _cur, _mark, _marked
+    if _flash is None:
+        return None
+    while True:
+        addr = _addr(_tail)
+        r = None
+        if _rpos + _REC <= _BLOCK_SIZE and (_tail != _seq or _rpos < _wpos):
+            r = _read_rec(addr + _rpos)
+        if r is None or _rpos + _REC + r[1] > _BLOCK_SIZE:
+            if _tail == _seq:
+                return None
+            if _mark < _MARKS:
+                _write_mark(_DONE)
+            _tail += 1
+            _rpos = _HDR
+            _mark = 0
+            _marked = _HDR
+            continue
+        if r[0] == _PENDING:
+            data = _flash.read_data(addr + _rpos + _REC, r[1])
+            if r[1] > 0 and data[r[1] - 1] == 0x0A:
+                try:
+                    rec = json.loads(data[0:r[1] - 1])
+                    if rec[0] is None and len(rec) > 2 and clock.synced and \
+                            (_tail > _boot[0] or (_tail == _boot[0] and _rpos >= _boot[1])):
+                        # stored before the clock was synced in this boot
+                        rec[0] = clock.stamp(rec[2])
+                    _cur = (addr + _rpos, r[1])
+                    return rec
+                except Exception as e:
+                    pass
+            # unreadable record, skip it
+            _flash[addr + _rpos + 1] = bytes([_SENT])
+        _rpos += _REC + r[1]
+
+
+def pop():
+    """Marks the record returned by peek() as sent"""
+    global _rpos, _cur
+    if _cur is None:
+        return
+    _flash[_cur[0] + 1] = bytes([_SENT])
+    if _cur[0] == _addr(_tail) + _rpos:
+        _rpos += _REC + _cur[1]
+        # the last mark is kept for the end of the block
+        if _rpos - _marked >= _MARK_STEP and _mark < _MARKS - 1:
+            _write_mark(_rpos)
+    _cur = None
+
+
+def drain(publish, max_records):
+    """Resends up to max_records stored records, oldest first.
+    publish(telemetry, ts) must return True on success.
+    Returns the number of records sent."""
+    sent = 0
+    while sent < max_records:
+        rec = peek()
+        if rec is None:
+            break
+        if not publish(rec[1], rec[0]):
+            break
+        pop()
+        sent += 1
+    return sent
@@ -46,3 +46,54 @@ _EPOCH_START = _ymd2ord(1970,1,1)
 def to_unix(ts):
     """Converts a date/time tuple to Unix timestamp in seconds"""
     return (((_ymd2ord(ts[0],ts[1],ts[2])-_EPOCH_START)*24+ts[3])*60+ts[4])*60+ts[5]
+
+_DI400Y = _days_before_year(401)    # number of days in 400 years
+_DI100Y = _days_before_year(101)    #    "    "   "   " 100   "
+_DI4Y   = _days_before_year(5)      #    "    "   "   "   4   "
+
+def _ord2ymd(n):
+    """ordinal -> (year, month, day), considering 01-Jan-0001 as day 1."""
+    # n is a 1-based index, starting at 1-Jan-1.  The pattern of leap years
+    # repeats exactly every 400 years.
+    n -= 1
+    n400 = n // _DI400Y
+    n = n % _DI400Y
+    year = n400 * 400 + 1   # ..., -399, 1, 401, ...
+
+    # Now n is the (non-negative) offset, in days, from January 1 of year, to
+    # the desired date.  Now compute how many 100-year cycles precede n.
+    n100 = n // _DI100Y
+    n = n % _DI100Y
+
+    # Now compute how many 4-year cycles precede it.
+    n4 = n // _DI4Y
+    n = n % _DI4Y
+
+    # And now how many single years.
+    n1 = n // 365
+    n = n % 365
+
+    year += n100 * 100 + n4 * 4 + n1
+    if n1 == 4 or n100 == 4:
+        # last day of a leap year (Dec 31st)
+        return year-1, 12, 31
+
+    # Now the year is correct, and n is the offset from January 1.  We find
+    # the month via an estimate that's either exact or one too large.
+    leapyear = n1 == 3 and (n4 != 24 or n100 == 3)
+    month = (n + 50) >> 5
+    preceding = _DAYS_BEFORE_MONTH[month] + (month > 2 and leapyear)
+    if preceding > n:  # estimate is too large
+        month -= 1
+        preceding -= _DAYS_IN_MONTH[month] + (month == 2 and leapyear)
+    n -= preceding
+
+    # Now the year and month are correct, and n is the offset from the
+    # start of that month:  we're done!
+    return year, month, n+1
+
+def from_unix(secs):
+    """Converts a Unix timestamp in seconds to a date/time tuple"""
+    y, m, d = _ord2ymd(secs // 86400 + _EPOCH_START)
+    secs = secs % 86400
+    return (y, m, d, secs // 3600, (secs // 60) % 60, secs % 60)
@@ -0,0 +1,160 @@
+# Sensor trace recorder.
+#
+# While started, the inputs the application samples are appended as compact
+# records to a ring, and a low priority thread writes them to the serial
+# console as "#T <hex>" lines between the other messages. A console log of a
+# drive can then be replayed on a PC with sim/replay.py.
+#
+#   record := type (1) | dt | value*
+#
+# dt is the time from the previous record in ms. Integers are the zigzag
+# varints of codec.py; accelerations and positions are delta coded from the
+# previous record of the same type.
+
+import threading
+import timers
+import ring
+import codec
+import timestamp
+
+ACCEL = 0x61            # 'a' x, y, z in mg
+TEMP = 0x74             # 't' accelerometer temperature in 0.01 C
+FIX = 0x66              # 'f' lat, lon (1e-6 deg), alt (dm), speed, COG (0.1), nsat, HDOP (0.01), time (s from codec.TS_EPOCH)
+NOFIX = 0x6E            # 'n'
+INPUTS = 0x69           # 'i' ignition, sos
+SENSOR = 0x73           # 's' sensors source, value (x1000)
+
+_BUF = 4096
+_LINE = 48              # record bytes per console line
+_PERIOD = 100           # ms between writes
+
+_lock = threading.Lock()
+_ring = ring.new(_BUF)
+_stream = None
+_thread = None
+_time = 0
+_accel = [0, 0, 0]
+_fix = [0, 0]
+
+enabled = False
+lost = 0                # records that didn't fit in the ring
+
+
+def _begin(kind, t):
+    rec = bytearray()
+    rec.append(kind)
+    codec._put(rec, t - _time)
+    return rec
+
+
+def _end(rec, t):
+    # a record is stored whole or not at all, so deltas stay consistent
+    global _time, lost
+    if ring.free(_ring) < len(rec):
+        lost += 1
+        return False
+    ring.put(_ring, rec)
+    _time = t
+    return True
+
+
+def accel(a):
+    _lock.acquire()
+    t = timers.now()
+    rec = _begin(ACCEL, t)
+    v = [int(a[0] * 1000), int(a[1] * 1000), int(a[2] * 1000)]
+    for i in range(3):
+        codec._put(rec, v[i] - _accel[i])
+    if _end(rec, t):
+        for i in range(3):
+            _accel[i] = v[i]
+    _lock.release()
+
+
+def temp(v):
+    _lock.acquire()
+    t = timers.now()
+    rec = _begin(TEMP, t)
+    codec._put(rec, int(v * 100))
+    _end(rec, t)
+    _lock.release()
+
+
+def fix(raw):
+    _lock.acquire()
+    t = timers.now()
+    if raw is None:
+        _end(_begin(NOFIX, t), t)
+    else:
+        rec = _begin(FIX, t)
+        lat = int(raw[0] * 1000000)
+        lon = int(raw[1] * 1000000)
+        codec._put(rec, lat - _fix[0])
+        codec._put(rec, lon - _fix[1])
+        codec._put(rec, int(raw[2] * 10))
+        codec._put(rec, int(raw[3] * 10))
+        codec._put(rec, int(raw[4] * 10))
+        codec._put(rec, int(raw[5]))
+        codec._put(rec, int(raw[6] * 100))
+        codec._put(rec, timestamp.to_unix(raw[9]) - codec.TS_EPOCH)
+        if _end(rec, t):
+            _fix[0] = lat
+            _fix[1] = lon
+    _lock.release()
+
+
+def inputs(ignition, sos):
+    _lock.acquire()
+    t = timers.now()
+    rec = _begin(INPUTS, t)
+    codec._put(rec, ignition)
+    codec._put(rec, sos)
+    _end(rec, t)
+    _lock.release()
+
+
+def sensor(src, value):
+    _lock.acquire()
+    t = timers.now()
+    rec = _begin(SENSOR, t)
+    codec._put(rec, src)
+    codec._put(rec, int(value * 1000))
+    _end(rec, t)
+    _lock.release()
+
+
+def _run():
+    while True:
+        sleep(_PERIOD)
+        while True:
+            _lock.acquire()
+            data = ring.get(_ring, _LINE)
+            _lock.release()
+            if len(data) == 0:
+                break
+            _stream.write("#T " + codec.hexlify(data) + "\n")
+
+
+def start(stream):
+    """Starts tracing to stream"""
+    global _stream, _thread, _time, enabled
+    _lock.acquire()
+    _stream = stream
+    ring.clear(_ring)
+    # absolute values in the first records
+    _time = timers.now()
+    for i in range(3):
+        _accel[i] = 0
+    _fix[0] = 0
+    _fix[1] = 0
+    enabled = True
+    _lock.release()
+    print("#T start", _time)
+    if _thread is None:
+        _thread = thread(_run, prio=PRIO_LOW)
+
+
+def stop():
+    global enabled
+    enabled = False
+    print("#T stop, lost", lost)
@@ -0,0 +1,141 @@
+# Adaptive position reporting and track simplification.
+#
+# check() decides from the fix stream whether a position is worth sending
+# compared to the last reported() one: enough distance travelled, a heading
+# or speed change, or too much time since the last report. simplify() drops
+# buffered positions that lie within a tolerance of the simplified path
+# (Douglas-Peucker), keeping any point that carries more than a position.
+#
+# Distances use an equirectangular projection, accurate at these scales.
+
+import math
+import record
+
+_EARTH_RADIUS = 6371000.0
+_MIN_DISTANCE = 250.0       # m
+_MIN_HEADING = 25.0         # degrees
+_HEADING_SPEED = 10.0       # km/h, below this COG is not reliable
+_MIN_SPEED_CHANGE = 20.0    # km/h
+_MAX_SILENCE = 120000       # ms
+_SIMPLIFY_TOL = 15.0        # m
+
+_POSITION = (record.LATITUDE, record.LONGITUDE, record.SPEED)
+
+_last = None                # (lat, lon, speed, cog, time) of the last report
+
+
+def reset():
+    global _last
+    _last = None
+
+
+def _xy(lat, lon, lat0, lon0):
+    # local planar coordinates in m
+    k = math.radians(1) * _EARTH_RADIUS
+    return ((lon - lon0) * k * math.cos(math.radians(lat0)), (lat - lat0) * k)
+
+
+def distance(lat1, lon1, lat2, lon2):
+    p = _xy(lat2, lon2, lat1, lon1)
+    return math.sqrt(p[0]*p[0] + p[1]*p[1])
+
+
+def reported(lat, lon, speed, cog, now):
+    """Records the last reported position"""
+    global _last
+    _last = (lat, lon, speed, cog, now)
+
+
+def check(lat, lon, speed, cog, now):
+    """Returns True if the position must be reported"""
+    report = _last is None or now - _last[4] >= _MAX_SILENCE
+    if not report:
+        if distance(_last[0], _last[1], lat, lon) >= _MIN_DISTANCE:
+            report = True
+        elif speed >= _HEADING_SPEED and _last[2] >= _HEADING_SPEED:
+            d = cog - _last[3]
+            if d > 180:
+                d -= 360
+            elif d < -180:
+                d += 360
+            report = d >= _MIN_HEADING or d <= -_MIN_HEADING
+        if not report:
+            d = speed - _last[2]
+            report = d >= _MIN_SPEED_CHANGE or d <= -_MIN_SPEED_CHANGE
+    return report
+
+
+def _deviation(p, a, b):
+    # distance of p from segment a-b, planar coordinates
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    l2 = dx*dx + dy*dy
+    t = 0.0
+    if l2 > 0:
+        t = ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / l2
+        if t < 0:
+            t = 0.0
+        elif t > 1:
+            t = 1.0
+    ex = p[0] - a[0] - t * dx
+    ey = p[1] - a[1] - t * dy
+    return math.sqrt(ex*ex + ey*ey)
+
+
+def simplify(points, tol=_SIMPLIFY_TOL):
+    """Simplifies a list of (ts, record) points, returns a new list"""
+    n = len(points)
+    if n < 3:
+        return points
+    keep = [False] * n
+    xy = [None] * n
+    lat0 = None
+    lon0 = None
+    for i in range(n):
+        r = points[i][1]
+        if r[record.LATITUDE] is None or r[record.LONGITUDE] is None:
+            keep[i] = True
+            continue
+        if lat0 is None:
+            lat0 = r[record.LATITUDE]
+            lon0 = r[record.LONGITUDE]
+        xy[i] = _xy(r[record.LATITUDE], r[record.LONGITUDE], lat0, lon0)
+        for k in range(record.SIZE):
+            if r[k] is not None and k not in _POSITION:
+                keep[i] = True
+                break
+    # split the track at kept points and simplify each run
+    stack = []
+    a = None
+    for i in range(n):
+        if xy[i] is None:
+            a = None
+            continue
+        if a is None:
+            keep[i] = True
+        elif keep[i] or i == n - 1 or xy[i + 1] is None:
+            keep[i] = True
+            if i - a > 1:
+                stack.append((a, i))
+        if keep[i]:
+            a = i
+    while len(stack) > 0:
+        a, b = stack.pop()
+        dmax = 0.0
+        m = 0
+        for i in range(a + 1, b):
+            d = _deviation(xy[i], xy[a], xy[b])
+            if d > dmax:
+                dmax = d
+                m = i
+        if dmax > tol:
+            keep[m] = True
+            if m - a > 1:
+                stack.append((a, m))
+            if b - m > 1:
+                stack.append((m, b))
+    res = []
+    for i in range(n):
+        if keep[i]:
+            res.append(points[i])
+    return res
@@ -0,0 +1,136 @@
+# Trips, odometer and idle time.
+#
+# A trip runs from ignition on to ignition off. Fixes taken during the trip
+# add the distance from the last counted position once the vehicle moved by
+# more than _MIN_STEP at a speed of at least _MIN_SPEED, so the wander of
+# the fix while stationary is not counted. The time to each fix is counted
+# as driving or idle by the speed of the previous one. Everything is kept
+# in running totals; end() adds the trip summary to the telemetry record.
+#
+# The odometer and the end time of the last trip are saved in settings at
+# the end of each trip, every _SAVE_DISTANCE and before controlled resets.
+
+import settings
+import clock
+import track
+import record
+
+_KEY = "trip"
+_MIN_SPEED = 3.0        # km/h, slower is stationary
+_MIN_STEP = 50.0        # m from the last counted position
+_SAVE_DISTANCE = 5000.0 # m driven between odometer saves
+
+odometer = 0.0          # m
+_saved = 0.0
+_loaded = False         # nothing is saved before load()
+_last_end = None        # unix time of the end of the last trip
+
+_active = False
+_start = 0              # local time in ms
+_stop = None            # s stopped before the trip
+_distance = 0.0
+_idle = 0               # ms
+_vmax = 0.0
+_anchor = None          # (lat, lon) of the last counted position
+_last_time = 0
+_moving = False
+
+
+def load():
+    """Reads the saved odometer, call once settings are loaded"""
+    global odometer, _saved, _last_end, _loaded
+    v = settings.get(_KEY)
+    if v is not None:
+        odometer = v[0]
+        _last_end = v[1]
+    _saved = odometer
+    _loaded = True
+
+
+def save():
+    """Writes the odometer to flash if it changed"""
+    global _saved
+    if not _loaded:
+        return
+    v = [odometer, _last_end]
+    if settings.get(_KEY) == v:
+        return
+    settings.set(_KEY, v)
+    settings.commit()
+    _saved = odometer
+
+
+def active():
+    return _active
+
+
+def start(now):
+    """Starts a trip at local time now in ms"""
+    global _active, _start, _stop, _distance, _idle, _vmax, _anchor, _last_time, _moving
+    _active = True
+    _start = now
+    _stop = None
+    t = clock.now()
+    if t is not None and _last_end is not None and t[0] >= _last_end:
+        _stop = t[0] - _last_end
+    _distance = 0.0
+    _idle = 0
+    _vmax = 0.0
+    _anchor = None
+    _last_time = now
+    _moving = False
+
+
+def _elapse(now):
+    global _idle, _last_time
+    if not _moving:
+        _idle += now - _last_time
+    _last_time = now
+
+
+def fix(lat, lon, speed, now):
+    """Adds an accurate fix taken at local time now in ms"""
+    global _distance, _vmax, _anchor, _moving, odometer
+    if not _active:
+        return
+    _elapse(now)
+    _moving = speed >= _MIN_SPEED
+    if speed > _vmax:
+        _vmax = speed
+    if _anchor is None:
+        _anchor = (lat, lon)
+        return
+    if not _moving:
+        return
+    d = track.distance(_anchor[0], _anchor[1], lat, lon)
+    if d >= _MIN_STEP:
+        _distance += d
+        odometer += d
+        _anchor = (lat, lon)
+        if odometer - _saved >= _SAVE_DISTANCE:
+            save()
+
+
+def end(now, r):
+    """Ends the trip at local time now in ms, adds the summary fields to record r.
+    Returns False if no trip was active"""
+    global _active, _last_end
+    if not _active:
+        return False
+    _elapse(now)
+    _active = False
+    duration = now - _start
+    t = clock.now()
+    if t is not None:
+        _last_end = t[0]
+    save()
+    drive = duration - _idle
+    r[record.TRIP_DISTANCE] = _distance / 1000.0
+    r[record.TRIP_TIME] = duration // 1000
+    r[record.TRIP_IDLE] = _idle // 1000
+    r[record.TRIP_VMAX] = _vmax
+    r[record.TRIP_VAVG] = _distance * 3600.0 / drive if drive > 0 else 0.0
+    r[record.ODOMETER] = odometer / 1000.0
+    if _stop is not None:
+        r[record.TRIP_STOP] = _stop
+    return True
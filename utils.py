@@ -1,12 +1,21 @@
 import mcu
 import sfw
-import pwr
 import timers
+import threading
 import streams
-import json
 from fortebit.polaris import polaris
-from fortebit.polaris import qspiflash
 import accel
+import settings
+import sensors
+import scheduler
+import diag
+import ring
+import aiding
+import trip
+import trace
+import json
+import geofence
+import fences
 
 modem = None
 gnss = None
@@ -15,21 +24,15 @@ check_sms = False
 
 has_qspi = True
 
-def decimal(n, v):
-    v = float(v)
-    s = "%%.%df" % n
-    return s % v
-
 # entry sequence is '+++' within 1 second
 start_check = 0
 count_check = 0
 
-def check_terminal(s):
+def _scan(data, t):
+    # runs the '+++' detector over data received at time t
     global start_check, count_check
-    while s.available() > 0:
-        c = s.read()[0]
+    for c in data:
         if c == __ORD('+'):
-            t = timers.now()
             count_check += 1
             if count_check == 1:
                 start_check = t
@@ -45,6 +48,64 @@ def check_terminal(s):
     return False
 
 
+def check_terminal(s):
+    n = s.available()
+    if n > 0:
+        return _scan(s.read(n), timers.now())
+    return False
+
+
+# The console is read by a low priority thread blocked on the port, which
+# signals the main loop when the entry sequence is received. The reader
+# stays off the port while the terminal is in use.
+
+_terminal = threading.Event()
+_terminal_free = threading.Event()
+_terminal_free.set()
+_terminal_thread = None
+_terminal_notify = None
+
+def _terminal_reader(s):
+    while True:
+        _terminal_free.wait()
+        try:
+            # wait for input, then scan what else has arrived
+            data = s.read(1)
+            while not _scan(data, timers.now()):
+                n = s.available()
+                if n == 0:
+                    data = None
+                    break
+                data = s.read(n)
+            if data is not None:
+                _terminal_free.clear()
+                _terminal.set()
+                if _terminal_notify is not None:
+                    _terminal_notify()
+        except Exception as e:
+            print("Terminal reader:", e)
+            sleep(1000)
+
+
+def start_terminal(s, notify=None):
+    """Starts the console reader, notify() is called when the terminal is requested"""
+    global _terminal_thread, _terminal_notify
+    if _terminal_thread is None:
+        _terminal_notify = notify
+        _terminal_thread = thread(_terminal_reader, s, prio=PRIO_LOW)
+
+
+def terminal_requested():
+    return _terminal.is_set()
+
+
+def terminal_done():
+    global count_check
+    count_check = 0
+    _terminal.clear()
+    _terminal_free.set()
+
+
 def do_terminal(s):
     print("[Type +++ to exit terminal]")
     while True:
@@ -55,7 +116,7 @@ def do_terminal(s):
         elif cmd == 'erase':
             eraseSettings()
             print("erase done")
-            mcu.reset()
+            reset()
         elif cmd == 'name':
             settings = readSettings()
             print("Old name:", settings["name"])
@@ -65,7 +126,7 @@ def do_terminal(s):
                 print("Saving name:", name)
                 settings["name"] = name
                 saveSettings(settings)
-                mcu.reset()
+                reset()
         elif cmd == 'modem':
             do_modem_passthru(s)
             break
@@ -74,6 +135,29 @@ def do_terminal(s):
             gnss.debug = not gnss.debug
             print("gnss debug =", gnss.debug)
             break
+        elif cmd == 'tasks':
+            scheduler.dump()
+        elif cmd == 'sensors':
+            sensors.dump()
+        elif cmd == 'diag':
+            diag.dump()
+        elif cmd == 'trace':
+            if trace.enabled:
+                trace.stop()
+            else:
+                trace.start(s)
+            break
+        elif cmd == 'fences':
+            # a JSON list of fences on one line, see geofence.py
+            print("Fences (JSON list, empty to remove all):")
+            line = input_line(s)
+            try:
+                fence_set = json.loads(line) if len(line) > 0 else []
+                fences.save(fence_set)
+                geofence.load(fence_set)
+                print("Fences saved:", geofence.count())
+            except Exception as e:
+                print("Fences not saved:", e)
         elif cmd == 'mqtt':
             global client
             if client is not None:
@@ -82,47 +166,75 @@ def do_terminal(s):
                 break
 
 
+_PASSTHRU_BUF = 1024    # bytes buffered in each direction
+_PASSTHRU_CHUNK = 64    # max bytes written per call, about a driver buffer
+
 def do_modem_passthru(s):
     print("Modem passthrough...[^ to exit]")
     modem.bypass(1)
     ms = streams.serial(polaris.gsm.SERIAL,baud=115200,set_default=False)
     ms.write('ATE1\r')
+    up = ring.new(_PASSTHRU_BUF)        # stream to modem
+    down = ring.new(_PASSTHRU_BUF)      # modem to stream
     while True:
         sfw.kick()
-        # modem to stream
+        # empty both receive buffers before any blocking write
+        idle = True
         n = ms.available()
         if n > 0:
-            s.write(ms.read(n))
-        # stream to modem
+            ring.put(down, ms.read(n))
+            idle = False
         n = s.available()
         if n > 0:
             b = s.read(n)
             if n == 1 and b[0] == __ORD('^'):
                 break
-            ms.write(b)
-        else:
+            ring.put(up, b)
+            idle = False
+        # then forward a block in each direction
+        if ring.count(down) > 0:
+            s.write(ring.get(down, _PASSTHRU_CHUNK))
+            idle = False
+        if ring.count(up) > 0:
+            ms.write(ring.get(up, _PASSTHRU_CHUNK))
+            idle = False
+        if idle:
             sleep(1)
+    while ring.count(up) > 0:
+        ms.write(ring.get(up, _PASSTHRU_CHUNK))
     ms.write('ATE0\r')
     modem.bypass(0)
+    if ring.dropped(up) > 0 or ring.dropped(down) > 0:
+        print("Passthrough dropped:", ring.dropped(up), ring.dropped(down))
 
 
 def input_line(s):
     res = bytearray()
     s.read(s.available())
     while True:
-        if s.available() < 1:
+        n = s.available()
+        if n < 1:
             sfw.kick()
             sleep(1)
             continue
-        c = s.read()[0]
-        if c == __ORD('\r') or c == __ORD('\n'):
+        # read and echo whole blocks
+        done = False
+        echo = bytearray()
+        for c in s.read(n):
+            if c == __ORD('\r') or c == __ORD('\n'):
+                done = True
+                break
+            if c == __ORD('\b') and len(res) > 0:
+                del res[-1]
+                echo.append(__ORD('\b'))
+                echo.append(__ORD(' '))
+            else:
+                res.append(c)
+            echo.append(c)
+        if len(echo) > 0:
+            s.write(echo)
+        if done:
             break
-        if c == __ORD('\b') and len(res) > 0:
-            del res[-1]
-            print('\b ', sep='', end='')
-        else:
-            res.append(c)
-        print(chr(c), sep='', end='')
     print()
     return str(res)
 
@@ -155,80 +267,158 @@ def validate_email(email):
     return len(email) > 2 and dom >= 256
 
 
-def saveSettings(settings):
+def saveSettings(values):
     if has_qspi:
-        my_flash = qspiflash.QSpiFlash()
-        my_flash.erase_block(0)
-        my_flash[0] = json.dumps(settings) + "\n"
+        for k in settings.read():
+            if k not in values:
+                settings.remove(k)
+        for k in values:
+            settings.set(k, values[k])
+        settings.commit()
 
 
 def readSettings():
     if has_qspi:
-        my_flash = qspiflash.QSpiFlash()
-        data = my_flash.read_data(0, 128)
-        if not data.find("\n") < 0:
-            return json.loads(data[0:data.find("\n")])
-        else:
-            return {}
+        return settings.read()
     else:
         return {"apn": "tm", "email": "test@test.com"}
 
 
 def eraseSettings():
-    my_flash = qspiflash.QSpiFlash()
-    my_flash.erase_block(0)
+    global _erased
+    settings.erase()
+    _erased = True
+
+
+_erased = False         # settings erased, nothing is saved before a reset
+
+def reset():
+    """Saves the odometer and the GNSS aiding data, then resets the MCU;
+    used for every controlled reset"""
+    if not _erased:
+        try:
+            trip.save()
+            aiding.save()
+        except Exception as e:
+            print("Failed saving before reset", e)
+    mcu.reset()
+
+
+# SMS commands: key -> handler(value, changes) returning the reply text.
+# Handlers only stage changes, they are saved with a single commit.
+
+def _sms_erase(value, changes):
+    print('erase flash')
+    # parse_sms drops earlier changes, erase before saving the following ones
+    changes["*erase"] = True
+    return "erase done"
+
+
+def _sms_apn(value, changes):
+    apn = value.replace(" ", "")
+    print("APN", apn)
+    if not validate_apn(apn):
+        return "apn " + apn + " invalid"
+    changes["apn"] = apn
+    return "apn " + apn + " saved"
+
+
+def _sms_email(value, changes):
+    email = value.replace(" ", "")
+    print("email", email)
+    if not validate_email(email):
+        return "email " + email + " invalid"
+    changes["email"] = email
+    return "email " + email + " saved"
+
+
+def _sms_name(value, changes):
+    name = value.strip()
+    print("name", name)
+    changes["name"] = name
+    return "name changed " + name
+
+
+# key: (handler, needs value)
+_SMS_COMMANDS = {
+    "erase": (_sms_erase, False),
+    "apn": (_sms_apn, True),
+    "email": (_sms_email, True),
+    "name": (_sms_name, True),
+}
+
+_SMS_PAGE = 10
+_SMS_MAX_PAGES = 5
+
+
+def parse_sms(text, changes):
+    """Applies the comma separated key=value commands in text to changes,
+    returns a [reply, key, value] list per command; key and value are the
+    change staged by the command, key is None if it staged none"""
+    res = []
+    for line in text.split(","):
+        line = line.split("=")
+        key = line[0].lower().strip()
+        if key in _SMS_COMMANDS:
+            cmd = _SMS_COMMANDS[key]
+            if cmd[1] and len(line) < 2:
+                continue
+            staged = {}
+            reply = cmd[0](line[1] if len(line) > 1 else None, staged)
+            if "*erase" in staged:
+                changes.clear()
+            r = [reply, None, None]
+            for k in staged:
+                changes[k] = staged[k]
+                if k[0] != "*":
+                    r[1] = k
+                    r[2] = staged[k]
+            res.append(r)
+    return res
 
 
 def read_and_parse_sms():
-    mcu_reset = False
-    sms = modem.list_sms(False,10,0)
-    if sms and len(sms) > 0:
+    changes = {}
+    staged = []     # [sender, reply, key, value]
+    # collect all pending messages
+    for _ in range(_SMS_MAX_PAGES):
+        sms = modem.list_sms(False,_SMS_PAGE,0)
+        if not sms:
+            break
         for msg in sms:
             print("Index:", msg[3])
             print("Text:", msg[0])
             print("From:", msg[1])
             print("Time:", msg[2])
             modem.delete_sms(msg[3])
-            text = msg[0].split(",")
-            ret = ""
-            for line in text:
-                line = line.split("=")
-                line[0] = line[0].lower().strip()
-                if line[0] == "erase":
-                    print('erase flash')
-                    eraseSettings()
-                    ret += "erase done"
-                    mcu_reset = True
-                if line[0] == "apn" and len(line) > 1:
-                    line[1] = line[1].replace(" ", "")
-                    apn = line[1]
-                    print("APN", apn)
-                    settings = readSettings()
-                    settings["apn"] = apn
-                    saveSettings(settings)
-                    ret += "apn " + apn + " saved,"
-                    mcu_reset = True
-                if line[0] == "email" and len(line) > 1:
-                    line[1] = line[1].replace(" ", "")
-                    email = line[1]
-                    print("email", email)
-                    settings = readSettings()
-                    settings["email"] = email
-                    saveSettings(settings)
-                    ret += "email " + email + " saved,"
-                    mcu_reset = True
-                if line[0] == "name" and len(line) > 1:
-                    name = line[1].strip()
-                    print("name", name)
-                    settings = readSettings()
-                    settings["name"] = name
-                    saveSettings(settings)
-                    ret += "name changed " + name + ","
-                    mcu_reset = True
-            if len(ret) > 0:
-                if ret[-1] == ",":
-                    ret = ret[0:-1]
-                modem.send_sms(msg[1], ret)
+            for r in parse_sms(msg[0], changes):
+                staged.append([msg[1]] + r)
+        if len(sms) < _SMS_PAGE:
+            break
+    # one reply per sender, amended for changes dropped by a later erase
+    # or replaced by a later command
+    replies = {}
+    for r in staged:
+        reply = r[1]
+        if r[2] is not None and changes.get(r[2]) != r[3]:
+            reply = r[2] + " " + r[3] + (" replaced" if r[2] in changes else " erased")
+        if r[0] not in replies:
+            replies[r[0]] = []
+        replies[r[0]].append(reply)
+    # save everything at once, restart only if something changed
+    mcu_reset = False
+    if "*erase" in changes:
+        del changes["*erase"]
+        eraseSettings()
+        mcu_reset = True
+    if has_qspi:
+        for k in changes:
+            if settings.get(k) != changes[k]:
+                settings.set(k, changes[k])
+                mcu_reset = True
+        settings.commit()
+    for sender in replies:
+        modem.send_sms(sender, ",".join(replies[sender]))
     return mcu_reset
 
 
@@ -236,16 +426,17 @@ charging = False
 
 def update_charger():
     global charging
-    if polaris.isBatteryBackup():
+    temp = accel.get_temperature()
+    if sensors.get(sensors.BATTERY_BACKUP):
         charging = False
     elif charging:
-        if accel.get_temperature() < 4 or accel.get_temperature() > 45:
+        if temp < 4 or temp > 45:
             print("Exceeding battery temperature range!")
             charging = False
         if not charging:
             print("Stop battery charging...")
     else:
-        if accel.get_temperature() >= 6 and accel.get_temperature() <= 43:
+        if temp >= 6 and temp <= 43:
             print("Good battery temperature range!")
             charging = True
         if charging:
@@ -255,13 +446,13 @@ def update_charger():
 
 
 def is_powersupply_toolow():
-    if polaris.isBatteryBackup():
-        volt = polaris.readBattVoltage()
+    if sensors.get(sensors.BATTERY_BACKUP):
+        volt = sensors.get(sensors.BATT_VOLTAGE)
         if volt < 3.45:
             print("Backup battery:", volt)
             return True
     else:
-        volt = polaris.readMainVoltage()
+        volt = sensors.get(sensors.MAIN_VOLTAGE)
         if volt < 11.2:
             print("Main battery:", volt)
             return True
@@ -269,18 +460,20 @@ def is_powersupply_toolow():
 
 
 def is_powersupply_enough():
-    if polaris.isBatteryBackup():
-        volt = polaris.readBattVoltage()
+    if sensors.get(sensors.BATTERY_BACKUP):
+        volt = sensors.get(sensors.BATT_VOLTAGE)
         if volt >= 3.6:
             return True
     else:
-        volt = polaris.readMainVoltage()
+        volt = sensors.get(sensors.MAIN_VOLTAGE)
         if volt >= 11.5:
             return True
     return False
 
 
 def start():
+    if has_qspi:
+        settings.load()
     # only proceed if power supply input level is enough
     print("Checking power supply level...")
     while not is_powersupply_enough():
@@ -292,15 +485,17 @@ def start():
     print("Starting utility thread...")
     thread(run)
     
+_SMS_FALLBACK = 600       # full SMS check period in s, in case a notification is missed
+
 def run():
-    sms_timer = 0
+    sms_timer = _SMS_FALLBACK
     while True:
         mcu_reset = False
         sleep(1000)
         sms_timer += 1
-        # parse SMS commands
+        # parse SMS commands when the modem notifies new messages
         try:
-            if check_sms and modem and (sms_timer >= 15 or modem.pending_sms() > 0):
+            if check_sms and modem and (sms_timer >= _SMS_FALLBACK or modem.pending_sms() > 0):
                 sms_timer = 0
                 mcu_reset = read_and_parse_sms()
         except Exception as e:
@@ -316,7 +511,7 @@ def run():
             if modem:
                 modem.shutdown()
             print("utils MCU reset")
-            mcu.reset()
+            reset()
 
 
 def request_apn(s):
@@ -347,14 +542,13 @@ def request_email(s):
     return email
 
 led_state = False
-led_count = 0
 
 
 def status_led(sending, ignition, connected):
-    global led_state, led_count
+    # called about once a second while not sending
+    global led_state
     if sending:
         led_state = False
-        led_count = 0
         if ignition:
             polaris.ledRedOff()
             polaris.ledGreenOff()
@@ -370,10 +564,7 @@ def status_led(sending, ignition, connected):
                 polaris.ledRedOff()
                 polaris.ledGreenOff()
         else:
-            led_count += 1
-            if led_count > 5:
-                led_state = not led_state
-                led_count = 0
+            led_state = not led_state
             if led_state:
                 polaris.ledRedOn()
             else: